@@ -2,47 +2,155 @@
 FastAPI app definition, initialization and definition of routes
 """
 
+# # Native # #
+import os
+from typing import Optional, List
+from contextlib import asynccontextmanager
+
 # # Installed # #
 import uvicorn
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, UploadFile, Body, Query, Depends, Request, Response, WebSocket
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi import status as statuscode
+from fastapi.concurrency import run_in_threadpool
 
 # # Package # #
 from .models import *
 from .exceptions import *
-from .repositories import UsersRepository, DeepFakeRepository, TherapyRepository, DoctorRepository, MusicRepository
+from .repositories import DeepFakeRepository, TherapyRepository, UsersRepository
+from .async_repositories import (
+    AsyncUsersRepository, AsyncEmotionsRepository, AsyncDoctorRepository, AsyncMusicRepository
+)
 from .middlewares import request_handler
+from .database import connect_clients, close_clients
+from .buffers import emotion_buffer
+from .passwords import password_executor
+from .classifier import emotion_classifier
+from .notes import note_processor
+from .quotes import quote_store
+from .catalog import music_catalog
+from .renders import quote_renders
+from .renderer import render_executor
+from .sessions import require_session, require_admin, check_session, get_credentials
+from .streams import stream_emotions
+from .responses import *
+from .indexes import create_indexes
+from .utils import get_time
 from .settings import api_settings as settings
+from .settings import ingest_settings, session_settings, therapy_settings
 
 __all__ = ("app", "run")
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup and shutdown of the API"""
+    # The Mongo clients are created by each process, from its running loop
+    connect_clients()
+    await run_in_threadpool(create_indexes)
+    await run_in_threadpool(emotion_classifier.load)
+    await run_in_threadpool(quote_store.load)
+    await run_in_threadpool(quote_renders.load)
+    if therapy_settings.music_recommendation_mode == "catalog":
+        await run_in_threadpool(music_catalog.load)
+    await note_processor.start()
+    if ingest_settings.buffered:
+        emotion_buffer.start()
+    yield
+    # Write the emotions still on the buffer, and classify the notes pending, before exiting
+    await run_in_threadpool(emotion_buffer.stop)
+    await note_processor.stop()
+    await run_in_threadpool(password_executor.shutdown)
+    await run_in_threadpool(render_executor.shutdown)
+    close_clients()
+
+
 app = FastAPI(
-    title=settings.title
+    title=settings.title,
+    lifespan=lifespan
 )
 app.middleware("http")(request_handler)
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+SESSION_EXCEPTIONS = (InvalidSessionException, SessionForbiddenException)
+"""Errors of the routes that require the session token of the user (require_session dependency)"""
+
+
+def _fields_query(fields: Optional[str] = Query(
+    None,
+    description="Comma separated list of fields to return (the id is always returned). All the fields by default",
+    example="name,current_emotion"
+)) -> Optional[List[str]]:
+    """Dependency that parses the fields query parameter, used for sparse fieldsets"""
+    if fields:
+        return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def _wants_ndjson(request: Request) -> bool:
+    """Whether the client requested the list as a stream of newline delimited JSON (NDJSON)"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+class _Page:
+    """Dependency with the keyset pagination query parameters of the list endpoints"""
+    def __init__(
+        self,
+        limit: int = Query(
+            settings.page_size, ge=1, le=settings.max_page_size,
+            description="Max number of items to return"
+        ),
+        after: Optional[str] = Query(
+            None,
+            description=f"Return the items after this one. Use the {NEXT_CURSOR_HEADER} header of the previous page"
+        )
+    ):
+        self.limit = limit
+        self.after = after
+
+    def set_next(self, response: Response, items: list, id_field: str):
+        """Set the cursor of the next page on the response header, if the page is complete"""
+        if len(items) == self.limit:
+            response.headers[NEXT_CURSOR_HEADER] = getattr(items[-1], id_field)
+
 
 @app.get(
     "/users",
     response_model=UsersRead,
-    description="List all the available users",
+    description=f"List the available users, sorted by their id. "
+                f"If there are more users, the cursor of the next page is returned on the {NEXT_CURSOR_HEADER} header. "
+                f"With the Accept: {NDJSON_MEDIA_TYPE} header, all the users (after the given one) are streamed as NDJSON. "
+                f"Requires the admin token",
+    responses=get_exception_responses(InvalidFieldsException, InvalidSessionException, AdminForbiddenException),
+    dependencies=[Depends(require_admin)],
     tags=["Users"]
 )
-def _list_users():
+async def _list_users(
+    request: Request,
+    fields: Optional[List[str]] = Depends(_fields_query),
+    page: _Page = Depends()
+):
     # TODO Filters
-    return UsersRepository.list()
+    if _wants_ndjson(request):
+        return ndjson_response(AsyncUsersRepository.stream(fields, after=page.after), partial=bool(fields))
+
+    users = await AsyncUsersRepository.list(fields, limit=page.limit, after=page.after)
+    response = PartialReadResponse(users) if fields else ReadResponse(users)
+    page.set_next(response, users, "user_id")
+    return response
 
 
 @app.get(
     "/users/{user_id}",
     response_model=UserRead,
     description="Get a single user by its unique ID",
-    responses=get_exception_responses(UserNotFoundException),
+    responses=get_exception_responses(UserNotFoundException, InvalidFieldsException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Users"]
 )
-def _get_user(user_id: str):
-    return UsersRepository.get(user_id)
+async def _get_user(user_id: str, fields: Optional[List[str]] = Depends(_fields_query)):
+    if fields:
+        return PartialReadResponse(await AsyncUsersRepository.get(user_id, fields))
+    return ReadResponse(await AsyncUsersRepository.get(user_id))
 
 
 @app.post(
@@ -50,63 +158,142 @@ def _get_user(user_id: str):
     description="Create a new user",
     response_model=UserRead,
     status_code=statuscode.HTTP_201_CREATED,
-    responses=get_exception_responses(UserAlreadyExistsException),
+    responses=get_exception_responses(UserAlreadyExistsException, PasswordServiceBusyException),
     tags=["Users"]
 )
-def _create_user(create: UserCreate):
-    return UsersRepository.create(create)
+async def _create_user(create: UserCreate):
+    return ReadResponse(await AsyncUsersRepository.create(create), status_code=statuscode.HTTP_201_CREATED)
 
 @app.post(
     "/users/login",
-    description="Login into system",
-    responses=get_exception_responses(UserNotFoundException),
+    description="Login into system. Returns a session token, required by the routes of the user "
+                "(as Authorization: Bearer <token> header) until it expires",
+    responses=get_exception_responses(UserNotFoundException, PasswordServiceBusyException),
     tags=["Users"]
 )
-def _login_user(email: str, password: str):
-    return UsersRepository.login(email,password)
+async def _login_user(email: str, password: str):
+    return await AsyncUsersRepository.login(email,password)
 
 @app.patch(
     "/users/{user_id}",
     description="Update a single user by its unique ID, providing the fields to update",
     status_code=statuscode.HTTP_204_NO_CONTENT,
-    responses=get_exception_responses(UserNotFoundException, UserAlreadyExistsException),
+    responses=get_exception_responses(UserNotFoundException, UserAlreadyExistsException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Users"]
 )
-def _update_user(user_id: str, update: UserUpdate):
-    UsersRepository.update(user_id, update)
+async def _update_user(user_id: str, update: UserUpdate):
+    await AsyncUsersRepository.update(user_id, update)
 
 
 @app.delete(
     "/users/{user_id}",
     description="Delete a single user by its unique ID",
     status_code=statuscode.HTTP_204_NO_CONTENT,
-    responses=get_exception_responses(UserNotFoundException),
+    responses=get_exception_responses(UserNotFoundException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Users"]
 )
-def _delete_user(user_id: str):
-    UsersRepository.delete(user_id)
+async def _delete_user(user_id: str):
+    await AsyncUsersRepository.delete(user_id)
 
 @app.post(
     "/users/add-profile-pic",
     response_model=UserRead,
-    description="Add Profile Pic",
+    description="Add Profile Pic. The picture is named after the user, so the user must have a name",
+    responses=get_exception_responses(UserNotFoundException, UserFieldRequiredException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Users"]
 )
-def _add_profile_pic(user_id: str, picture: UploadFile = File(...)):
-    return UsersRepository.add_profile_pic(picture, user_id)
+async def _add_profile_pic(user_id: str, picture: UploadFile = File(...)):
+    return ReadResponse(await AsyncUsersRepository.add_profile_pic(picture, user_id))
 
 @app.post(
     "/users/update-emotion",
     response_model=UserRead,
-    description="Update current Emotion of User",
+    description="Update current Emotion of User. "
+                "When buffered ingestion is enabled, the emotion is written later and 202 is returned without body. "
+                "Unless sent by a device (device=true, with the device id as user_id), requires the session of the user",
+    responses={
+        statuscode.HTTP_202_ACCEPTED: {"description": "The emotion was buffered"},
+        **get_exception_responses(UserNotFoundException, *SESSION_EXCEPTIONS)
+    },
     tags=["Users"]
 )
-def _update_emotion(user_id: str, emotion: str, device: str):
-    return UsersRepository.update_emotion(user_id, emotion, True if device == "true" else False)
+async def _update_emotion(
+    user_id: str, emotion: str, device: str,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(get_credentials)
+):
+    device = True if device == "true" else False
+    if not device:
+        check_session(user_id, credentials)
+    if ingest_settings.buffered:
+        # Adding to the buffer can write it right away (if full), so it runs on a thread
+        await run_in_threadpool(emotion_buffer.add, EmotionEvent.construct(
+            user_id=None if device else user_id,
+            device_id=user_id if device else None,
+            emotion=emotion,
+            captured=get_time()
+        ))
+        return Response(status_code=statuscode.HTTP_202_ACCEPTED)
+    return ReadResponse(await AsyncUsersRepository.update_emotion(user_id, emotion, device))
+
+@app.post(
+    "/users/emotions:batch",
+    response_model=EmotionEventsStatus,
+    description="Apply many captured emotions, of many users or devices, at once. "
+                "Returns the status of each event, in the same order they were sent. "
+                "The events of a user (by user_id) require the session of that user; those of devices do not",
+    responses=get_exception_responses(*SESSION_EXCEPTIONS),
+    tags=["Users"]
+)
+async def _update_emotions(
+    events: List[EmotionEvent] = Body(..., max_items=settings.emotions_batch_size),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(get_credentials)
+):
+    for user_id in {event.user_id for event in events if event.user_id}:
+        check_session(user_id, credentials)
+    return await AsyncUsersRepository.update_emotions(events)
+
+@app.websocket("/users/emotions/stream")
+async def _stream_emotions(websocket: WebSocket, device_id: str):
+    """Stream of emotions captured by an Emoup Device. The device is resolved once, when connecting"""
+    try:
+        user_id = await AsyncUsersRepository.get_device_user_id(device_id)
+    except UserNotFoundException:
+        await websocket.close(code=statuscode.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    await stream_emotions(websocket, user_id)
+
+@app.get(
+    "/users/{user_id}/emotions",
+    response_model=EmotionsRead,
+    description="List the emotion states of a user, optionally captured between the start and end Unix timestamps",
+    responses=get_exception_responses(*SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
+    tags=["Users"]
+)
+async def _list_emotions(user_id: str, start: Optional[int] = None, end: Optional[int] = None):
+    return await AsyncEmotionsRepository.list(user_id, start, end)
+
+@app.get(
+    "/users/{user_id}/notes",
+    response_model=NotesRead,
+    description="List the notes of a user, optionally captured between the start and end Unix timestamps",
+    responses=get_exception_responses(*SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
+    tags=["Users"]
+)
+async def _list_notes(user_id: str, start: Optional[int] = None, end: Optional[int] = None):
+    return ReadResponse(await AsyncUsersRepository.list_notes(user_id, start, end))
 
 @app.get(
     "/users/emotion-analysis/{user_id}",
     description="Get Emotion Analysis of User",
+    responses=get_exception_responses(*SESSION_EXCEPTIONS, RenderServiceBusyException),
+    dependencies=[Depends(require_session)],
     tags=["Users"]
 )
 def _emotion_analysis(user_id: str):
@@ -115,40 +302,67 @@ def _emotion_analysis(user_id: str):
 @app.post(
     "/users/add-note",
     response_model=UserRead,
-    description="Add Note of User",
+    description="Add Note of User. The note is returned as pending, and its emotions are classified in background: "
+                "the note status changes to classified (or failed) when the emotions of the user are updated",
+    responses=get_exception_responses(*SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
+    tags=["Users"]
+)
+async def _add_note(user_id: str, note: Note):
+    read = await AsyncUsersRepository.add_note(user_id, note)
+    await note_processor.add(user_id)
+    return ReadResponse(read)
+
+@app.post(
+    "/users/notes:classify",
+    response_model=NoteClassifications,
+    description="Classify the emotions of many note texts at once (e.g. for backfills), in the same order they were sent. "
+                "Nothing is stored",
     tags=["Users"]
 )
-def _add_note(user_id: str, note: Note):
-    return UsersRepository.add_note(user_id, note)
+async def _classify_notes(texts: List[str] = Body(..., max_items=settings.notes_batch_size)):
+    scores = await run_in_threadpool(emotion_classifier.score_many, texts)
+    return [
+        NoteClassification.construct(scores=text_scores, emotions=emotion_classifier.get_emotions(text_scores))
+        for text_scores in scores
+    ]
   
 @app.post(
     "/deep-fake/picture",
     description="Add DeepFake Pic",
+    responses=get_exception_responses(UserNotFoundException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Deep Fake"]
 )
 def _add_deepfake_pic(user_id: str, name: str, picture: UploadFile = File(...)):
-    return DeepFakeRepository.add_deepfake_pic(picture, name, user_id)
+    return ReadResponse(DeepFakeRepository.add_deepfake_pic(picture, name, user_id))
 
 @app.post(
     "/deep-fake/audio",
-    description="Add DeepFake Audio",
+    description="Add DeepFake Audio. The audio is named after the deepfake picture, so it must be added first",
+    responses=get_exception_responses(UserNotFoundException, UserFieldRequiredException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Deep Fake"]
 )
 def _add_deepfake_audio(user_id: str, audio: UploadFile = File(...)):
-    return DeepFakeRepository.add_deepfake_audio(audio, user_id)
+    return ReadResponse(DeepFakeRepository.add_deepfake_audio(audio, user_id))
 
 @app.get(
     "/deep-fake/result/{user_id}",
     response_model=UsersRead,
     description="Add DeepFake",
+    responses=get_exception_responses(UserNotFoundException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Deep Fake"]
 )
 def _deepfake(user_id: str):
-    return DeepFakeRepository.deepfake(user_id)
+    return ReadResponse(DeepFakeRepository.deepfake(user_id))
 
 @app.get(
     "/therapies/music-recommendation/{user_id}",
     description="Give Music recommendations based on emotions",
+    responses=get_exception_responses(UserNotFoundException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Therapies"]
 )
 def _music_recommendation(user_id: str):
@@ -157,6 +371,8 @@ def _music_recommendation(user_id: str):
 @app.get(
     "/therapies/inspiration/{user_id}",
     description="Give Inspiration quotes",
+    responses=get_exception_responses(RenderServiceBusyException, *SESSION_EXCEPTIONS),
+    dependencies=[Depends(require_session)],
     tags=["Therapies"]
 )
 def _inspiration_therapy(user_id: str):
@@ -165,12 +381,20 @@ def _inspiration_therapy(user_id: str):
 @app.get(
     "/doctors",
     response_model=DoctorsRead,
-    description="List all the available doctors",
+    description=f"List the available doctors, sorted by their id. "
+                f"If there are more doctors, the cursor of the next page is returned on the {NEXT_CURSOR_HEADER} header. "
+                f"With the Accept: {NDJSON_MEDIA_TYPE} header, all the doctors (after the given one) are streamed as NDJSON",
     tags=["Doctors"]
 )
-def _list_doctors():
+async def _list_doctors(request: Request, page: _Page = Depends()):
     # TODO Filters
-    return DoctorRepository.list()
+    if _wants_ndjson(request):
+        return ndjson_response(AsyncDoctorRepository.stream(after=page.after))
+
+    doctors = await AsyncDoctorRepository.list(limit=page.limit, after=page.after)
+    response = ReadResponse(doctors)
+    page.set_next(response, doctors, "doctor_id")
+    return response
 
 
 @app.get(
@@ -180,8 +404,8 @@ def _list_doctors():
     responses=get_exception_responses(DoctorNotFoundException),
     tags=["Doctors"]
 )
-def _get_doctor(doctor_id: str):
-    return DoctorRepository.get(doctor_id)
+async def _get_doctor(doctor_id: str):
+    return ReadResponse(await AsyncDoctorRepository.get(doctor_id))
 
 
 @app.post(
@@ -192,8 +416,8 @@ def _get_doctor(doctor_id: str):
     responses=get_exception_responses(DoctorAlreadyExistsException),
     tags=["Doctors"]
 )
-def _create_doctor(create: DoctorCreate):
-    return DoctorRepository.create(create)
+async def _create_doctor(create: DoctorCreate):
+    return ReadResponse(await AsyncDoctorRepository.create(create), status_code=statuscode.HTTP_201_CREATED)
 
 @app.patch(
     "/doctors/{doctor_id}",
@@ -202,8 +426,8 @@ def _create_doctor(create: DoctorCreate):
     responses=get_exception_responses(DoctorNotFoundException, DoctorAlreadyExistsException),
     tags=["Doctors"]
 )
-def _update_doctor(doctor_id: str, update: DoctorUpdate):
-    DoctorRepository.update(doctor_id, update)
+async def _update_doctor(doctor_id: str, update: DoctorUpdate):
+    await AsyncDoctorRepository.update(doctor_id, update)
 
 
 @app.delete(
@@ -213,8 +437,8 @@ def _update_doctor(doctor_id: str, update: DoctorUpdate):
     responses=get_exception_responses(DoctorNotFoundException),
     tags=["Doctors"]
 )
-def _delete_doctor(doctor_id: str):
-    DoctorRepository.delete(doctor_id)
+async def _delete_doctor(doctor_id: str):
+    await AsyncDoctorRepository.delete(doctor_id)
 
 @app.post(
     "/doctors/add-profile-pic",
@@ -222,18 +446,26 @@ def _delete_doctor(doctor_id: str):
     description="Add Profile Pic",
     tags=["Doctors"]
 )
-def _add_profile_pic(doctor_id: str, picture: UploadFile = File(...)):
-    return DoctorRepository.add_profile_pic(picture, doctor_id)
+async def _add_profile_pic(doctor_id: str, picture: UploadFile = File(...)):
+    return ReadResponse(await AsyncDoctorRepository.add_profile_pic(picture, doctor_id))
 
 @app.get(
     "/musics",
     response_model=MusicsRead,
-    description="List all the available musics",
+    description=f"List the available musics, sorted by their id. "
+                f"If there are more musics, the cursor of the next page is returned on the {NEXT_CURSOR_HEADER} header. "
+                f"With the Accept: {NDJSON_MEDIA_TYPE} header, all the musics (after the given one) are streamed as NDJSON",
     tags=["Musics"]
 )
-def _list_musics():
+async def _list_musics(request: Request, page: _Page = Depends()):
     # TODO Filters
-    return MusicRepository.list()
+    if _wants_ndjson(request):
+        return ndjson_response(AsyncMusicRepository.stream(after=page.after))
+
+    musics = await AsyncMusicRepository.list(limit=page.limit, after=page.after)
+    response = ReadResponse(musics)
+    page.set_next(response, musics, "music_id")
+    return response
 
 
 @app.get(
@@ -243,8 +475,8 @@ def _list_musics():
     responses=get_exception_responses(MusicNotFoundException),
     tags=["Musics"]
 )
-def _get_music(music_id: str):
-    return MusicRepository.get(music_id)
+async def _get_music(music_id: str):
+    return ReadResponse(await AsyncMusicRepository.get(music_id))
 
 
 @app.post(
@@ -255,8 +487,8 @@ def _get_music(music_id: str):
     responses=get_exception_responses(MusicAlreadyExistsException),
     tags=["Musics"]
 )
-def _create_music(create: MusicCreate):
-    return MusicRepository.create(create)
+async def _create_music(create: MusicCreate):
+    return ReadResponse(await AsyncMusicRepository.create(create), status_code=statuscode.HTTP_201_CREATED)
 
 @app.patch(
     "/musics/{music_id}",
@@ -265,8 +497,8 @@ def _create_music(create: MusicCreate):
     responses=get_exception_responses(MusicNotFoundException, MusicAlreadyExistsException),
     tags=["Musics"]
 )
-def _update_music(music_id: str, update: MusicUpdate):
-    MusicRepository.update(music_id, update)
+async def _update_music(music_id: str, update: MusicUpdate):
+    await AsyncMusicRepository.update(music_id, update)
 
 
 @app.delete(
@@ -276,14 +508,36 @@ def _update_music(music_id: str, update: MusicUpdate):
     responses=get_exception_responses(MusicNotFoundException),
     tags=["Musics"]
 )
-def _delete_music(music_id: str):
-    MusicRepository.delete(music_id)
+async def _delete_music(music_id: str):
+    await AsyncMusicRepository.delete(music_id)
+
+
+@app.get(
+    "/metrics/renders",
+    description="Metrics of the image renders of this worker process. "
+                "Executor: renders pending (queue depth), rendered and failed, and latency of the last renders. "
+                "Quotes: hits, misses and hit rate of the cache of rendered quote images, images evicted, "
+                "and images and bytes cached",
+    tags=["Metrics"]
+)
+async def _render_metrics():
+    return {"executor": render_executor.stats(), "quotes": quote_renders.stats()}
 
 def run():
-    """Run the API using Uvicorn"""
+    """Run the API using Uvicorn. With more than one worker, each worker process imports the app by itself
+    (so the Mongo clients, buffers and settings are never shared between processes)"""
+    if settings.workers > 1:
+        # All the workers must sign the session tokens with the same secret (random if not set)
+        os.environ["SESSION_SECRET"] = session_settings.secret
+
     uvicorn.run(
-        app,
+        f"{__name__}:app" if settings.workers > 1 else app,
         host=settings.host,
         port=settings.port,
-        log_level=settings.log_level.lower()
+        log_level=settings.log_level.lower(),
+        workers=settings.workers,
+        loop=settings.loop,
+        http=settings.http,
+        timeout_keep_alive=settings.keep_alive,
+        backlog=settings.backlog
     )
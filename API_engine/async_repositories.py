@@ -0,0 +1,474 @@
+"""ASYNC REPOSITORIES
+Async (Motor) versions of the repositories used by the API routes, so the requests do not hold a thread
+while they wait for Mongo. The queries and updates are the same as on the sync repositories (repositories.py),
+which are kept for the maintenance commands and the background workers
+"""
+
+# # Installed # #
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from fastapi.concurrency import run_in_threadpool
+
+# # Package # #
+from .models import *
+from .exceptions import *
+from .passwords import password_executor
+from .classifier import emotion_classifier
+from .catalog import music_catalog
+from .sessions import create_token
+from .database import get_async_collection
+from .repositories import UsersRepository, EmotionsRepository, NoteWordsRepository, find_page
+from .utils import get_time, get_uuid, get_iso_week
+from .settings import server_settings as settings
+from .settings import api_settings, mongo_settings
+
+# # Native # #
+import os
+import shutil
+from typing import List, AsyncIterator
+
+__all__ = (
+    "AsyncUsersRepository", "AsyncEmotionsRepository", "AsyncNoteWordsRepository",
+    "AsyncDoctorRepository", "AsyncMusicRepository"
+)
+
+
+def save_upload(upload, folder_path: str, filename: str):
+    """Save an uploaded file on the given folder (created if it does not exist). Blocking, run it on a thread"""
+    if not os.path.isdir(folder_path):
+        os.mkdir(folder_path)
+
+    with open(folder_path + filename, "wb") as buffer:
+        shutil.copyfileobj(upload.file, buffer)
+
+
+class AsyncUsersRepository:
+    @staticmethod
+    async def get(user_id: str, fields: List[str] = None) -> UserRead:
+        """Retrieve a single User by its unique id. If fields are given, only those fields are read"""
+        projection = UsersRepository.get_projection(fields) if fields else UsersRepository.READ_PROJECTION
+        document = await get_async_collection(mongo_settings.users).find_one({"_id": user_id}, projection)
+        if not document:
+            raise UserNotFoundException(user_id)
+        if fields:
+            return UsersRepository.get_partial(document, fields)
+        return UserRead.from_document(document)
+
+    @staticmethod
+    async def login(email: str, password: str):
+        """Verify the password of a User, given its email, and issue a session token"""
+        document = await get_async_collection(mongo_settings.users).find_one({"email": email})
+        if not document:
+            raise UserNotFoundException(email)
+        if not await password_executor.check_async(password, document['password']):
+            raise InvalidUserPasswordException(email)
+
+        token, expires = create_token(document["_id"])
+        return {
+            "status": True,
+            "_id": document["_id"],
+            "email": document["email"],
+            "token": token,
+            "expires": expires
+            }
+
+    @staticmethod
+    async def list(fields: List[str] = None, limit: int = None, after: str = None) -> UsersRead:
+        """Retrieve the available users, sorted by their id. If fields are given, only those fields are read.
+        If limit is given, only that number of users are returned, starting after the given user id"""
+        users = get_async_collection(mongo_settings.users)
+        if fields:
+            cursor = find_page(users, UsersRepository.get_projection(fields), limit, after)
+            return [UsersRepository.get_partial(document, fields) async for document in cursor]
+        cursor = find_page(users, UsersRepository.READ_PROJECTION, limit, after)
+        return [UserRead.from_document(document) async for document in cursor]
+
+    @staticmethod
+    def stream(fields: List[str] = None, after: str = None) -> AsyncIterator[UserRead]:
+        """Iterate all the users, sorted by their id, starting after the given user id, reading them in batches.
+        If fields are given, only those fields are read. The fields are validated when called (not when iterated),
+        so an InvalidFieldsException is raised before a streamed response starts"""
+        projection = UsersRepository.get_projection(fields) if fields else UsersRepository.READ_PROJECTION
+        cursor = find_page(get_async_collection(mongo_settings.users), projection, after=after)
+        return AsyncUsersRepository._read_users(cursor.batch_size(api_settings.export_batch_size), fields)
+
+    @staticmethod
+    async def _read_users(cursor, fields: List[str] = None) -> AsyncIterator[UserRead]:
+        async for document in cursor:
+            yield UsersRepository.get_partial(document, fields) if fields else UserRead.from_document(document)
+
+    @staticmethod
+    async def create(create: UserCreate) -> UserRead:
+        """Create a user and return its Read object"""
+        document = create.dict()
+        document["created"] = document["updated"] = get_time()
+        document["_id"] = get_uuid()
+        if document.get("notes"):
+            UsersRepository.set_captured_at(document["notes"])
+        document["password"] = await password_executor.hash_async(document["password"])
+
+        try:
+            result = await get_async_collection(mongo_settings.users).insert_one(document)
+        except DuplicateKeyError:
+            raise UserAlreadyExistsException(identifier=document["email"])
+        assert result.acknowledged
+
+        if document.get("notes"):
+            await AsyncNoteWordsRepository.push_many([{**note, "user_id": document["_id"]} for note in document["notes"]])
+        return UserRead.from_document(document)
+
+    @staticmethod
+    async def update(user_id: str, update: UserUpdate):
+        """Update a user by giving only the fields to update"""
+        document = update.dict()
+        document["updated"] = get_time()
+        if "notes" in document:
+            UsersRepository.set_captured_at(document["notes"])
+
+        result = await get_async_collection(mongo_settings.users).update_one({"_id": user_id}, {"$set": document})
+        if not result.modified_count:
+            raise UserNotFoundException(identifier=user_id)
+        if "notes" in document:
+            await AsyncNoteWordsRepository.rebuild(user_id, document["notes"])
+
+    @staticmethod
+    async def update_emotion(id: str, emotion: str, device: bool = False) -> UserRead:
+        """Update a user's emotion"""
+        updated = get_time()
+
+        document = await get_async_collection(mongo_settings.users).find_one_and_update(
+            {"device_id" if device else "_id": id},
+            {"$set": {
+                "current_emotion" : emotion.lower(),
+                "updated": updated
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            raise UserNotFoundException(identifier=id)
+
+        await AsyncEmotionsRepository.push_many([
+            {"user_id": document["_id"], "emotion": emotion.lower(), "captured": updated}
+        ])
+
+        return UserRead.from_document(document)
+
+    @staticmethod
+    async def update_emotions(events: List[EmotionEvent]) -> List[dict]:
+        """Apply many emotion events, of many users or devices, at once (see UsersRepository.update_emotions).
+        Returns the status of each event, in the same order"""
+        cursor = get_async_collection(mongo_settings.users).find(
+            UsersRepository.get_events_query(events),
+            {"_id": 1, "device_id": 1}
+        )
+        statuses, states = UsersRepository.resolve_events(events, await cursor.to_list(length=None))
+        await AsyncUsersRepository.apply_emotions(states)
+        return statuses
+
+    @staticmethod
+    async def apply_emotions(states: List[dict]):
+        """Write many emotion states (dicts with user_id, emotion and captured) of existing users
+        (see UsersRepository.apply_emotions)"""
+        operations = UsersRepository.get_emotions_operations(states)
+        if not operations:
+            return
+
+        await get_async_collection(mongo_settings.users).bulk_write(operations, ordered=False)
+        await AsyncEmotionsRepository.push_many(states)
+
+    @staticmethod
+    async def get_device_user_id(device_id: str) -> str:
+        """Retrieve the unique id of the User an Emoup Device belongs to"""
+        document = await get_async_collection(mongo_settings.users).find_one({"device_id": device_id}, {"_id": 1})
+        if not document:
+            raise UserNotFoundException(device_id)
+        return document["_id"]
+
+    @staticmethod
+    async def add_note(user_id: str, note: Note) -> UserRead:
+        """Add a note to a user. The note is stored as pending, to be classified by the note processor (notes.py)"""
+        document = await get_async_collection(mongo_settings.users).find_one_and_update(
+            {"_id": user_id},
+            {
+                "$push": {"notes": UsersRepository.get_note_document(note.dict(), "pending")},
+                "$set": {"updated": get_time()}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            raise UserNotFoundException(identifier=user_id)
+
+        return UserRead.from_document(document)
+
+    @staticmethod
+    async def list_notes(user_id: str, start: int = None, end: int = None) -> NotesRead:
+        """Retrieve the notes of a user, captured between start and end (both optional and inclusive)"""
+        cursor = get_async_collection(mongo_settings.users).aggregate(
+            UsersRepository.get_notes_pipeline(user_id, start, end)
+        )
+        documents = await cursor.to_list(length=None)
+        if not documents:
+            raise UserNotFoundException(user_id)
+        return [NoteRead.construct_trusted(note) for note in documents[0]["notes"]]
+
+    @staticmethod
+    async def process_notes(user_ids: List[str]):
+        """Classify the pending notes of the given users, in a single batch, and write their emotions
+        (status and emotions of each note, current emotion of each user and emotion states) with a single bulk write,
+        and their words (see NoteWordsRepository). The notes are claimed first, so the notes processed by another
+        batch (of this or another process) are skipped, and their emotions and words are never written twice.
+        If the notes cannot be classified, they are marked as failed and the error is raised"""
+        users = get_async_collection(mongo_settings.users)
+        claim_id = get_uuid()
+        update, array_filters = UsersRepository.get_claim_update(claim_id, get_time())
+        result = await users.update_many(
+            {"_id": {"$in": user_ids}, "notes.status": "pending"}, update, array_filters=array_filters
+        )
+        if not result.modified_count:
+            return
+
+        cursor = users.find({"_id": {"$in": user_ids}, "notes.claim_id": claim_id}, {"notes": 1})
+        notes = UsersRepository.get_claimed_notes(await cursor.to_list(length=None), claim_id)
+        if not notes:
+            return
+
+        emotions = None
+        try:
+            scores = await run_in_threadpool(emotion_classifier.score_many, [note["note"] for note in notes])
+            emotions = [emotion_classifier.get_emotions(note_scores) for note_scores in scores]
+        finally:
+            operations, states = UsersRepository.get_notes_operations(notes, claim_id, emotions)
+            await users.bulk_write(operations, ordered=False)
+            await AsyncEmotionsRepository.push_many(states)
+            # Counted once the notes are not pending anymore, so a crash never counts their words twice
+            await AsyncNoteWordsRepository.push_many(notes)
+
+    @staticmethod
+    async def release_notes(claimed_before: int) -> int:
+        """Set as pending again the notes claimed to be processed before the given time, that were never processed
+        (e.g. the process was stopped while processing them). Returns the number of users with released notes"""
+        query, update, array_filters = UsersRepository.get_release_update(claimed_before)
+        result = await get_async_collection(mongo_settings.users).update_many(
+            query, update, array_filters=array_filters
+        )
+        return result.modified_count
+
+    @staticmethod
+    async def get_pending_notes_user_ids() -> List[str]:
+        """Retrieve the unique ids of the users with notes pending to be processed"""
+        return await get_async_collection(mongo_settings.users).distinct("_id", {"notes.status": "pending"})
+
+    @staticmethod
+    async def delete(user_id: str):
+        """Delete a user given its unique id, with its emotion buckets, weekly counters and word frequencies"""
+        result = await get_async_collection(mongo_settings.users).delete_one({"_id": user_id})
+        if not result.deleted_count:
+            raise UserNotFoundException(identifier=user_id)
+
+        for collection in (mongo_settings.emotions, mongo_settings.emotion_weeks, mongo_settings.note_words):
+            await get_async_collection(collection).delete_many({"user_id": user_id})
+
+    @staticmethod
+    async def add_profile_pic(picture, user_id: str) -> UserRead:
+        """Profile Picture uploaded by user"""
+        extension = picture.filename.split('.')[-1]
+
+        # The file is named after the user, so the URL is built on the update itself (pipeline update)
+        users = get_async_collection(mongo_settings.users)
+        document = await users.find_one_and_update(
+            {"_id": user_id, "name": {"$exists": True}},
+            [{"$set": {
+                "profile_pic": {"$concat": [settings.ftp_server + user_id + "/", "$name", "." + extension]},
+                "updated": get_time()
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            # The user does not exist, or has no name to name the picture after (see UsersRepository.raise_not_updated)
+            if not await users.count_documents({"_id": user_id}, limit=1):
+                raise UserNotFoundException(user_id)
+            raise UserFieldRequiredException(identifier="name")
+
+        await run_in_threadpool(save_upload, picture, "Uploads/" + user_id + "/", document['name'] + '.' + extension)
+        return UserRead.from_document(document)
+
+
+class AsyncEmotionsRepository:
+    """Emotion states of the users, stored on fixed-size time buckets (see EmotionsRepository)"""
+
+    @staticmethod
+    async def push_many(states: List[dict]):
+        """Append many emotion states (dicts with user_id, emotion and captured) to their buckets and weekly counters,
+        using a single bulk write per collection"""
+        bucket_operations, week_operations = EmotionsRepository.get_push_operations(states)
+        if not bucket_operations:
+            return
+
+        await get_async_collection(mongo_settings.emotions).bulk_write(bucket_operations, ordered=False)
+        await get_async_collection(mongo_settings.emotion_weeks).bulk_write(week_operations, ordered=False)
+
+    @staticmethod
+    async def count(user_id: str, week: str = None) -> dict:
+        """Retrieve how many times each emotion was captured for a user on an ISO week (current week by default)"""
+        document = await get_async_collection(mongo_settings.emotion_weeks).find_one(
+            {"_id": EmotionsRepository.get_week_id(user_id, week or get_iso_week())},
+            {"counts": 1}
+        )
+        return document["counts"] if document else {}
+
+    @staticmethod
+    async def list(user_id: str, start: int = None, end: int = None) -> List[Emotion]:
+        """Retrieve the emotion states of a user, captured between start and end (both optional and inclusive),
+        sorted from oldest to newest. Only the buckets that overlap the interval are read"""
+        cursor = get_async_collection(mongo_settings.emotions).find(
+            EmotionsRepository.get_list_query(user_id, start, end)
+        ).sort("day", ASCENDING)
+        return EmotionsRepository.get_states(await cursor.to_list(length=None), start, end)
+
+
+class AsyncNoteWordsRepository:
+    """Weekly frequencies of the words of the notes of the users (see NoteWordsRepository)"""
+
+    @staticmethod
+    async def push_many(notes: List[dict]):
+        """Add the words of many notes (dicts with user_id, note and captured_at) to their weekly frequencies,
+        using a single bulk write. The words are counted on a thread"""
+        operations = await run_in_threadpool(NoteWordsRepository.get_push_operations, notes)
+        if operations:
+            await get_async_collection(mongo_settings.note_words).bulk_write(operations, ordered=False)
+
+    @staticmethod
+    async def rebuild(user_id: str, notes: List[dict]):
+        """Rebuild the weekly word frequencies of a user from all its notes (e.g. when the notes are replaced),
+        with a single bulk write (see NoteWordsRepository.get_rebuild_operations). The words are counted on a thread"""
+        operations = await run_in_threadpool(NoteWordsRepository.get_rebuild_operations, user_id, notes)
+        await get_async_collection(mongo_settings.note_words).bulk_write(operations, ordered=False)
+
+
+class AsyncDoctorRepository:
+    @staticmethod
+    async def get(doctor_id: str) -> DoctorRead:
+        """Retrieve a single Doctor by its unique id"""
+        document = await get_async_collection(mongo_settings.doctors).find_one({"_id": doctor_id})
+        if not document:
+            raise DoctorNotFoundException(doctor_id)
+        return DoctorRead.from_document(document)
+
+    @staticmethod
+    async def list(limit: int = None, after: str = None) -> DoctorsRead:
+        """Retrieve the available doctors, sorted by their id.
+        If limit is given, only that number of doctors are returned, starting after the given doctor id"""
+        cursor = find_page(get_async_collection(mongo_settings.doctors), limit=limit, after=after)
+        return [DoctorRead.from_document(document) async for document in cursor]
+
+    @staticmethod
+    async def stream(after: str = None) -> AsyncIterator[DoctorRead]:
+        """Iterate all the doctors, sorted by their id, starting after the given doctor id, reading them in batches"""
+        cursor = find_page(get_async_collection(mongo_settings.doctors), after=after)
+        async for document in cursor.batch_size(api_settings.export_batch_size):
+            yield DoctorRead.from_document(document)
+
+    @staticmethod
+    async def create(create: DoctorCreate) -> DoctorRead:
+        """Create a doctor and return its Read object"""
+        document = create.dict()
+        document["created"] = document["updated"] = get_time()
+        document["_id"] = get_uuid()
+
+        result = await get_async_collection(mongo_settings.doctors).insert_one(document)
+        assert result.acknowledged
+
+        return DoctorRead.from_document(document)
+
+    @staticmethod
+    async def update(doctor_id: str, update: DoctorUpdate):
+        """Update a doctor by giving only the fields to update"""
+        document = update.dict()
+        document["updated"] = get_time()
+
+        result = await get_async_collection(mongo_settings.doctors).update_one({"_id": doctor_id}, {"$set": document})
+        if not result.modified_count:
+            raise DoctorNotFoundException(identifier=doctor_id)
+
+    @staticmethod
+    async def delete(doctor_id: str):
+        """Delete a doctor given its unique id"""
+        result = await get_async_collection(mongo_settings.doctors).delete_one({"_id": doctor_id})
+        if not result.deleted_count:
+            raise DoctorNotFoundException(identifier=doctor_id)
+
+    @staticmethod
+    async def add_profile_pic(picture, doctor_id: str) -> DoctorRead:
+        """Profile Picture uploaded by doctor"""
+        extension = picture.filename.split('.')[-1]
+
+        # The file is named after the doctor, so the URL is built on the update itself (pipeline update)
+        document = await get_async_collection(mongo_settings.doctors).find_one_and_update(
+            {"_id": doctor_id},
+            [{"$set": {
+                "profile_pic": {"$concat": [settings.ftp_server + doctor_id + "/", "$name", "." + extension]},
+                "updated": get_time()
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            raise DoctorNotFoundException(doctor_id)
+
+        await run_in_threadpool(save_upload, picture, "Uploads/" + doctor_id + "/", document['name'] + '.' + extension)
+        return DoctorRead.from_document(document)
+
+
+class AsyncMusicRepository:
+    @staticmethod
+    async def get(music_id: str) -> MusicRead:
+        """Retrieve a single Music by its unique id"""
+        document = await get_async_collection(mongo_settings.musics).find_one({"_id": music_id})
+        if not document:
+            raise MusicNotFoundException(music_id)
+        return MusicRead.from_document(document)
+
+    @staticmethod
+    async def list(limit: int = None, after: str = None) -> MusicsRead:
+        """Retrieve the available musics, sorted by their id.
+        If limit is given, only that number of musics are returned, starting after the given music id"""
+        cursor = find_page(get_async_collection(mongo_settings.musics), limit=limit, after=after)
+        return [MusicRead.from_document(document) async for document in cursor]
+
+    @staticmethod
+    async def stream(after: str = None) -> AsyncIterator[MusicRead]:
+        """Iterate all the musics, sorted by their id, starting after the given music id, reading them in batches"""
+        cursor = find_page(get_async_collection(mongo_settings.musics), after=after)
+        async for document in cursor.batch_size(api_settings.export_batch_size):
+            yield MusicRead.from_document(document)
+
+    @staticmethod
+    async def create(create: MusicCreate) -> MusicRead:
+        """Create a music and return its Read object"""
+        document = create.dict()
+        document["created"] = document["updated"] = get_time()
+        document["_id"] = get_uuid()
+
+        result = await get_async_collection(mongo_settings.musics).insert_one(document)
+        assert result.acknowledged
+        music_catalog.invalidate()
+
+        return MusicRead.from_document(document)
+
+    @staticmethod
+    async def update(music_id: str, update: MusicUpdate):
+        """Update a music by giving only the fields to update"""
+        document = update.dict()
+        document["updated"] = get_time()
+
+        result = await get_async_collection(mongo_settings.musics).update_one({"_id": music_id}, {"$set": document})
+        if not result.modified_count:
+            raise MusicNotFoundException(identifier=music_id)
+        music_catalog.invalidate()
+
+    @staticmethod
+    async def delete(music_id: str):
+        """Delete a music given its unique id"""
+        result = await get_async_collection(mongo_settings.musics).delete_one({"_id": music_id})
+        if not result.deleted_count:
+            raise MusicNotFoundException(identifier=music_id)
+        music_catalog.invalidate()
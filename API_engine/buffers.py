@@ -0,0 +1,87 @@
+"""BUFFERS
+Write-behind buffer for the captured emotions. Emotions are kept in memory and written to Mongo in batches,
+when the buffer reaches a size or after a time interval, whatever comes first.
+Within a batch, the current emotion of each user is set only once, and the states of the same bucket are pushed together
+"""
+
+# # Native # #
+import logging
+import threading
+from typing import List
+
+# # Package # #
+from .models import EmotionEvent
+from .repositories import UsersRepository
+from .settings import ingest_settings as settings
+
+__all__ = ("EmotionBuffer", "emotion_buffer")
+
+logger = logging.getLogger(__name__)
+
+
+class EmotionBuffer:
+    def __init__(self, flush_size: int, flush_interval: float, max_size: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._events: List[EmotionEvent] = list()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread that flushes the buffer"""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="emotion-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and write all the pending emotions"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, event: EmotionEvent):
+        """Add an emotion to the buffer. The flusher is woken up if the flush size is reached,
+        and the emotions are written right away if the buffer is full (the flusher is not keeping up)"""
+        with self._lock:
+            self._events.append(event)
+            size = len(self._events)
+
+        if size >= self.max_size or not self._thread:
+            self.flush()
+        elif size >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write all the buffered emotions to Mongo"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, list()
+            if not events:
+                return
+
+            try:
+                UsersRepository.update_emotions(events)
+            except Exception:
+                logger.exception("Failed writing %d buffered emotions, they will be retried", len(events))
+                with self._lock:
+                    self._events = (events + self._events)[-self.max_size:]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+emotion_buffer = EmotionBuffer(
+    flush_size=settings.flush_size,
+    flush_interval=settings.flush_interval,
+    max_size=settings.max_size
+)
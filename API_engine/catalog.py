@@ -0,0 +1,88 @@
+"""CATALOG
+In-memory index of the music catalog used by the music recommendation, so a playlist is sampled without reading the
+whole musics collection on every request. The musics are read once and grouped by cluster, so the songs of a cluster
+are sampled in O(k). The index is kept by each process: it is dropped when the musics are created, updated or deleted
+through the repositories of the process, and read again after THERAPY_MUSIC_CATALOG_TTL seconds (if set),
+so the changes done through other processes are seen too
+"""
+
+# # Native # #
+import time
+import random
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# # Package # #
+from .database import musics
+from .settings import therapy_settings as settings
+
+__all__ = ("MusicCatalog", "music_catalog")
+
+logger = logging.getLogger(__name__)
+
+
+class MusicCatalog:
+    def __init__(self, ttl: Optional[float]):
+        self.ttl = ttl
+        self._index: Optional[Tuple[float, Dict[str, List[dict]]]] = None
+        """When the catalog was read (monotonic), and the musics (spotify_id and name) of each cluster.
+        Replaced at once when the catalog is read again"""
+        self._version = 0
+        """Increased when the catalog is invalidated, so a read started before is not kept"""
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def load(self) -> Dict[str, List[dict]]:
+        """Read the musics (their spotify_id and name) and index them by cluster (blocking).
+        Returns the musics of each cluster"""
+        with self._lock:
+            version = self._version
+
+        clusters = dict()
+        for document in musics.find({}, {"_id": 0, "cluster": 1, "spotify_id": 1, "name": 1}):
+            clusters.setdefault(document.pop("cluster", None), list()).append(document)
+
+        with self._lock:
+            if version == self._version:
+                self._index = (time.monotonic(), clusters)
+        logger.info("Loaded %d musics (%d clusters)", sum(map(len, clusters.values())), len(clusters))
+        return clusters
+
+    def invalidate(self):
+        """Drop the index, so the catalog is read again on its next use"""
+        with self._lock:
+            self._version += 1
+            self._index = None
+
+    def _is_valid(self, index) -> bool:
+        return index is not None and (self.ttl is None or time.monotonic() - index[0] < self.ttl)
+
+    def _get_clusters(self) -> Dict[str, List[dict]]:
+        index = self._index
+        if self._is_valid(index):
+            return index[1]
+
+        with self._load_lock:
+            index = self._index
+            if self._is_valid(index):
+                return index[1]
+            return self.load()
+
+    def sample(self, cluster: str, k: int) -> List[dict]:
+        """k random musics (their spotify_id and name) of the given cluster, that can be repeated.
+        Empty if the cluster has no musics. Reads the catalog if it was not read, or expired"""
+        documents = self._get_clusters().get(cluster)
+        return random.choices(documents, k=k) if documents else []
+
+    def sample_many(self, counts: List[int]) -> List[dict]:
+        """Random musics of many clusters: as many musics of each cluster ("0", "1", ...) as its count"""
+        playlist = list()
+        for cluster, k in enumerate(counts):
+            playlist.extend(self.sample(str(cluster), k))
+        return playlist
+
+
+music_catalog = MusicCatalog(
+    ttl=settings.music_catalog_ttl or None
+)
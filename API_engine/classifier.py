@@ -0,0 +1,84 @@
+"""CLASSIFIER
+Text emotion classification service (text2emotion), used for the notes of the users.
+- Its resources (NLTK corpora, loaded lazily by text2emotion) are loaded once, when the API starts.
+- Results are cached (LRU) by the hash of the normalised text, so repeated notes are classified once.
+- Many texts can be classified by a single call (e.g. the notes of a batch, see notes.py), where repeated texts are
+  classified once. text2emotion has no batch API, so the texts are still classified one by one
+"""
+
+# # Native # #
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# # Installed # #
+import text2emotion as te
+
+# # Package # #
+from .settings import classifier_settings as settings
+
+__all__ = ("EmotionClassifier", "emotion_classifier")
+
+
+class EmotionClassifier:
+    def __init__(self, cache_size: int):
+        self.cache_size = cache_size
+        self._cache: Dict[str, Dict[str, float]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @staticmethod
+    def get_key(text: str) -> str:
+        """Cache key of a text: hash of the text normalised (lowercase, single spaces)"""
+        return hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def get_emotions(scores: Dict[str, float]) -> List[str]:
+        """Emotions of a text, given its scores: those whose score is above the average score"""
+        average = sum(scores.values()) / len(scores)
+        return [emotion.lower() for emotion in scores if scores[emotion] >= average]
+
+    def _get_cached(self, key: str) -> Optional[Dict[str, float]]:
+        with self._cache_lock:
+            scores = self._cache.get(key)
+            if scores is not None:
+                self._cache.move_to_end(key)
+            return scores
+
+    def _set_cached(self, key: str, scores: Dict[str, float]):
+        with self._cache_lock:
+            self._cache[key] = scores
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def score(self, text: str) -> Dict[str, float]:
+        """Score of each emotion on the text (blocking, CPU bound)"""
+        key = self.get_key(text)
+        scores = self._get_cached(key)
+        if scores is None:
+            scores = te.get_emotion(text)
+            self._set_cached(key, scores)
+        return scores
+
+    def score_many(self, texts: List[str]) -> List[Dict[str, float]]:
+        """Score of each emotion on many texts (blocking, CPU bound). Repeated texts are scored once"""
+        scores = dict()
+        for text in texts:
+            key = self.get_key(text)
+            if key not in scores:
+                scores[key] = self.score(text)
+        return [scores[self.get_key(text)] for text in texts]
+
+    def classify(self, text: str) -> List[str]:
+        """Emotions of a text (blocking, CPU bound)"""
+        return self.get_emotions(self.score(text))
+
+    def load(self):
+        """Load the resources of the classifier, by classifying a sample text (blocking)"""
+        te.get_emotion("Hello, I finally won, really happy!")
+
+
+emotion_classifier = EmotionClassifier(
+    cache_size=settings.cache_size
+)
@@ -0,0 +1,97 @@
+"""COMMANDS
+Maintenance commands, run from the command line with `python -m API_engine <command>`
+"""
+
+# # Native # #
+import argparse
+
+# # Package # #
+from .repositories import UsersRepository, EmotionsRepository, NoteWordsRepository
+from .indexes import create_indexes, find_duplicates, explain_queries
+from .quotes import read_dump, write_store
+from .settings import quote_settings
+
+__all__ = ("main",)
+
+
+def migrate_states(args: argparse.Namespace):
+    """Move the states array of the user documents to the emotion buckets collection"""
+    migrated = EmotionsRepository.migrate()
+    print(f"Migrated the states of {migrated} users")
+
+
+def backfill_counters(args: argparse.Namespace):
+    """Rebuild the weekly emotion counters from the emotion buckets (with the API stopped)"""
+    rebuilt = EmotionsRepository.backfill_counters()
+    print(f"Rebuilt the weekly emotion counters of {rebuilt} users")
+
+
+def migrate_notes(args: argparse.Namespace):
+    """Set the capture time (Unix timestamp) of the notes added before it was stored, parsed from their captured text"""
+    migrated = UsersRepository.migrate_notes()
+    print(f"Migrated the notes of {migrated} users")
+
+
+def backfill_note_words(args: argparse.Namespace):
+    """Rebuild the weekly word frequencies (word clouds) from the notes of the users"""
+    rebuilt = NoteWordsRepository.backfill()
+    print(f"Rebuilt the weekly word frequencies of {rebuilt} users")
+
+
+def indexes(args: argparse.Namespace):
+    """Create the indexes of all the collections, reporting the duplicated values of the unique indexes not created"""
+    failed = create_indexes()
+    for collection, index, error in failed:
+        print(f"Could not create the index {index.document['name']} of {collection.name}: {error}")
+        if index.document.get("unique"):
+            for duplicate in find_duplicates(collection, index):
+                print(f"    {duplicate['count']} documents with {duplicate['_id']}")
+    if failed:
+        raise SystemExit(1)
+    print("Indexes created")
+
+
+def explain(args: argparse.Namespace):
+    """Print the query plan of each repository query, to verify they are backed by an index"""
+    for name, plan in explain_queries().items():
+        print(f"{'SCAN ' if 'COLLSCAN' in plan else 'INDEX'} {name}: {plan}")
+
+
+def import_quotes(args: argparse.Namespace):
+    """Create or refresh the quote store from a dump of quotes (JSON lines or CSV, see quotes.read_dump)"""
+    imported = write_store(read_dump(args.dump), args.output, args.max_length)
+    print(f"Imported {imported} quotes to {args.output} (restart the API to load them)")
+
+
+def main(argv=None):
+    """Parse the command line arguments and run the requested command"""
+    parser = argparse.ArgumentParser(prog="API_engine", description="EmoUP API maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparser = subparsers.add_parser("migrate-states", help=migrate_states.__doc__)
+    subparser.set_defaults(func=migrate_states)
+
+    subparser = subparsers.add_parser("backfill-counters", help=backfill_counters.__doc__)
+    subparser.set_defaults(func=backfill_counters)
+
+    subparser = subparsers.add_parser("migrate-notes", help=migrate_notes.__doc__)
+    subparser.set_defaults(func=migrate_notes)
+
+    subparser = subparsers.add_parser("backfill-note-words", help=backfill_note_words.__doc__)
+    subparser.set_defaults(func=backfill_note_words)
+
+    subparser = subparsers.add_parser("create-indexes", help=indexes.__doc__)
+    subparser.set_defaults(func=indexes)
+
+    subparser = subparsers.add_parser("explain", help=explain.__doc__)
+    subparser.set_defaults(func=explain)
+
+    subparser = subparsers.add_parser("import-quotes", help=import_quotes.__doc__)
+    subparser.add_argument("dump", help="Dump file of quotes: .jsonl, or .csv with header (quote, title, moods)")
+    subparser.add_argument("--output", default=quote_settings.path, help="Quote store file to write")
+    subparser.add_argument("--max-length", type=int, default=quote_settings.max_length,
+                           help="Max characters of the quotes imported")
+    subparser.set_defaults(func=import_quotes)
+
+    args = parser.parse_args(argv)
+    args.func(args)
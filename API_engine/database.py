@@ -1,18 +1,126 @@
 """DATABASE
-MongoDB database initialization
+MongoDB database initialization.
+The clients are created lazily, on their first use (the API creates them when it starts), once per process:
+importing the package does not connect to Mongo, and a client created before a fork is never used by the child process
+(pymongo clients are not fork-safe)
 """
 
+# # Native # #
+import os
+from typing import Optional
+
 # # Installed # #
 from pymongo import MongoClient
 from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
 
 # # Package # #
 from .settings import mongo_settings as settings
 
-__all__ = ("client", "collection")
+__all__ = (
+    "users", "doctors", "musics", "emotions", "emotion_weeks", "note_words",
+    "get_client", "get_collection", "get_async_client", "get_async_collection", "connect_clients", "close_clients"
+)
+
+_client: Optional[MongoClient] = None
+_async_client: Optional[AsyncIOMotorClient] = None
+_collections = dict()
+_async_collections = dict()
+
+
+def get_client_options() -> dict:
+    """Options of the Mongo clients (credentials and connection pool), from the settings"""
+    options = dict(
+        username=settings.user,
+        password=settings.password,
+        authSource="admin",
+        authMechanism="SCRAM-SHA-1",
+        maxPoolSize=settings.max_pool_size,
+        minPoolSize=settings.min_pool_size,
+        waitQueueTimeoutMS=settings.wait_queue_timeout_ms,
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms
+    )
+    if settings.compressors:
+        options["compressors"] = settings.compressors
+    return options
+
+
+def get_client() -> MongoClient:
+    """Mongo client of the current process, created on its first use"""
+    global _client
+    if _client is None:
+        _client = MongoClient(settings.uri, **get_client_options())
+    return _client
+
+
+def get_collection(name: str) -> Collection:
+    """Collection of the Mongo client of the current process"""
+    collection = _collections.get(name)
+    if collection is None:
+        collection = _collections[name] = get_client()[settings.database][name]
+    return collection
+
+
+def get_async_client() -> AsyncIOMotorClient:
+    """Motor (asyncio) client of the current process, created on its first use.
+    The Motor client is bound to the event loop it is created on, so it must be first used from the running loop of the API"""
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncIOMotorClient(settings.uri, **get_client_options())
+    return _async_client
+
+
+def get_async_collection(name: str) -> AsyncIOMotorCollection:
+    """Motor (asyncio) collection, used by the async repositories"""
+    collection = _async_collections.get(name)
+    if collection is None:
+        collection = _async_collections[name] = get_async_client()[settings.database][name]
+    return collection
+
+
+def connect_clients():
+    """Create the clients of the current process. Called when the API starts, from its running loop"""
+    get_client()
+    get_async_client()
+
+
+def close_clients():
+    """Close the clients of the current process. They are created again if used afterwards"""
+    if _client is not None:
+        _client.close()
+    if _async_client is not None:
+        _async_client.close()
+    _forget()
+
+
+def _forget():
+    """Forget the clients of the current process, without closing them"""
+    global _client, _async_client
+    _client = _async_client = None
+    _collections.clear()
+    _async_collections.clear()
+
+
+# The clients inherited from the parent process must not be used (nor closed) by a forked child
+os.register_at_fork(after_in_child=_forget)
+
+
+class LazyCollection:
+    """Collection that is resolved (from the client of the current process) every time it is used,
+    so it can be imported as a module-level object without connecting to Mongo"""
+    def __init__(self, name: str):
+        self.name = name
+
+    def __getattr__(self, item):
+        return getattr(get_collection(self.name), item)
+
+    def __repr__(self):
+        return f"LazyCollection({self.name!r})"
+
 
-client = MongoClient(settings.uri)
-client.admin.authenticate(settings.user, settings.password, mechanism = 'SCRAM-SHA-1', source='admin')
-users: Collection = client[settings.database][settings.users]
-doctors: Collection = client[settings.database][settings.doctors]
-musics: Collection = client[settings.database][settings.musics]
+users: Collection = LazyCollection(settings.users)
+doctors: Collection = LazyCollection(settings.doctors)
+musics: Collection = LazyCollection(settings.musics)
+emotions: Collection = LazyCollection(settings.emotions)
+emotion_weeks: Collection = LazyCollection(settings.emotion_weeks)
+note_words: Collection = LazyCollection(settings.note_words)
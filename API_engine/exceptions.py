@@ -22,6 +22,9 @@ __all__ = (
     "UserAlreadyExistsException", "get_exception_responses",
     "DoctorNotFoundException", "DoctorAlreadyExistsException",
     "MusicNotFoundException", "MusicAlreadyExistsException",
+    "InvalidFieldsException", "PasswordServiceBusyException",
+    "InvalidSessionException", "SessionForbiddenException", "AdminForbiddenException",
+    "RenderServiceBusyException", "UserFieldRequiredException",
 )
 
 
@@ -103,6 +106,48 @@ class MusicAlreadyExistsException(AlreadyExistsException):
     """Error raised when a music already exists"""
     message = "The music already exists"
 
+class InvalidFieldsException(BaseIdentifiedException):
+    """Error raised when requesting fields that do not exist (the identifier is the list of invalid fields)"""
+    message = "The requested fields do not exist"
+    code = statuscode.HTTP_422_UNPROCESSABLE_ENTITY
+    model = BaseIdentifiedError
+
+class UserFieldRequiredException(BaseIdentifiedException):
+    """Error raised when an action requires a field the user has not set (the identifier is the required field)"""
+    message = "The user does not have the field required by this action"
+    code = statuscode.HTTP_409_CONFLICT
+    model = BaseIdentifiedError
+
+class PasswordServiceBusyException(BaseAPIException):
+    """Error raised when there are too many passwords pending to be hashed or verified"""
+    message = "Too many login requests, try again later"
+    code = statuscode.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class RenderServiceBusyException(BaseAPIException):
+    """Error raised when there are too many images pending to be rendered"""
+    message = "Too many images being generated, try again later"
+    code = statuscode.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class InvalidSessionException(BaseAPIException):
+    """Error raised when the session token is missing, not valid or expired"""
+    message = "The session is not valid or expired, login again"
+    code = statuscode.HTTP_401_UNAUTHORIZED
+
+
+class SessionForbiddenException(BaseIdentifiedException):
+    """Error raised when the session token belongs to another user (the identifier is the requested user)"""
+    message = "The session does not belong to the user"
+    code = statuscode.HTTP_403_FORBIDDEN
+    model = BaseIdentifiedError
+
+
+class AdminForbiddenException(BaseAPIException):
+    """Error raised when a route of the administrators is requested without the admin token (e.g. with a user session)"""
+    message = "The route requires the admin token"
+    code = statuscode.HTTP_403_FORBIDDEN
+
 
 def get_exception_responses(*args: Type[BaseAPIException]) -> dict:
     """Given BaseAPIException classes, return a dict of responses used on FastAPI endpoint definition, with the format:
@@ -0,0 +1,111 @@
+"""INDEXES
+Declarative registry of the indexes of each collection, created at startup (creating an existing index does nothing),
+and of the queries performed by the repositories, to verify (explain) that they are backed by an index.
+An index that cannot be created (e.g. a unique index on a collection with duplicated values) is logged and skipped,
+so the API still starts: the create-indexes command reports the duplicated values to fix
+"""
+
+# # Native # #
+import logging
+from typing import List, Tuple
+
+# # Installed # #
+from pymongo import IndexModel, ASCENDING
+from pymongo.errors import OperationFailure
+
+# # Package # #
+from .database import users, doctors, musics, emotions, emotion_weeks, note_words
+
+__all__ = ("INDEXES", "QUERIES", "create_indexes", "find_duplicates", "explain_queries")
+
+logger = logging.getLogger(__name__)
+
+
+INDEXES = (
+    (users, [
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+        IndexModel([("device_id", ASCENDING)], name="device_id", sparse=True),
+        IndexModel([("notes.status", ASCENDING)], name="notes_status", sparse=True),
+    ]),
+    (musics, [
+        IndexModel([("cluster", ASCENDING)], name="cluster"),
+    ]),
+    (emotions, [
+        IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_id_day"),
+    ]),
+    (emotion_weeks, [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ]),
+    (note_words, [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ]),
+)
+"""Indexes of each collection. Queries by _id are not listed, as the _id index always exists"""
+
+QUERIES = {
+    "UsersRepository.get": (users, {"_id": ""}, None),
+    "UsersRepository.login": (users, {"email": ""}, None),
+    "UsersRepository.get_device_user_id": (users, {"device_id": ""}, None),
+    "UsersRepository.update_emotion (device)": (users, {"device_id": ""}, None),
+    "UsersRepository.update_emotions": (users, {"$or": [{"_id": {"$in": [""]}}, {"device_id": {"$in": [""]}}]}, None),
+    "AsyncUsersRepository.get_pending_notes_user_ids": (users, {"notes.status": "pending"}, None),
+    "EmotionsRepository.list": (emotions, {"user_id": "", "day": {"$gte": 0, "$lte": 0}}, [("day", ASCENDING)]),
+    "EmotionsRepository.backfill_counters": (emotions, {"user_id": ""}, None),
+    "EmotionsRepository.count": (emotion_weeks, {"_id": ""}, None),
+    "NoteWordsRepository.get": (note_words, {"_id": ""}, None),
+    "DoctorRepository.get": (doctors, {"_id": ""}, None),
+    "MusicRepository.get": (musics, {"_id": ""}, None),
+    "Musics by cluster": (musics, {"cluster": ""}, None),
+    "MusicRepository.sample_many": (musics, {"cluster": {"$in": [""]}}, None),
+}
+"""Queries performed by the repositories: name: (collection, filter, sort)"""
+
+
+def create_indexes() -> List[Tuple[object, IndexModel, OperationFailure]]:
+    """Create the indexes of all the collections, one by one, so an index that cannot be created does not stop
+    the others. Returns the collection, index and error of the indexes not created (also logged)"""
+    failed = list()
+    for collection, indexes in INDEXES:
+        for index in indexes:
+            try:
+                collection.create_indexes([index])
+            except OperationFailure as ex:
+                logger.error("Could not create the index %s of %s: %s", index.document["name"], collection.name, ex)
+                failed.append((collection, index, ex))
+    return failed
+
+
+def find_duplicates(collection, index: IndexModel, limit: int = 10) -> List[dict]:
+    """Values of the fields of an index repeated on many documents (up to limit), which prevent creating it
+    as unique. Returns their fields values and count"""
+    fields = list(index.document["key"])
+    return list(collection.aggregate([
+        {"$group": {"_id": {field: "$" + field for field in fields}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": limit}
+    ]))
+
+
+def _format_plan(plan: dict) -> str:
+    """Return the stages of a query plan, from the outer to the inner stage, as: FETCH <- IXSCAN(index name)"""
+    stage = plan["stage"]
+    if plan.get("indexName"):
+        stage += f"({plan['indexName']})"
+
+    if plan.get("inputStage"):
+        return stage + " <- " + _format_plan(plan["inputStage"])
+    if plan.get("inputStages"):
+        return stage + " <- [" + ", ".join(_format_plan(input_plan) for input_plan in plan["inputStages"]) + "]"
+    return stage
+
+
+def explain_queries() -> dict:
+    """Explain the winning plan of each repository query. Returns {query name: plan stages}.
+    Plans with a COLLSCAN stage are not backed by an index"""
+    plans = dict()
+    for name, (collection, query, sort) in QUERIES.items():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plans[name] = _format_plan(cursor.explain()["queryPlanner"]["winningPlan"])
+    return plans
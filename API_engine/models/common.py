@@ -4,6 +4,7 @@ Common variables and base classes for the models
 
 # # Installed # #
 import pydantic
+from pydantic.fields import SHAPE_LIST
 
 __all__ = ("BaseModel",)
 
@@ -18,6 +19,39 @@ class BaseModel(pydantic.BaseModel):
             raise ValueError("At least one property is required")
         return data
 
+    @classmethod
+    def construct_trusted(cls, data: dict):
+        """Create the model (and its submodels) from trusted data, like documents read from our own database,
+        without validation (a lighter version of construct). Keys that are not fields of the model are ignored"""
+        values = dict()
+        for name, field in cls.__fields__.items():
+            if name not in data:
+                continue
+
+            value = data[name]
+            if value is not None and isinstance(field.type_, type) and issubclass(field.type_, BaseModel):
+                if field.shape == SHAPE_LIST:
+                    value = [field.type_.construct_trusted(item) for item in value]
+                else:
+                    value = field.type_.construct_trusted(value)
+            elif isinstance(value, bytes) and isinstance(field.type_, type) and issubclass(field.type_, str):
+                # Stored as bytes (e.g. password hashes), but read as str, as they are serialised to JSON
+                value = value.decode()
+            values[name] = value
+
+        model = cls.__new__(cls)
+        object.__setattr__(model, "__dict__", {**cls._get_null_defaults(), **values})
+        object.__setattr__(model, "__fields_set__", set(values))
+        return model
+
+    @classmethod
+    def _get_null_defaults(cls) -> dict:
+        """Fields of the model with null as default value, cached per model class"""
+        if "_null_defaults" not in cls.__dict__:
+            defaults = {name: None for name, field in cls.__fields__.items() if not field.required and field.default is None}
+            type.__setattr__(cls, "_null_defaults", defaults)
+        return cls.__dict__["_null_defaults"]
+
     def dict(self, include_nulls=False, **kwargs):
         """Override the super dict method by removing null keys from the dict, unless include_nulls=True"""
         kwargs["exclude_none"] = not include_nulls
@@ -32,6 +32,12 @@ class DoctorRead(DoctorCreate):
             data["doctor_id"] = document_id
         return data
 
+    @classmethod
+    def from_document(cls, document: dict) -> "DoctorRead":
+        """Create a DoctorRead from a document of the doctors collection, without validation (trusted data).
+        Only the derived doctor_id (from _id) is set"""
+        return cls.construct_trusted({**document, "doctor_id": document["_id"]})
+
     class Config(DoctorCreate.Config):
         extra = pydantic.Extra.ignore  # if a read document has extra fields, ignore them
 
@@ -55,9 +55,6 @@ class UserFields:
         description="Date of birth, in format YYYY-MM-DD, or Unix timestamp",
         example="1999-12-31"
     )
-    states = Field(
-        description="Emotion state of user"
-    )
     notes = Field(
         description="Notes of user"
     )
@@ -105,6 +102,28 @@ class StateFields:
         **_unix_ts
     )
     
+class EmotionEventFields:
+    user_id = Field(
+        description="Unique identifier of the user the emotion was captured for (either user_id or device_id is required)",
+        example=get_uuid(),
+        min_length=36,
+        max_length=36
+    )
+    device_id = Field(
+        description="Emoup Device id that captured the emotion (either user_id or device_id is required)",
+        example="1BDKfbibi1234",
+        **_string
+    )
+    captured = Field(
+        description="Capture time of the emotion (Unix timestamp). The time it is received if not given",
+        **_unix_ts
+    )
+    status = Field(
+        description="Result of applying the emotion event: ok, or not_found if the user/device does not exist",
+        example="ok"
+    )
+
+
 class NoteFields:
     note = Field(
         description="Note of the user",
@@ -116,11 +135,33 @@ class NoteFields:
         example="06/04/2020",
         **_string
     )
+    captured_at = Field(
+        description="Capture time of the note (Unix timestamp), parsed from captured when the note is added. "
+                    "The time the note was added if captured is not a date",
+        **_unix_ts
+    )
     color = Field(
         description="Color selected by the user",
         example="red",
         **_string
     )
+    note_id = Field(
+        description="Unique identifier of the note, set when it is added",
+        example=get_uuid()
+    )
+    status = Field(
+        description="Processing status of the note: pending or processing (its emotions are being classified), "
+                    "classified or failed",
+        example="classified"
+    )
+    scores = Field(
+        description="Score of each emotion on the note",
+        example={"Happy": 0.5, "Angry": 0.0, "Surprise": 0.25, "Sad": 0.25, "Fear": 0.0}
+    )
+    emotions = Field(
+        description="Emotions of the note: those whose score is above the average score",
+        example=["happy", "surprise", "sad"]
+    )
     
 class DeepFakeFields:
     name = Field(
@@ -32,6 +32,12 @@ class MusicRead(MusicCreate):
             data["music_id"] = document_id
         return data
 
+    @classmethod
+    def from_document(cls, document: dict) -> "MusicRead":
+        """Create a MusicRead from a document of the musics collection, without validation (trusted data).
+        Only the derived music_id (from _id) is set"""
+        return cls.construct_trusted({**document, "music_id": document["_id"]})
+
     class Config(MusicCreate.Config):
         extra = pydantic.Extra.ignore  # if a read document has extra fields, ignore them
 
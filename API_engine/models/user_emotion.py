@@ -2,14 +2,46 @@
 The emotion of a user is part of the User model
 """
 
+# # Native # #
+from typing import Optional, List
+
+# # Installed # #
+import pydantic
+
 # # Package # #
 from .common import BaseModel
-from .fields import StateFields
+from .fields import StateFields, EmotionEventFields
 
-__all__ = ("Emotion",)
+__all__ = ("Emotion", "EmotionsRead", "EmotionEvent", "EmotionEventStatus", "EmotionEventsStatus")
 
 
 class Emotion(BaseModel):
     """The emotion state information of a user"""
     emotion: str = StateFields.emotion
-    captured: int = StateFields.captured
\ No newline at end of file
+    captured: int = StateFields.captured
+
+
+EmotionsRead = List[Emotion]
+
+
+class EmotionEvent(BaseModel):
+    """An emotion captured for a user or by a device, sent on batch ingestion"""
+    user_id: Optional[str] = EmotionEventFields.user_id
+    device_id: Optional[str] = EmotionEventFields.device_id
+    emotion: str = StateFields.emotion
+    captured: Optional[int] = EmotionEventFields.captured
+
+    @pydantic.root_validator()
+    def _user_or_device(cls, data):
+        """Exactly one of user_id or device_id is required"""
+        if bool(data.get("user_id")) == bool(data.get("device_id")):
+            raise ValueError("Either user_id or device_id is required")
+        return data
+
+
+class EmotionEventStatus(BaseModel):
+    """Result of applying an emotion event, in the same position as the event was sent"""
+    status: str = EmotionEventFields.status
+
+
+EmotionEventsStatus = List[EmotionEventStatus]
@@ -2,15 +2,38 @@
 The note of a user is part of the User model
 """
 
+# # Native # #
+from typing import Dict, List, Optional
+
 # # Package # #
 from .common import BaseModel
 from .fields import NoteFields
 
-__all__ = ("Note",)
+__all__ = ("Note", "NoteRead", "NotesRead", "NoteClassification", "NoteClassifications")
 
 
 class Note(BaseModel):
-    """The notes of a user"""
+    """The notes of a user, as sent by the clients"""
     note: str = NoteFields.note
     color: str = NoteFields.color
-    captured: str = NoteFields.captured
\ No newline at end of file
+    captured: str = NoteFields.captured
+
+
+class NoteRead(Note):
+    """The notes of a user, as stored. Adds the fields set by the API when the note is added and processed"""
+    captured_at: Optional[int] = NoteFields.captured_at
+    note_id: Optional[str] = NoteFields.note_id
+    status: Optional[str] = NoteFields.status
+    emotions: Optional[List[str]] = NoteFields.emotions
+
+
+NotesRead = List[NoteRead]
+
+
+class NoteClassification(BaseModel):
+    """The emotions classified on the text of a note"""
+    scores: Dict[str, float] = NoteFields.scores
+    emotions: List[str] = NoteFields.emotions
+
+
+NoteClassifications = List[NoteClassification]
@@ -1,25 +1,33 @@
 """MODELS - USER - READ
-User Read model. Inherits from UserCreate and adds the user_id field, which is the _id field on Mongo documents
+User Read model. Inherits from UserCreate and adds the user_id field, which is the _id field on Mongo documents.
+The password is removed, as it is never returned
 """
 
 # # Native # #
-from datetime import datetime
+from datetime import datetime, date
 from typing import Optional, List
 
 # # Installed # #
 import pydantic
-from dateutil.relativedelta import relativedelta
 
 # # Package # #
 from .user_create import UserCreate
+from .user_note import NoteRead
 from .fields import UserFields
 
-__all__ = ("UserRead", "UsersRead")
+__all__ = ("UserRead", "UsersRead", "get_age")
+
+
+def get_age(birth: date) -> int:
+    """Calculate the current age of a person born on the given date"""
+    today = datetime.now().date()
+    return today.year - birth.year - ((today.month, today.day) < (birth.month, birth.day))
 
 
 class UserRead(UserCreate):
     """Body of User GET and POST responses"""
     user_id: str = UserFields.user_id
+    notes: Optional[List[NoteRead]] = UserFields.notes
     age: Optional[int] = UserFields.age
     created: int = UserFields.created
     updated: int = UserFields.updated
@@ -38,12 +46,25 @@ class UserRead(UserCreate):
         """Calculate the current age of the user from the date of birth, if any"""
         birth = data.get("birth")
         if birth:
-            today = datetime.now().date()
-            data["age"] = relativedelta(today, birth).years
+            data["age"] = get_age(birth)
         return data
 
+    @classmethod
+    def from_document(cls, document: dict) -> "UserRead":
+        """Create a UserRead from a document of the users collection, without validation (trusted data).
+        Only the derived fields are set: the user_id (from _id) and the age (from the date of birth, if any)"""
+        read = cls.construct_trusted({**document, "user_id": document["_id"]})
+        if isinstance(read.birth, str):
+            read.birth = date.fromisoformat(read.birth)
+        if read.birth:
+            read.age = get_age(read.birth)
+        return read
+
     class Config(UserCreate.Config):
         extra = pydantic.Extra.ignore  # if a read document has extra fields, ignore them
 
 
+# The password (hash) is never returned: it is not a field of the read model, so it cannot be requested either
+del UserRead.__fields__["password"]
+
 UsersRead = List[UserRead]
@@ -12,7 +12,6 @@ from contextlib import suppress
 from .common import BaseModel
 from .fields import UserFields
 from .user_address import Address
-from .user_emotion import Emotion
 from .user_deepfakes import DeepFake
 from .user_note import Note
 
@@ -24,7 +23,6 @@ class UserUpdate(BaseModel):
     name: Optional[str] = UserFields.name
     password: Optional[str] = UserFields.password
     address: Optional[Address] = UserFields.address_update
-    states: Optional[List[Emotion]] = UserFields.states
     notes: Optional[List[Note]] = UserFields.notes
     deepfake: Optional[DeepFake] = UserFields.deepfake
     birth: Optional[date] = UserFields.birth
@@ -0,0 +1,78 @@
+"""NOTES
+Background processing of the notes of the users. Notes are stored as pending when added, and the users with pending notes
+are queued here, so the notes are classified in batches (a single thread call per batch) and their emotions written with
+a single combined update per batch (see AsyncUsersRepository.process_notes).
+Notes left pending by a previous run (e.g. the API was stopped before processing them) are queued on startup, as well as
+the notes claimed by a run that never processed them (after CLASSIFIER_CLAIM_TIMEOUT)
+"""
+
+# # Native # #
+import asyncio
+import logging
+from typing import Optional
+
+# # Package # #
+from .async_repositories import AsyncUsersRepository
+from .utils import get_batch, get_time
+from .settings import classifier_settings as settings
+
+__all__ = ("NoteProcessor", "note_processor")
+
+logger = logging.getLogger(__name__)
+
+
+class NoteProcessor:
+    def __init__(self, batch_size: int, batch_interval: float, claim_timeout: int):
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.claim_timeout = claim_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def add(self, user_id: str):
+        """Queue a user with pending notes. If the processor is not started, its notes are processed right away"""
+        if self._queue is None:
+            await self.process([user_id])
+        else:
+            self._queue.put_nowait(user_id)
+
+    async def process(self, user_ids):
+        """Process the pending notes of the given users. Failures are logged, and the notes marked as failed"""
+        try:
+            await AsyncUsersRepository.process_notes(list(set(user_ids)))
+        except Exception:
+            logger.exception("Failed processing the notes of %d users", len(user_ids))
+
+    async def start(self):
+        """Start the worker, and queue the users with notes pending (including the notes whose claim expired).
+        Must be called from the running loop"""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+        released = await AsyncUsersRepository.release_notes(get_time() - self.claim_timeout)
+        if released:
+            logger.info("Released the notes of %d users, claimed and never processed", released)
+        for user_id in await AsyncUsersRepository.get_pending_notes_user_ids():
+            self._queue.put_nowait(user_id)
+
+    async def stop(self):
+        """Stop the worker, after processing the notes queued"""
+        if self._worker:
+            self._queue.put_nowait(None)
+            await self._worker
+            self._queue = self._worker = None
+
+    async def _run(self):
+        """Process the queued users in batches, until a None is received"""
+        closed = False
+
+        while not closed:
+            user_ids, closed = await get_batch(self._queue, self.batch_size, self.batch_interval)
+            if user_ids:
+                await self.process(user_ids)
+
+
+note_processor = NoteProcessor(
+    batch_size=settings.batch_size,
+    batch_interval=settings.batch_interval,
+    claim_timeout=settings.claim_timeout
+)
@@ -0,0 +1,109 @@
+"""PASSWORDS
+Hashing and verification of the user passwords (bcrypt), on a dedicated, size-limited thread pool
+(bcrypt releases the GIL), so a login storm can not take the threads used by the rest of requests.
+When the pool and its queue are full, or a password waits for longer than the timeout, the request is rejected
+"""
+
+# # Native # #
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError
+
+# # Installed # #
+import bcrypt
+
+# # Package # #
+from .exceptions import PasswordServiceBusyException
+from .settings import password_settings as settings
+
+__all__ = ("PasswordExecutor", "password_executor")
+
+
+class PasswordExecutor:
+    def __init__(self, workers: int, queue_size: int, timeout: float, rounds: int):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.rounds = rounds
+        self._reset()
+        # The threads of the pool are not inherited by forked children
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Thread pool, created on its first use (on each process)"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="passwords")
+            return self._executor
+
+    def _submit(self, fn, *args) -> Future:
+        """Submit a job to the pool. Raises PasswordServiceBusyException if the pool and its queue are full"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordServiceBusyException()
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _hash(self, password: str) -> bytes:
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=self.rounds))
+
+    @staticmethod
+    def _check(password: str, hashed: bytes) -> bool:
+        return bcrypt.checkpw(password.encode("utf-8"), hashed)
+
+    def hash(self, password: str) -> bytes:
+        """Hash a password with a new salt"""
+        return self._result(self._submit(self._hash, password))
+
+    def check(self, password: str, hashed: bytes) -> bool:
+        """Verify a password against its hash (constant-time comparison)"""
+        return self._result(self._submit(self._check, password, hashed))
+
+    async def hash_async(self, password: str) -> bytes:
+        """Hash a password with a new salt, without blocking the event loop"""
+        return await self._result_async(self._submit(self._hash, password))
+
+    async def check_async(self, password: str, hashed: bytes) -> bool:
+        """Verify a password against its hash (constant-time comparison), without blocking the event loop"""
+        return await self._result_async(self._submit(self._check, password, hashed))
+
+    def _result(self, future: Future):
+        """Wait for the result of a job. If it takes longer than the timeout, the job is cancelled (if not started yet)"""
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordServiceBusyException()
+
+    async def _result_async(self, future: Future):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            # The wrapped future is cancelled by wait_for, which cancels the job (if not started yet)
+            raise PasswordServiceBusyException()
+
+    def shutdown(self):
+        """Stop the thread pool, waiting for the running jobs. It is created again if used afterwards"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+password_executor = PasswordExecutor(
+    workers=settings.workers,
+    queue_size=settings.queue_size,
+    timeout=settings.timeout,
+    rounds=settings.rounds
+)
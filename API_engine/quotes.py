@@ -0,0 +1,133 @@
+"""QUOTES
+Local store of the quotes used by the therapies, replacing the wikiquote requests (one or more per quote).
+The store is a JSON lines file, with a quote per line: {"quote": str, "title": str, "moods": [str]},
+created or refreshed from a dump by the import-quotes command, and loaded in memory when the API starts.
+Only the quotes of up to QUOTES_MAX_LENGTH characters are kept, sorted by length and indexed by mood,
+so a quote is sampled with a random index (a bisect if a shorter max length is requested)
+"""
+
+# # Native # #
+import os
+import csv
+import json
+import random
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# # Package # #
+from .settings import quote_settings as settings
+
+__all__ = ("QuoteStore", "quote_store", "read_dump", "write_store")
+
+logger = logging.getLogger(__name__)
+
+Quote = Tuple[str, str]
+"""A quote and its title (the author or work it comes from)"""
+
+
+def read_dump(path: str) -> Iterator[dict]:
+    """Read the quotes of a dump: a JSON lines file, or a CSV file with a header,
+    both with the quote, title (or author) and moods (or tags; a list, or a comma separated string) of each quote"""
+    with open(path, encoding="utf-8", newline="") as file:
+        rows = csv.DictReader(file) if path.endswith(".csv") else (json.loads(line) for line in file if line.strip())
+        for row in rows:
+            moods = row.get("moods") or row.get("tags") or []
+            if isinstance(moods, str):
+                moods = moods.split(",")
+            yield {
+                "quote": " ".join((row.get("quote") or "").split()),
+                "title": " ".join((row.get("title") or row.get("author") or "").split()),
+                "moods": sorted({mood.strip().lower() for mood in moods if mood.strip()})
+            }
+
+
+def write_store(quotes: Iterable[dict], path: str, max_length: int) -> int:
+    """Write a quote store file with the given quotes (see read_dump), keeping those with a quote and title
+    of up to max_length characters, once. Returns the quotes written"""
+    written = set()
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        for quote in quotes:
+            if not quote["quote"] or not quote["title"] or len(quote["quote"]) > max_length:
+                continue
+            if quote["quote"].lower() in written:
+                continue
+
+            written.add(quote["quote"].lower())
+            file.write(json.dumps(quote, ensure_ascii=False) + "\n")
+
+    # Replaced at once, so a running API never loads a half written store
+    os.replace(path + ".tmp", path)
+    return len(written)
+
+
+class QuoteStore:
+    def __init__(self, path: str, max_length: int):
+        self.path = path
+        self.max_length = max_length
+        self._index: Optional[Tuple[List[Quote], List[int], Dict[str, List[int]]]] = None
+        """Quotes sorted by length, their lengths, and the indexes of the quotes of each mood.
+        Replaced at once when the store is loaded again"""
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """Load the quotes of the store file (blocking). Raises ValueError if it has no quotes to use"""
+        with open(self.path, encoding="utf-8") as file:
+            quotes = [json.loads(line) for line in file if line.strip()]
+        quotes = sorted(
+            (quote for quote in quotes if len(quote["quote"]) <= self.max_length),
+            key=lambda quote: len(quote["quote"])
+        )
+        if not quotes:
+            raise ValueError(f"The quote store {self.path} has no quotes of up to {self.max_length} characters")
+
+        moods = dict()
+        for i, quote in enumerate(quotes):
+            for mood in quote.get("moods", []):
+                moods.setdefault(mood, list()).append(i)
+
+        self._index = (
+            [(quote["quote"], quote["title"]) for quote in quotes],
+            [len(quote["quote"]) for quote in quotes],
+            moods
+        )
+        logger.info("Loaded %d quotes (%d moods) from %s", len(quotes), len(moods), self.path)
+
+    def _get_index(self):
+        if self._index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self.load()
+        return self._index
+
+    def sample(self, mood: str = None, max_length: int = None) -> Quote:
+        """Random quote (and its title), of the given mood if it has quotes. Loads the store if it was not loaded"""
+        return self.sample_many(1, mood, max_length)[0]
+
+    def sample_many(self, k: int, mood: str = None, max_length: int = None) -> List[Quote]:
+        """k different random quotes (and their titles), of the given mood if it has quotes, and of up to max_length
+        characters if given. If there are less than k quotes, some are repeated"""
+        quotes, lengths, moods = self._get_index()
+        # Quotes are sorted by length, so the short enough are the first ones
+        count = len(quotes) if max_length is None else bisect_right(lengths, max_length)
+        indexes = moods.get(mood.lower()) if mood else None
+        # The indexes of a mood are sorted too, so its short enough quotes are the first indexes
+        mood_count = bisect_left(indexes, count) if indexes else 0
+        if mood_count:
+            count = mood_count
+        else:
+            indexes = None
+        if not count:
+            raise ValueError(f"No quotes of up to {max_length} characters")
+
+        picks = random.sample(range(count), k) if k <= count else random.choices(range(count), k=k)
+        if indexes is not None:
+            picks = [indexes[pick] for pick in picks]
+        return [quotes[pick] for pick in picks]
+
+
+quote_store = QuoteStore(
+    path=settings.path,
+    max_length=settings.max_length
+)
@@ -0,0 +1,160 @@
+"""RENDERER
+Render service for the images generated by the API (word clouds and quote images), on a dedicated, size-limited
+process pool: rendering is CPU bound Pillow/NumPy work that holds the GIL, so rendering on the request threads slowed
+down all the other requests of the worker. Many images are rendered in parallel by submitting them at once.
+When the pool and its queue are full, or a render waits for longer than the timeout, the request is rejected.
+The render jobs are module level functions, so they can be sent to the pool processes
+"""
+
+# # Native # #
+import os
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from statistics import median, quantiles
+from typing import Dict, List
+
+# # Installed # #
+from quote2image import generate
+from wordcloud import WordCloud
+
+# # Package # #
+from .exceptions import RenderServiceBusyException
+from .settings import render_settings as settings
+
+__all__ = ("RenderExecutor", "render_executor", "render_quote_image", "render_wordcloud")
+
+
+def render_quote_image(text: str, path: str):
+    """Render the image of a quote (with its title on a new line) as JPEG, to the given path"""
+    generate.main(text).save(path, format="JPEG")
+
+
+def render_wordcloud(frequencies: Dict[str, int], path: str):
+    """Render the word cloud of the given word frequencies as JPEG, to the given path.
+    The image is written to a temporary file and renamed, so a partial image is never served"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    WordCloud().generate_from_frequencies(frequencies).to_image().save(temp_path, format="JPEG")
+    os.replace(temp_path, path)
+
+
+class RenderExecutor:
+    def __init__(self, workers: int, queue_size: int, timeout: float, start_method: str, latencies: int = 1000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.start_method = start_method
+        self.latencies = latencies
+        self._reset()
+        # The pool processes are children of the process that created the pool, not of its forked children
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._pending = 0
+        self._rendered = 0
+        self._failed = 0
+        self._latencies = deque(maxlen=self.latencies)
+        self._stats_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Process pool, created on its first use (on each process)"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method)
+                )
+            return self._executor
+
+    def submit(self, fn, *args) -> Future:
+        """Submit a render job (fn and its arguments must be picklable), without waiting for it.
+        Raises RenderServiceBusyException if the pool and its queue are full"""
+        if not self._slots.acquire(blocking=False):
+            raise RenderServiceBusyException()
+
+        submitted = time.perf_counter()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # A render process died (e.g. killed when out of memory): the pool is created again on the next render
+            with self._executor_lock:
+                self._executor = None
+            self._slots.release()
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        with self._stats_lock:
+            self._pending += 1
+        future.add_done_callback(lambda done: self._done(done, submitted))
+        return future
+
+    def _done(self, future: Future, submitted: float):
+        self._slots.release()
+        with self._stats_lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._failed += 1
+            else:
+                self._rendered += 1
+                self._latencies.append(time.perf_counter() - submitted)
+
+    def _result(self, future: Future):
+        """Wait for the result of a render. If it takes longer than the timeout, it is cancelled (if not started yet)"""
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise RenderServiceBusyException()
+
+    def wait(self, futures: List[Future]) -> list:
+        """Wait for the results of the given renders, in the same order"""
+        return [self._result(future) for future in futures]
+
+    def render(self, fn, *args):
+        """Render an image on the pool, waiting for it (blocking)"""
+        return self._result(self.submit(fn, *args))
+
+    def render_many(self, fn, args: List[tuple]) -> list:
+        """Render many images on the pool in parallel, waiting for all of them (blocking)"""
+        return self.wait([self.submit(fn, *job_args) for job_args in args])
+
+    def stats(self) -> dict:
+        """Renders pending (queued or running), rendered and failed, and latency of the last renders
+        (from submitted to done, in milliseconds)"""
+        with self._stats_lock:
+            latencies = [latency * 1000 for latency in self._latencies]
+            stats = {
+                "workers": self.workers,
+                "pending": self._pending,
+                "rendered": self._rendered,
+                "failed": self._failed
+            }
+
+        stats["latency_ms"] = {
+            "p50": median(latencies) if latencies else None,
+            "p99": quantiles(latencies, n=100, method="inclusive")[98] if len(latencies) > 1 else None,
+            "max": max(latencies) if latencies else None
+        }
+        return stats
+
+    def shutdown(self):
+        """Stop the process pool, waiting for the running renders. It is created again if used afterwards"""
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+render_executor = RenderExecutor(
+    workers=settings.workers,
+    queue_size=settings.queue_size,
+    timeout=settings.timeout,
+    start_method=settings.start_method
+)
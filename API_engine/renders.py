@@ -0,0 +1,172 @@
+"""RENDERS
+Content-addressed cache of the rendered quote images. Each image is stored once, named after the hash of its text
+and render style, on a folder served by the file server, so the same quote is rendered once and its URL shared by
+all the users. The cache size on disk is limited, removing the least recently used images first
+(images whose URL was given recently are the last ones to be removed)
+"""
+
+# # Native # #
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import suppress
+from typing import Callable, Dict, List, Optional, Tuple
+
+# # Package # #
+from .settings import render_settings as settings
+from .settings import server_settings
+
+__all__ = ("RenderCache", "quote_renders")
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    def __init__(self, folder: str, url: str, max_size: int, style: str, extension: str = "jpg",
+                 temp_timeout: float = settings.timeout):
+        self.folder = folder
+        self.url = url
+        self.max_size = max_size
+        self.style = style
+        self.extension = extension
+        self.temp_timeout = temp_timeout
+        """Seconds after which a temporary file is of a render that failed (e.g. cancelled, but finished later)"""
+        self._files: Optional[Dict[str, int]] = None
+        """Size of the cached files, by key, from the least to the most recently used"""
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_key(self, text: str) -> str:
+        """Key of the image of a text: hash of the render style and the text"""
+        return hashlib.sha256(f"{self.style}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.{self.extension}")
+
+    def get_url(self, key: str) -> str:
+        return f"{self.url}{key}.{self.extension}"
+
+    def load(self):
+        """Index the images already cached on disk, from the least to the most recently used (blocking).
+        The temporary files of renders that failed are removed"""
+        os.makedirs(self.folder, exist_ok=True)
+        files = list()
+        stale = time.time() - self.temp_timeout
+        for entry in os.scandir(self.folder):
+            if not entry.is_file():
+                continue
+            with suppress(FileNotFoundError):
+                stat = entry.stat()
+                if entry.name.endswith("." + self.extension):
+                    files.append((stat.st_mtime, entry.name[:-len(self.extension) - 1], stat.st_size))
+                elif entry.name.endswith(".tmp") and stat.st_mtime < stale:
+                    os.remove(entry.path)
+
+        with self._lock:
+            self._files = OrderedDict((key, size) for _, key, size in sorted(files))
+            self._size = sum(self._files.values())
+            evicted = self._evict()
+        self._remove(evicted)
+        logger.info("Indexed %d cached renders (%d bytes) on %s", len(files), self._size, self.folder)
+
+    def _get_files(self) -> Dict[str, int]:
+        if self._files is None:
+            self.load()
+        return self._files
+
+    def _evict(self) -> list:
+        """Remove the least recently used keys until the cache fits its max size. Returns the keys removed.
+        Must be called with the lock acquired"""
+        evicted = list()
+        while self._size > self.max_size and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _remove(self, keys: list):
+        for key in keys:
+            try:
+                os.remove(self.get_path(key))
+            except FileNotFoundError:
+                pass
+
+    def get(self, text: str, render: Callable[[str], None]) -> str:
+        """URL of the image of a text. If not cached, the image is rendered by calling render with the path
+        to write it to (blocking), and then added to the cache"""
+        return self.get_many([text], lambda jobs: [render(path) for _, path in jobs])[0]
+
+    def get_many(self, texts: List[str], render: Callable[[List[Tuple[str, str]]], None]) -> List[str]:
+        """URLs of the images of many texts, in the same order. The images not cached are rendered at once,
+        by calling render with the text and the path to write it to of each image (blocking), and then added"""
+        files = self._get_files()
+        keys = [self.get_key(text) for text in texts]
+        missing = dict()
+        for key, text in zip(keys, texts):
+            if key in missing:
+                continue
+            with self._lock:
+                cached = key in files
+                if cached:
+                    files.move_to_end(key)
+
+            # The file could have been removed by another process sharing the folder
+            path = self.get_path(key)
+            if cached and os.path.exists(path):
+                os.utime(path)
+                with self._lock:
+                    self.hits += 1
+            else:
+                missing[key] = text
+
+        if missing:
+            temp_paths = {key: f"{self.get_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp" for key in missing}
+            sizes = dict()
+            try:
+                render([(missing[key], temp_paths[key]) for key in missing])
+                for key in missing:
+                    os.replace(temp_paths.pop(key), self.get_path(key))
+                    sizes[key] = os.path.getsize(self.get_path(key))
+            finally:
+                # If a render failed, the images rendered are not kept (the renders still running, if cancelled,
+                # are removed when loaded again)
+                for temp_path in temp_paths.values():
+                    with suppress(FileNotFoundError):
+                        os.remove(temp_path)
+
+            with self._lock:
+                self.misses += len(missing)
+                for key, size in sizes.items():
+                    self._size += size - files.pop(key, 0)
+                    files[key] = size
+                evicted = self._evict()
+            self._remove(evicted)
+
+        return [self.get_url(key) for key in keys]
+
+    def stats(self) -> dict:
+        """Hits, misses and hit rate of the cache, images evicted, and images and bytes cached"""
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else None,
+            "evictions": self.evictions,
+            "files": len(self._files or ()),
+            "size": self._size
+        }
+
+
+quote_renders = RenderCache(
+    folder=settings.quotes_folder,
+    url=server_settings.ftp_server + settings.quotes_path,
+    max_size=settings.quotes_max_size,
+    style=settings.quotes_style
+)
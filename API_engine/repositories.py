@@ -1,57 +1,142 @@
 """REPOSITORIES
-Methods to interact with the database
+Methods to interact with the database. The routes use the async versions of the Users, Doctor and Music repositories
+(async_repositories.py), with the same queries and updates: their blocking versions here are used by the maintenance
+commands, the background workers and the tests, and the other repositories by the routes that generate images.
+The notes are only added by the API (as pending, see AsyncUsersRepository.add_note), so they have no blocking version
 """
 
 # # Installed # #
-import bcrypt
-import text2emotion as te
+from pymongo import UpdateOne, UpdateMany, ReplaceOne, ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
 from fastapi.responses import JSONResponse
-import wikiquote
-from quote2image import generate
 from wordcloud import WordCloud
 
 # # Package # #
 from .models import *
 from .exceptions import *
-from .database import users, doctors, musics
-from .utils import get_time, get_uuid, get_week_timestamp, timestamp
+from .passwords import password_executor
+from .classifier import emotion_classifier
+from .quotes import quote_store
+from .catalog import music_catalog
+from .renders import quote_renders
+from .renderer import render_executor, render_quote_image, render_wordcloud
+from .sessions import create_token
+from .database import users, doctors, musics, emotions, emotion_weeks, note_words
+from .utils import get_time, get_uuid, get_day_timestamp, get_iso_week, parse_timestamp
 from .settings import server_settings as settings
+from .settings import api_settings, therapy_settings
 
 # # Native # #
 import os
+import time
 import shutil
+import hashlib
+from contextlib import suppress
+from collections import Counter
+from datetime import date
+from concurrent.futures import Future
+from typing import Dict, List, Iterator, Iterable, Optional, Tuple, Union
 
-__all__ = ("UsersRepository", "DeepFakeRepository", "TherapyRepository", "DoctorRepository", "MusicRepository")
+__all__ = (
+    "UsersRepository", "EmotionsRepository", "NoteWordsRepository", "DeepFakeRepository",
+    "TherapyRepository", "DoctorRepository", "MusicRepository"
+)
+
+
+def find_page(collection, projection: dict = None, limit: int = None, after: str = None):
+    """Find the documents of a collection sorted by their _id, starting after the given _id (keyset pagination).
+    Returns the pymongo cursor"""
+    query = {"_id": {"$gt": after}} if after else {}
+    cursor = collection.find(query, projection).sort("_id", ASCENDING)
+    if limit:
+        cursor = cursor.limit(limit)
+    return cursor
+
+
+def render_quotes(quotes: List[Tuple[str, str]]) -> List[str]:
+    """URLs of the images of quotes and their titles. Those not cached are rendered in parallel on the render
+    service (see renders.py and renderer.py)"""
+    return quote_renders.get_many(
+        [quote + '\n' + title for quote, title in quotes],
+        lambda jobs: render_executor.render_many(render_quote_image, jobs)
+    )
 
 
 class UsersRepository:
+    READ_PROJECTION = {"password": 0}
+    """Mongo projection of the users read with all their fields (the password is never returned)"""
+
     @staticmethod
-    def get(user_id: str) -> UserRead:
-        """Retrieve a single User by its unique id"""
-        document = users.find_one({"_id": user_id})
+    def get_projection(fields: List[str]) -> dict:
+        """Mongo projection to read only the given fields of UserRead"""
+        invalid = [field for field in fields if field not in UserRead.__fields__]
+        if invalid:
+            raise InvalidFieldsException(identifier=",".join(invalid))
+
+        projection = {field: 1 for field in fields if field not in ("user_id", "age")}
+        if "age" in fields:
+            projection["birth"] = 1
+        return projection
+
+    @staticmethod
+    def get_partial(document: dict, fields: List[str]) -> UserRead:
+        """Build a UserRead with only the given fields (plus the user_id), from a document read with a projection.
+        The document is not validated, as it comes from the database"""
+        values = {field: document[field] for field in fields if field in document}
+        values["user_id"] = document["_id"]
+        if "age" in fields and document.get("birth"):
+            values["age"] = get_age(date.fromisoformat(document["birth"]))
+        return UserRead.construct_trusted(values)
+
+    @staticmethod
+    def get(user_id: str, fields: List[str] = None) -> UserRead:
+        """Retrieve a single User by its unique id. If fields are given, only those fields are read"""
+        projection = UsersRepository.get_projection(fields) if fields else UsersRepository.READ_PROJECTION
+        document = users.find_one({"_id": user_id}, projection)
         if not document:
             raise UserNotFoundException(user_id)
-        return UserRead(**document)
+        if fields:
+            return UsersRepository.get_partial(document, fields)
+        return UserRead.from_document(document)
     
     @staticmethod
     def login(email: str, password: str):
-        """Retrieve a single User by its unique id"""
+        """Verify the password of a User, given its email, and issue a session token"""
         document = users.find_one({"email": email})
         if not document:
             raise UserNotFoundException(email)
-        if bcrypt.hashpw(password.encode('utf-8'), document['password']) != document['password']:
+        if not password_executor.check(password, document['password']):
             raise InvalidUserPasswordException(email)
+
+        token, expires = create_token(document["_id"])
         return {
             "status": True,
             "_id": document["_id"],
-            "email": document["email"]
+            "email": document["email"],
+            "token": token,
+            "expires": expires
             }
 
     @staticmethod
-    def list() -> UsersRead:
-        """Retrieve all the available users"""
-        cursor = users.find()
-        return [UserRead(**document) for document in cursor]
+    def list(fields: List[str] = None, limit: int = None, after: str = None) -> UsersRead:
+        """Retrieve the available users, sorted by their id. If fields are given, only those fields are read.
+        If limit is given, only that number of users are returned, starting after the given user id"""
+        if fields:
+            cursor = find_page(users, UsersRepository.get_projection(fields), limit, after)
+            return [UsersRepository.get_partial(document, fields) for document in cursor]
+        cursor = find_page(users, UsersRepository.READ_PROJECTION, limit, after)
+        return [UserRead.from_document(document) for document in cursor]
+
+    @staticmethod
+    def stream(fields: List[str] = None, after: str = None) -> Iterator[UserRead]:
+        """Iterate all the users, sorted by their id, starting after the given user id, reading them in batches.
+        If fields are given, only those fields are read. The fields are validated when called (not when iterated)"""
+        projection = UsersRepository.get_projection(fields) if fields else UsersRepository.READ_PROJECTION
+        cursor = find_page(users, projection, after=after).batch_size(api_settings.export_batch_size)
+        return (
+            UsersRepository.get_partial(document, fields) if fields else UserRead.from_document(document)
+            for document in cursor
+        )
 
     @staticmethod
     def create(create: UserCreate) -> UserRead:
@@ -59,56 +144,148 @@ class UsersRepository:
         document = create.dict()
         document["created"] = document["updated"] = get_time()
         document["_id"] = get_uuid()
-        document["password"] = bcrypt.hashpw(document["password"].encode('utf-8'), bcrypt.gensalt())
+        if document.get("notes"):
+            UsersRepository.set_captured_at(document["notes"])
+        document["password"] = password_executor.hash(document["password"])
 
         # The time and id could be inserted as a model's Field default factory,
         # but would require having another model for Repository only to implement it
 
-        result = users.insert_one(document)
+        try:
+            result = users.insert_one(document)
+        except DuplicateKeyError:
+            raise UserAlreadyExistsException(identifier=document["email"])
         assert result.acknowledged
 
-        return UsersRepository.get(result.inserted_id)
+        if document.get("notes"):
+            NoteWordsRepository.push_many([{**note, "user_id": document["_id"]} for note in document["notes"]])
+        return UserRead.from_document(document)
 
     @staticmethod
     def update(user_id: str, update: UserUpdate):
         """Update a user by giving only the fields to update"""
         document = update.dict()
         document["updated"] = get_time()
+        if "notes" in document:
+            UsersRepository.set_captured_at(document["notes"])
 
         result = users.update_one({"_id": user_id}, {"$set": document})
         if not result.modified_count:
             raise UserNotFoundException(identifier=user_id)
+        if "notes" in document:
+            NoteWordsRepository.rebuild(user_id, document["notes"])
     
     @staticmethod
     def update_emotion(id: str, emotion: str, device: bool = False):
         """Update a user's emotion"""
         updated = get_time()
-        user_id = id
-        if device:
-            user_id = users.find_one({"device_id": id})['_id']
-
-        result = users.update_one({"_id": user_id}, {"$push": {
-            "states" : {
-                "emotion" :emotion.lower(),
-                "captured": updated
-            }
-        }})
-        result = users.update_one({"_id": user_id}, {"$set": {
-            "current_emotion" : emotion.lower(),
-            "updated": updated
-        }})
 
-        if not result.modified_count:
-            raise UserNotFoundException(identifier=user_id)
-        
-        return UsersRepository.get(user_id)
+        document = users.find_one_and_update(
+            {"device_id" if device else "_id": id},
+            {"$set": {
+                "current_emotion" : emotion.lower(),
+                "updated": updated
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            raise UserNotFoundException(identifier=id)
+
+        EmotionsRepository.push(document["_id"], emotion.lower(), updated)
+
+        return UserRead.from_document(document)
     
+    @staticmethod
+    def update_emotions(events: List[EmotionEvent]) -> List[dict]:
+        """Apply many emotion events, of many users or devices, at once.
+        Users and devices are resolved with a single query, the current emotion of each user is set once
+        (with the latest captured event), and the states are appended with a single bulk write.
+        Returns the status of each event, in the same order"""
+        documents = users.find(UsersRepository.get_events_query(events), {"_id": 1, "device_id": 1})
+        statuses, states = UsersRepository.resolve_events(events, documents)
+        UsersRepository.apply_emotions(states)
+        return statuses
+
+    @staticmethod
+    def get_events_query(events: List[EmotionEvent]) -> dict:
+        """Mongo query to find, at once, the users and devices of many emotion events"""
+        user_ids = list({event.user_id for event in events if event.user_id})
+        device_ids = list({event.device_id for event in events if event.device_id})
+        return {"$or": [{"_id": {"$in": user_ids}}, {"device_id": {"$in": device_ids}}]}
+
+    @staticmethod
+    def resolve_events(events: List[EmotionEvent], documents: Iterable[dict]) -> Tuple[List[dict], List[dict]]:
+        """Resolve the user of each emotion event, given the user documents found (with _id and device_id).
+        Returns the status of each event, in the same order, and the states of the events whose user was found"""
+        updated = get_time()
+        found_users = set()
+        found_devices = dict()
+        for document in documents:
+            found_users.add(document["_id"])
+            if document.get("device_id"):
+                found_devices[document["device_id"]] = document["_id"]
+
+        statuses = list()
+        states = list()
+        for event in events:
+            user_id = event.user_id if event.user_id in found_users else found_devices.get(event.device_id)
+            if not user_id:
+                statuses.append({"status": "not_found"})
+                continue
+
+            states.append({"user_id": user_id, "emotion": event.emotion.lower(), "captured": event.captured or updated})
+            statuses.append({"status": "ok"})
+
+        return statuses, states
+
+    @staticmethod
+    def apply_emotions(states: List[dict]):
+        """Write many emotion states (dicts with user_id, emotion and captured) of existing users:
+        the current emotion of each user is set once (with the latest captured state),
+        and the states are appended with a single bulk write"""
+        operations = UsersRepository.get_emotions_operations(states)
+        if not operations:
+            return
+
+        users.bulk_write(operations, ordered=False)
+        EmotionsRepository.push_many(states)
+
+    @staticmethod
+    def get_emotions_operations(states: List[dict]) -> List[UpdateOne]:
+        """Bulk write operations that set the current emotion of each user of the states, once per user
+        (with the latest captured state)"""
+        latest = dict()
+        for state in states:
+            if state["user_id"] not in latest or state["captured"] >= latest[state["user_id"]]["captured"]:
+                latest[state["user_id"]] = state
+
+        updated = get_time()
+        return [
+            UpdateOne({"_id": user_id}, {"$set": {
+                "current_emotion": state["emotion"],
+                "updated": updated
+            }})
+            for user_id, state in latest.items()
+        ]
+
+    @staticmethod
+    def get_device_user_id(device_id: str) -> str:
+        """Retrieve the unique id of the User an Emoup Device belongs to"""
+        document = users.find_one({"device_id": device_id}, {"_id": 1})
+        if not document:
+            raise UserNotFoundException(device_id)
+        return document["_id"]
+
     @staticmethod
     def emotion_analysis(user_id: str, map = False):
         """User's Emotion Analysis"""
-        
-        document = users.find_one({"_id": user_id})
-        if 'states' not in document.keys():
+        if map:
+            return EmotionsRepository.count(user_id)
+
+        document = users.find_one({"_id": user_id}, {"name": 1, "current_emotion": 1})
+        if not document:
+            raise UserNotFoundException(user_id)
+        if 'current_emotion' not in document.keys():
              return JSONResponse(
                 content={
                     'message' : "Capture emotion first"
@@ -116,103 +293,197 @@ class UsersRepository:
                 status_code=404
             )
 
-        emotions = document['states'][::-1]
-        notes = document['notes'][::-1] if 'notes' in document.keys() else []
-
-        start,end  = get_week_timestamp()
-
-        emotion_map = {}
-        for emotion in emotions:
-            if start <= emotion['captured'] <= end:
-                if emotion['emotion'] in emotion_map:
-                    emotion_map[emotion['emotion']] += 1
-                else:
-                    emotion_map[emotion['emotion']] = 1
-            else:
-                break  
-        if map:
-            return emotion_map
+        emotion_map = EmotionsRepository.count(user_id)
 
-        notes_txt = 'Hello I am ' + document['name'] + "."
-        for note in notes:
-            time = timestamp(note['captured'])
-            if start <= time <= end:
-                notes_txt+=note['note'] +' '
-            else:
-                break  
-        
-        wordcloud = WordCloud().generate(notes_txt).to_image()
-
-        quote = '7'*81
-        while len(quote) > 80:
-            try:
-                title = wikiquote.random_titles(max_titles=1)[0]
-                quote = wikiquote.quotes(title, max_quotes=1)[0]
-            except:
-                quote = '7'*81
-                
-        img = generate.main(quote + '\n' + title)
-        
-        folder_path = 'Uploads/' + user_id + '/'
-        if not os.path.isdir(folder_path):
-            os.mkdir(folder_path)
-        
-        wordcloud.save(folder_path + 'wordcloud.jpg')
-        img.save(folder_path + 'quote.jpg')
+        # The word cloud is rendered (if its notes changed) while the quote is rendered (or found on the cache)
+        wordcloud_url, wordcloud = NoteWordsRepository.submit_wordcloud(user_id, document['name'])
+        quote_url, = render_quotes([quote_store.sample(mood=document['current_emotion'])])
+        if wordcloud:
+            render_executor.wait([wordcloud])
         return JSONResponse(
                 content={
                     'emotion' : emotion_map,
-                    'message' : settings.ftp_server + user_id + '/quote.jpg',
-                    'wordcloud' : settings.ftp_server + user_id + '/wordcloud.jpg'
+                    'message' : quote_url,
+                    'wordcloud' : wordcloud_url
                 },
                 status_code=200
             )
     
     @staticmethod
-    def add_note(user_id: str, note: Note):
-        """Update a user's note"""
-        note = note.dict()
-        updated = get_time()
-        
-        result = users.update_one({"_id": user_id}, {"$push": {
-            "notes" : {
-                "note" :note['note'],
-                "captured": note['captured'],
-                "color": note['color'],
+    def get_captured_at(captured: str) -> int:
+        """Capture time of a note (Unix timestamp), parsed from its captured text when the note is added,
+        or the current time if the text is not a date"""
+        captured_at = parse_timestamp(captured)
+        return captured_at if captured_at is not None else get_time()
+
+    @staticmethod
+    def set_captured_at(notes: List[dict]) -> List[dict]:
+        """Set the capture time (Unix timestamp) of the notes of a created or updated user"""
+        for note in notes:
+            note["captured_at"] = UsersRepository.get_captured_at(note["captured"])
+        return notes
+
+    @staticmethod
+    def get_notes_pipeline(user_id: str, start: int = None, end: int = None) -> List[dict]:
+        """Aggregation pipeline that returns the notes of a user captured between start and end
+        (both optional and inclusive), filtered by their capture time"""
+        conditions = list()
+        if start is not None:
+            conditions.append({"$gte": ["$$note.captured_at", start]})
+        if end is not None:
+            conditions.append({"$lte": ["$$note.captured_at", end]})
+
+        return [
+            {"$match": {"_id": user_id}},
+            {"$project": {"notes": {"$filter": {
+                "input": {"$ifNull": ["$notes", []]},
+                "as": "note",
+                "cond": {"$and": conditions}
+            }}}}
+        ]
+
+    @staticmethod
+    def list_notes(user_id: str, start: int = None, end: int = None) -> NotesRead:
+        """Retrieve the notes of a user, captured between start and end (both optional and inclusive)"""
+        documents = list(users.aggregate(UsersRepository.get_notes_pipeline(user_id, start, end)))
+        if not documents:
+            raise UserNotFoundException(user_id)
+        return [NoteRead.construct_trusted(note) for note in documents[0]["notes"]]
+
+    @staticmethod
+    def migrate_notes() -> int:
+        """Set the capture time (Unix timestamp, parsed from captured) of the notes added before it was stored,
+        with one update per user that only sets the capture time of each note without it (by its position, so notes
+        added meanwhile are kept). Notes whose captured text is not a date get a null capture time, so they are not
+        migrated again. Returns the number of migrated users"""
+        migrated = 0
+        query = {"notes": {"$elemMatch": {"captured_at": {"$exists": False}}}}
+        for document in users.find(query, {"notes.captured": 1, "notes.captured_at": 1}):
+            users.update_one({"_id": document["_id"]}, {"$set": {
+                f"notes.{i}.captured_at": parse_timestamp(note["captured"])
+                for i, note in enumerate(document["notes"])
+                if "captured_at" not in note
+            }})
+            migrated += 1
+        return migrated
+
+    @staticmethod
+    def get_note_document(note: dict, status: str, emotions: List[str] = None) -> dict:
+        """Document of a note added to a user, with the given status (pending, classified or failed)"""
+        document = {
+            "note": note['note'],
+            "captured": note['captured'],
+            "captured_at": UsersRepository.get_captured_at(note['captured']),
+            "color": note['color'],
+            "note_id": get_uuid(),
+            "status": status
+        }
+        if emotions is not None:
+            document["emotions"] = emotions
+        return document
+
+    @staticmethod
+    def get_claim_update(claim_id: str, claimed: int) -> Tuple[dict, List[dict]]:
+        """Mongo update (and its array filters) that claims the pending notes of the matched users to be processed,
+        setting them as processing with the given claim id, so each note is processed by a single batch"""
+        return (
+            {"$set": {
+                "notes.$[note].status": "processing",
+                "notes.$[note].claim_id": claim_id,
+                "notes.$[note].claimed": claimed
+            }},
+            [{"note.status": "pending", "note.note_id": {"$exists": True}}]
+        )
+
+    @staticmethod
+    def get_release_update(claimed_before: int) -> Tuple[dict, dict, List[dict]]:
+        """Mongo query, update and array filters that set as pending again the notes claimed before the given time
+        (e.g. by a process that was stopped while processing them)"""
+        stale = {"status": "processing", "claimed": {"$lt": claimed_before}}
+        return (
+            {"notes": {"$elemMatch": stale}},
+            {
+                "$set": {"notes.$[note].status": "pending"},
+                "$unset": {"notes.$[note].claim_id": "", "notes.$[note].claimed": ""}
+            },
+            [{f"note.{key}": value for key, value in stale.items()}]
+        )
+
+    @staticmethod
+    def get_claimed_notes(documents: Iterable[dict], claim_id: str) -> List[dict]:
+        """Notes claimed with the given claim id (see get_claim_update) of the given user documents (with _id and notes),
+        as dicts with the user_id, note_id, note (text) and captured_at of each note"""
+        return [
+            {
+                "user_id": document["_id"], "note_id": note["note_id"], "note": note["note"],
+                "captured_at": note.get("captured_at")
             }
-        }})
+            for document in documents
+            for note in document.get("notes") or []
+            if note.get("status") == "processing" and note.get("claim_id") == claim_id
+        ]
 
-        emotion = te.get_emotion(note['note'])
-        avg_emotion = sum(emotion.values()) / len(emotion)
-        for i in emotion:
-            if emotion[i] >= avg_emotion:
-                UsersRepository.update_emotion(user_id, i.lower())
+    @staticmethod
+    def get_notes_operations(
+            notes: List[dict], claim_id: str, emotions: List[List[str]] = None
+    ) -> Tuple[List[UpdateOne], List[dict]]:
+        """Bulk write operations that set the status and emotions of processed notes (see get_claimed_notes),
+        given the emotions of each note, in the same order, or None if they could not be classified (failed).
+        Each note is only updated while it keeps the claim of the batch. The current emotion of each user is set once,
+        from its latest note. Returns the operations and the emotion states of the notes"""
+        updated = get_time()
+        operations = list()
+        states = list()
+        for i, note in enumerate(notes):
+            if emotions is None:
+                update = {"notes.$.status": "failed"}
+            else:
+                update = {"notes.$.status": "classified", "notes.$.emotions": emotions[i]}
+                states.extend({"user_id": note["user_id"], "emotion": state, "captured": updated} for state in emotions[i])
+            operations.append(UpdateOne(
+                {"_id": note["user_id"], "notes": {"$elemMatch": {"note_id": note["note_id"], "claim_id": claim_id}}},
+                {"$set": update, "$unset": {"notes.$.claim_id": "", "notes.$.claimed": ""}}
+            ))
 
-        if not result.modified_count:
-            raise UserNotFoundException(identifier=user_id)
-        
-        return UsersRepository.get(user_id)
-        
+        return operations + UsersRepository.get_emotions_operations(states), states
 
     @staticmethod
     def delete(user_id: str):
-        """Delete a user given its unique id"""
+        """Delete a user given its unique id, with its emotion buckets, weekly counters and word frequencies"""
         result = users.delete_one({"_id": user_id})
         if not result.deleted_count:
             raise UserNotFoundException(identifier=user_id)
 
+        for collection in (emotions, emotion_weeks, note_words):
+            collection.delete_many({"user_id": user_id})
+
+    @staticmethod
+    def raise_not_updated(user_id: str, field: str):
+        """Raise the error of an update of a user that requires a field (filtered by it) and did not match:
+        UserNotFoundException if the user does not exist, otherwise UserFieldRequiredException"""
+        if not users.count_documents({"_id": user_id}, limit=1):
+            raise UserNotFoundException(user_id)
+        raise UserFieldRequiredException(identifier=field)
+
     @staticmethod
     def add_profile_pic(picture, user_id):
         """Profile Picture uploaded by user"""
         path = "Uploads/"
-        document = users.find_one({"_id": user_id})
-        if not document:
-            raise UserNotFoundException(user_id)
-        
-        name = document['name']
         extension = picture.filename.split('.')[-1]
 
-        filename = name + '.' + extension
+        # The file is named after the user, so the URL is built on the update itself (pipeline update)
+        document = users.find_one_and_update(
+            {"_id": user_id, "name": {"$exists": True}},
+            [{"$set": {
+                "profile_pic": {"$concat": [settings.ftp_server + user_id + "/", "$name", "." + extension]},
+                "updated": get_time()
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            UsersRepository.raise_not_updated(user_id, "name")
+
+        filename = document['name'] + '.' + extension
         folder_path = path + user_id + "/"
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
@@ -220,91 +491,383 @@ class UsersRepository:
         with open(folder_path + filename, "wb") as buffer:
             shutil.copyfileobj(picture.file, buffer)
 
-        updated = get_time()
-        profile_pic = settings.ftp_server + user_id + "/" + filename
-        result = users.update_one({"_id": user_id}, {"$set": {
-            "profile_pic": profile_pic,
-            'updated': updated
-            }
-        })
-        
-        return UsersRepository.get(user_id)
+        return UserRead.from_document(document)
         
+class EmotionsRepository:
+    """Emotion states of the users, stored on fixed-size time buckets (one document per user per day),
+    instead of an ever-growing array on the user document"""
+
+    @staticmethod
+    def get_bucket_id(user_id: str, day: int) -> str:
+        """Unique id of the bucket that holds the states of a user on a day"""
+        return user_id + ':' + str(day)
+
+    @staticmethod
+    def get_week_id(user_id: str, week: str) -> str:
+        """Unique id of the document that holds the emotion counters of a user on an ISO week"""
+        return user_id + ':' + week
+
+    @staticmethod
+    def push(user_id: str, emotion: str, captured: int):
+        """Append an emotion state to the bucket it belongs to, creating the bucket if needed,
+        and increase the counter of the emotion on the week it was captured"""
+        EmotionsRepository.push_many([{"user_id": user_id, "emotion": emotion, "captured": captured}])
+
+    @staticmethod
+    def push_many(states: List[dict]):
+        """Append many emotion states (dicts with user_id, emotion and captured) to their buckets and weekly counters,
+        using a single bulk write per collection. States that belong to the same bucket or week are grouped together"""
+        bucket_operations, week_operations = EmotionsRepository.get_push_operations(states)
+        if not bucket_operations:
+            return
+
+        emotions.bulk_write(bucket_operations, ordered=False)
+        emotion_weeks.bulk_write(week_operations, ordered=False)
+
+    @staticmethod
+    def get_push_operations(states: List[dict]) -> Tuple[List[UpdateOne], List[UpdateOne]]:
+        """Bulk write operations that append the states to their buckets, and increase their weekly counters.
+        Returns (bucket operations, week operations)"""
+        buckets = dict()
+        weeks = dict()
+        for state in states:
+            day = get_day_timestamp(state["captured"])
+            bucket = buckets.setdefault((state["user_id"], day), [])
+            bucket.append({"emotion": state["emotion"], "captured": state["captured"]})
+
+            counts = weeks.setdefault((state["user_id"], get_iso_week(state["captured"])), {})
+            counts["counts." + state["emotion"]] = counts.get("counts." + state["emotion"], 0) + 1
+
+        bucket_operations = [
+            UpdateOne(
+                {"_id": EmotionsRepository.get_bucket_id(user_id, day)},
+                {
+                    "$push": {"states": {"$each": bucket}},
+                    "$setOnInsert": {"user_id": user_id, "day": day}
+                },
+                upsert=True
+            )
+            for (user_id, day), bucket in buckets.items()
+        ]
+        week_operations = [
+            UpdateOne(
+                {"_id": EmotionsRepository.get_week_id(user_id, week)},
+                {
+                    "$inc": counts,
+                    "$setOnInsert": {"user_id": user_id, "week": week}
+                },
+                upsert=True
+            )
+            for (user_id, week), counts in weeks.items()
+        ]
+        return bucket_operations, week_operations
+
+    @staticmethod
+    def count(user_id: str, week: str = None) -> dict:
+        """Retrieve how many times each emotion was captured for a user on an ISO week (current week by default)"""
+        document = emotion_weeks.find_one(
+            {"_id": EmotionsRepository.get_week_id(user_id, week or get_iso_week())},
+            {"counts": 1}
+        )
+        return document["counts"] if document else {}
+
+    @staticmethod
+    def list(user_id: str, start: int = None, end: int = None) -> List[Emotion]:
+        """Retrieve the emotion states of a user, captured between start and end (both optional and inclusive),
+        sorted from oldest to newest. Only the buckets that overlap the interval are read"""
+        buckets = emotions.find(EmotionsRepository.get_list_query(user_id, start, end)).sort("day", ASCENDING)
+        return EmotionsRepository.get_states(buckets, start, end)
+
+    @staticmethod
+    def get_list_query(user_id: str, start: int = None, end: int = None) -> dict:
+        """Mongo query to find the buckets of a user that overlap the interval between start and end"""
+        query = {"user_id": user_id}
+        if start is not None:
+            query.setdefault("day", {})["$gte"] = get_day_timestamp(start)
+        if end is not None:
+            query.setdefault("day", {})["$lte"] = end
+        return query
+
+    @staticmethod
+    def get_states(buckets: Iterable[dict], start: int = None, end: int = None) -> List[Emotion]:
+        """Emotion states of the given buckets (sorted by day), captured between start and end"""
+        states = list()
+        for bucket in buckets:
+            for state in bucket["states"]:
+                if start is not None and state["captured"] < start:
+                    continue
+                if end is not None and state["captured"] > end:
+                    continue
+                states.append(Emotion(**state))
+        return states
+
+    @staticmethod
+    def migrate() -> int:
+        """Move the states array of every user document to the buckets. Users are migrated one at a time, and only
+        the states read from the user document are removed from it (after the buckets are written), so the states
+        appended meanwhile are migrated by the next run. The migration can be resumed: the states already found
+        on their bucket (same emotion and capture time, by a previous interrupted run) are not written again.
+        Returns the number of migrated users"""
+        migrated = 0
+        for document in users.find({"states": {"$exists": True}}, {"states": 1}):
+            buckets = dict()
+            for state in document["states"]:
+                buckets.setdefault(get_day_timestamp(state["captured"]), []).append(state)
+
+            written = Counter(
+                (state["emotion"], state["captured"])
+                for bucket in emotions.find({"user_id": document["_id"], "day": {"$in": list(buckets)}}, {"states": 1})
+                for state in bucket["states"]
+            )
+            operations = list()
+            for day, states in buckets.items():
+                missing = list()
+                for state in states:
+                    key = (state["emotion"], state["captured"])
+                    if written[key] > 0:
+                        written[key] -= 1
+                    else:
+                        missing.append(state)
+
+                if missing:
+                    operations.append(UpdateOne(
+                        {"_id": EmotionsRepository.get_bucket_id(document["_id"], day)},
+                        {
+                            "$push": {"states": {"$each": missing, "$sort": {"captured": 1}}},
+                            "$setOnInsert": {"user_id": document["_id"], "day": day}
+                        },
+                        upsert=True
+                    ))
+
+            if operations:
+                emotions.bulk_write(operations, ordered=False)
+            if document["states"]:
+                users.update_one({"_id": document["_id"]}, {"$pullAll": {"states": document["states"]}})
+            users.update_one({"_id": document["_id"], "states": {"$size": 0}}, {"$unset": {"states": ""}})
+            migrated += 1
+        return migrated
+
+    @staticmethod
+    def backfill_counters() -> int:
+        """Rebuild the weekly emotion counters of every user from the emotion buckets. The counters of each week
+        are replaced (or inserted) with the states read before, so the emotions counted by the API meanwhile are lost:
+        it must run with the ingestion of emotions paused (the API stopped).
+        Returns the number of users whose counters were rebuilt"""
+        rebuilt = 0
+        for user_id in emotions.distinct("user_id"):
+            weeks = dict()
+            for bucket in emotions.find({"user_id": user_id}, {"states": 1}):
+                for state in bucket["states"]:
+                    counts = weeks.setdefault(get_iso_week(state["captured"]), {})
+                    counts[state["emotion"]] = counts.get(state["emotion"], 0) + 1
+
+            if weeks:
+                emotion_weeks.bulk_write([
+                    ReplaceOne(
+                        {"_id": EmotionsRepository.get_week_id(user_id, week)},
+                        {"user_id": user_id, "week": week, "counts": counts},
+                        upsert=True
+                    )
+                    for week, counts in weeks.items()
+                ], ordered=False)
+            rebuilt += 1
+        return rebuilt
+
+
+class NoteWordsRepository:
+    """Frequency of the words of the notes of each user on each ISO week (by the note capture time),
+    used for the word cloud of the emotion analysis. Kept incrementally as notes are added, on the note_words
+    collection (one document per user per week), with a version increased on every change, so the word cloud
+    is rendered once per version"""
+
+    @staticmethod
+    def get_words(text: str) -> Dict[str, int]:
+        """Frequency of the words of a text, as counted by the word cloud (without stopwords).
+        Words are counted note by note, so words repeated on different notes are not paired as collocations"""
+        return WordCloud(collocations=False).process_text(text)
+
+    @staticmethod
+    def get_week_words(notes: List[dict]) -> Dict[Tuple[str, str], Dict[str, int]]:
+        """Frequency of the words of the notes (dicts with user_id, note and captured_at) of each user and week.
+        Notes without capture time (migrated notes whose captured text was not a date) are not counted"""
+        weeks = dict()
+        for note in notes:
+            if note.get("captured_at") is None:
+                continue
+
+            counts = weeks.setdefault((note["user_id"], get_iso_week(note["captured_at"])), {})
+            for word, count in NoteWordsRepository.get_words(note["note"]).items():
+                counts[word] = counts.get(word, 0) + count
+        return weeks
+
+    @staticmethod
+    def get_push_operations(notes: List[dict]) -> List[UpdateOne]:
+        """Bulk write operations that add the words of the notes (dicts with user_id, note and captured_at)
+        to the frequencies of their user and week. Notes of the same user and week are grouped together"""
+        return [
+            UpdateOne(
+                {"_id": EmotionsRepository.get_week_id(user_id, week)},
+                {
+                    "$inc": {**{"words." + word: count for word, count in counts.items()}, "version": 1},
+                    "$setOnInsert": {"user_id": user_id, "week": week}
+                },
+                upsert=True
+            )
+            for (user_id, week), counts in NoteWordsRepository.get_week_words(notes).items()
+        ]
+
+    @staticmethod
+    def get_rebuild_operations(user_id: str, notes: List[dict]) -> List[Union[UpdateOne, UpdateMany]]:
+        """Bulk write operations that replace the weekly word frequencies of a user with those of the given notes.
+        The documents are updated in place, increasing their version (the weeks without notes are emptied), so the
+        word clouds are rendered again, and never named as a previous render"""
+        weeks = NoteWordsRepository.get_week_words([{**note, "user_id": user_id} for note in notes])
+        week_ids = [EmotionsRepository.get_week_id(user_id, week) for _, week in weeks]
+        return [
+            UpdateMany(
+                {"user_id": user_id, "_id": {"$nin": week_ids}},
+                {"$set": {"words": {}}, "$inc": {"version": 1}}
+            ),
+            *(
+                UpdateOne(
+                    {"_id": week_id},
+                    {"$set": {"words": counts}, "$inc": {"version": 1}, "$setOnInsert": {"user_id": user_id, "week": week}},
+                    upsert=True
+                )
+                for week_id, ((_, week), counts) in zip(week_ids, weeks.items())
+            )
+        ]
+
+    @staticmethod
+    def push_many(notes: List[dict]):
+        """Add the words of many notes (dicts with user_id, note and captured_at) to their weekly frequencies,
+        using a single bulk write"""
+        operations = NoteWordsRepository.get_push_operations(notes)
+        if operations:
+            note_words.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def get(user_id: str, week: str = None) -> dict:
+        """Retrieve the frequencies of the words of a user on an ISO week (current week by default),
+        as a dict with words and version (empty and 0 if the user has no notes on the week)"""
+        document = note_words.find_one(
+            {"_id": EmotionsRepository.get_week_id(user_id, week or get_iso_week())},
+            {"words": 1, "version": 1}
+        )
+        return document or {"words": {}, "version": 0}
+
+    @staticmethod
+    def submit_wordcloud(user_id: str, name: str) -> Tuple[str, Optional[Future]]:
+        """URL of the word cloud of the notes of a user on the current week, introduced by the name of the user.
+        It is rendered (on the render service) only if its frequencies (or the name) changed since its last render,
+        otherwise the cached image is used. Returns the URL and the future of the render (None if cached)"""
+        week = get_iso_week()
+        document = NoteWordsRepository.get(user_id, week)
+        name_hash = hashlib.sha1(name.encode("utf-8")).hexdigest()[:8]
+        filename = f"wordcloud-{week}-{document['version']}-{name_hash}.jpg"
+        folder_path = 'Uploads/' + user_id + '/'
+        url = settings.ftp_server + user_id + '/' + filename
+        if os.path.exists(folder_path + filename):
+            return url, None
+
+        os.makedirs(folder_path, exist_ok=True)
+        # Word clouds of previous versions or weeks are not used anymore. Temporary files are renders in progress
+        # (of other requests), only removed when older than the render timeout (the render failed)
+        stale = time.time() - render_executor.timeout
+        for entry in os.scandir(folder_path):
+            if not entry.name.startswith("wordcloud-") or entry.name.startswith(filename):
+                continue
+            with suppress(FileNotFoundError):
+                if not entry.name.endswith(".tmp") or entry.stat().st_mtime < stale:
+                    os.remove(entry.path)
+
+        frequencies = NoteWordsRepository.get_words('Hello I am ' + name + '.')
+        for word, count in document["words"].items():
+            frequencies[word] = frequencies.get(word, 0) + count
+        return url, render_executor.submit(render_wordcloud, frequencies, folder_path + filename)
+
+    @staticmethod
+    def rebuild(user_id: str, notes: List[dict]):
+        """Rebuild the weekly word frequencies of a user from all its notes (e.g. when the notes are replaced),
+        with a single bulk write (see get_rebuild_operations)"""
+        note_words.bulk_write(NoteWordsRepository.get_rebuild_operations(user_id, notes), ordered=False)
+
+    @staticmethod
+    def backfill() -> int:
+        """Rebuild the weekly word frequencies of every user from their notes.
+        Returns the number of users whose frequencies were rebuilt"""
+        rebuilt = 0
+        for document in users.find({}, {"notes": 1}):
+            NoteWordsRepository.rebuild(document["_id"], document.get("notes") or [])
+            rebuilt += 1
+        return rebuilt
+
+
 class DeepFakeRepository:
 
     @staticmethod
     def add_deepfake_pic(picture, picture_name, user_id):
         """Picture uploaded by user for deepfake"""
         path = "Uploads/"
-        document = users.find_one({"_id": user_id})
-        if not document:
-            raise UserNotFoundException(user_id)
-        
-        name = document['name']
         extension = picture.filename.split('.')[-1]
 
         filename = picture_name + '.' + extension
-        folder_path = path + user_id + "/deepfake/"
-        if not os.path.isdir(folder_path):
-            os.mkdir(folder_path)
-        
-        updated = get_time()
         image = settings.ftp_server + user_id  + "/deepfake/" + filename
-        
-        result = users.update_one({"_id": user_id}, {"$set": {
-            "deepfake": {
-                'image' : image,
-                'name': filename
-            },
-            'updated': updated
-            }
-        })
-        
+
+        document = users.find_one_and_update(
+            {"_id": user_id},
+            {"$set": {
+                "deepfake": {
+                    'image' : image,
+                    'name': filename
+                },
+                'updated': get_time()
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            raise UserNotFoundException(user_id)
+
+        folder_path = path + user_id + "/deepfake/"
+        os.makedirs(folder_path, exist_ok=True)
+
         with open(folder_path + filename, "wb") as buffer:
             shutil.copyfileobj(picture.file, buffer)
 
-        return UsersRepository.get(user_id)
+        return UserRead.from_document(document)
     
     @staticmethod
     def add_deepfake_audio(audio, user_id):
         """Audio uploaded by user for deepfake"""
         path = "Uploads/"
-        document = users.find_one({"_id": user_id})
-        if not document:
-            raise UserNotFoundException(user_id)
-        
-        name = document['name']
         extension = audio.filename.split('.')[-1]
 
-        deepfake_name = document['deepfake']['name'].split('.')[0]
-        filename = deepfake_name + '.' + extension
+        # The audio is named after the deepfake picture, so the URL is built on the update itself (pipeline update)
+        deepfake_name = {"$arrayElemAt": [{"$split": ["$deepfake.name", "."]}, 0]}
+        document = users.find_one_and_update(
+            {"_id": user_id, "deepfake.name": {"$exists": True}},
+            [{"$set": {
+                "deepfake.voice": {"$concat": [settings.ftp_server + user_id + "/deepfake/", deepfake_name, "." + extension]},
+                "updated": get_time()
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
+        if not document:
+            UsersRepository.raise_not_updated(user_id, "deepfake.name")
+
+        filename = document['deepfake']['name'].split('.')[0] + '.' + extension
         folder_path = path + user_id + "/deepfake/"
-        if not os.path.isdir(folder_path):
-            os.mkdir(folder_path)
+        os.makedirs(folder_path, exist_ok=True)
 
         with open(folder_path + filename, "wb") as buffer:
             shutil.copyfileobj(audio.file, buffer)
 
-        updated = get_time()
-        audio = settings.ftp_server + user_id + "/deepfake/" + filename
-        
-        result = users.update_one({"_id": user_id}, {"$set": {
-            "deepfake.voice": audio,
-            'updated': updated
-            }
-        })
-        
-        return UsersRepository.get(user_id)
+        return UserRead.from_document(document)
     
     @staticmethod
     def deepfake(user_id):
         """Files uploaded by admin"""
         path = "Uploads/"
-        document = users.find_one({"_id": user_id})
-        if not document:
-            raise UserNotFoundException(user_id)
-        
-        name = document['name']
         folder_path = path + user_id + "/deepfake/"
 
         #deepfake()
@@ -315,27 +878,13 @@ class TherapyRepository:
     @staticmethod
     def music_recommendation(user_id):
         """Music Recommendation Engine through Emotion"""
-        document = users.find_one({"_id": user_id})
-        if not document:
-            raise UserNotFoundException(user_id)
-        
-        emotion_map = UsersRepository.emotion_analysis(user_id,True)
-        current_emotion = document['current_emotion']
-        cluster = 1
-        count = [1,4,5]
-        if current_emotion in ['sad', 'angry', 'disgust']:
-            cluster = 0
-            count = [3,4,3]
-        elif current_emotion in ['neutral', 'fear']:
-            cluster = 2
-            count = [1,6,3]
-        
-        cursor = [music for music in musics.find()]
-        import random
-        playlist = []
-        for i,v in enumerate(count):
-            playlist+=random.choices([a for a in cursor if a['cluster'] == str(i)], k=v)
-        
+        current_emotion = UsersRepository.get(user_id, fields=["current_emotion"]).current_emotion
+        counts = therapy_settings.music_counts.get(current_emotion, therapy_settings.music_default_counts)
+        if therapy_settings.music_recommendation_mode == "sample":
+            playlist = MusicRepository.sample_many(counts)
+        else:
+            playlist = music_catalog.sample_many(counts)
+
         return JSONResponse(
                 content={
                     'songs' : playlist
@@ -349,23 +898,7 @@ class TherapyRepository:
         
         document = users.find_one({"_id": user_id})
         
-        quotes = []
-        for i in range(5):
-            quote = '7'*81
-            while len(quote) > 80:
-                try:
-                    title = wikiquote.random_titles(max_titles=1)[0]
-                    quote = wikiquote.quotes(title, max_quotes=1)[0]
-                except:
-                    quote = '7'*81
-                    
-            img = generate.main(quote + '\n' + title)
-            folder_path = 'Uploads/' + user_id + '/'
-            if not os.path.isdir(folder_path):
-                os.mkdir(folder_path)
-
-            img.save(folder_path + 'quote' + str(i) + '.jpg')
-            quotes.append(settings.ftp_server + user_id + '/quote' + str(i) + '.jpg')
+        quotes = render_quotes(quote_store.sample_many(5))
 
         return JSONResponse(
                 content={
@@ -381,13 +914,21 @@ class DoctorRepository:
         document = doctors.find_one({"_id": doctor_id})
         if not document:
             raise DoctorNotFoundException(doctor_id)
-        return DoctorRead(**document)
+        return DoctorRead.from_document(document)
     
     @staticmethod
-    def list() -> DoctorsRead:
-        """Retrieve all the available doctors"""
-        cursor = doctors.find()
-        return [DoctorRead(**document) for document in cursor]
+    def list(limit: int = None, after: str = None) -> DoctorsRead:
+        """Retrieve the available doctors, sorted by their id.
+        If limit is given, only that number of doctors are returned, starting after the given doctor id"""
+        cursor = find_page(doctors, limit=limit, after=after)
+        return [DoctorRead.from_document(document) for document in cursor]
+
+    @staticmethod
+    def stream(after: str = None) -> Iterator[DoctorRead]:
+        """Iterate all the doctors, sorted by their id, starting after the given doctor id, reading them in batches"""
+        cursor = find_page(doctors, after=after).batch_size(api_settings.export_batch_size)
+        for document in cursor:
+            yield DoctorRead.from_document(document)
 
     @staticmethod
     def create(create: DoctorCreate) -> DoctorRead:
@@ -402,7 +943,7 @@ class DoctorRepository:
         result = doctors.insert_one(document)
         assert result.acknowledged
 
-        return DoctorRepository.get(result.inserted_id)
+        return DoctorRead.from_document(document)
 
     @staticmethod
     def update(doctor_id: str, update: DoctorUpdate):
@@ -425,14 +966,21 @@ class DoctorRepository:
     def add_profile_pic(picture, doctor_id):
         """Profile Picture uploaded by doctor"""
         path = "Uploads/"
-        document = doctors.find_one({"_id": doctor_id})
+        extension = picture.filename.split('.')[-1]
+
+        # The file is named after the doctor, so the URL is built on the update itself (pipeline update)
+        document = doctors.find_one_and_update(
+            {"_id": doctor_id},
+            [{"$set": {
+                "profile_pic": {"$concat": [settings.ftp_server + doctor_id + "/", "$name", "." + extension]},
+                "updated": get_time()
+            }}],
+            return_document=ReturnDocument.AFTER
+        )
         if not document:
             raise DoctorNotFoundException(doctor_id)
-        
-        name = document['name']
-        extension = picture.filename.split('.')[-1]
 
-        filename = name + '.' + extension
+        filename = document['name'] + '.' + extension
         folder_path = path + doctor_id + "/"
         if not os.path.isdir(folder_path):
             os.mkdir(folder_path)
@@ -440,15 +988,7 @@ class DoctorRepository:
         with open(folder_path + filename, "wb") as buffer:
             shutil.copyfileobj(picture.file, buffer)
 
-        updated = get_time()
-        profile_pic = settings.ftp_server + doctor_id + "/" + filename
-        result = doctors.update_one({"_id": doctor_id}, {"$set": {
-            "profile_pic": profile_pic,
-            'updated': updated
-            }
-        })
-        
-        return DoctorRepository.get(doctor_id)
+        return DoctorRead.from_document(document)
 
 class MusicRepository:
     @staticmethod
@@ -457,13 +997,44 @@ class MusicRepository:
         document = musics.find_one({"_id": music_id})
         if not document:
             raise MusicNotFoundException(music_id)
-        return MusicRead(**document)
+        return MusicRead.from_document(document)
     
     @staticmethod
-    def list() -> MusicsRead:
-        """Retrieve all the available musics"""
-        cursor = musics.find()
-        return [MusicRead(**document) for document in cursor]
+    def list(limit: int = None, after: str = None) -> MusicsRead:
+        """Retrieve the available musics, sorted by their id.
+        If limit is given, only that number of musics are returned, starting after the given music id"""
+        cursor = find_page(musics, limit=limit, after=after)
+        return [MusicRead.from_document(document) for document in cursor]
+
+    @staticmethod
+    def stream(after: str = None) -> Iterator[MusicRead]:
+        """Iterate all the musics, sorted by their id, starting after the given music id, reading them in batches"""
+        cursor = find_page(musics, after=after).batch_size(api_settings.export_batch_size)
+        for document in cursor:
+            yield MusicRead.from_document(document)
+
+    @staticmethod
+    def sample_many(counts: List[int]) -> List[dict]:
+        """Random musics of many clusters: as many different musics of each cluster ("0", "1", ...) as its count,
+        with their spotify_id and name. Sampled by Mongo, with a single aggregation"""
+        clusters = {str(cluster): k for cluster, k in enumerate(counts) if k > 0}
+        if not clusters:
+            return []
+
+        cursor = musics.aggregate([
+            {"$match": {"cluster": {"$in": list(clusters)}}},
+            {"$project": {"_id": 0, "cluster": 1, "spotify_id": 1, "name": 1}},
+            {"$facet": {
+                cluster: [
+                    {"$match": {"cluster": cluster}},
+                    {"$sample": {"size": k}},
+                    {"$project": {"spotify_id": 1, "name": 1}}
+                ]
+                for cluster, k in clusters.items()
+            }}
+        ])
+        sampled = next(cursor, dict())
+        return [music for cluster in clusters for music in sampled.get(cluster, [])]
 
     @staticmethod
     def create(create: MusicCreate) -> MusicRead:
@@ -477,8 +1048,9 @@ class MusicRepository:
 
         result = musics.insert_one(document)
         assert result.acknowledged
+        music_catalog.invalidate()
 
-        return MusicRepository.get(result.inserted_id)
+        return MusicRead.from_document(document)
 
     @staticmethod
     def update(music_id: str, update: MusicUpdate):
@@ -488,7 +1060,8 @@ class MusicRepository:
 
         result = musics.update_one({"_id": music_id}, {"$set": document})
         if not result.modified_count:
-            raise MusicNotFoundException(identifier=music_id)        
+            raise MusicNotFoundException(identifier=music_id)
+        music_catalog.invalidate()
 
     @staticmethod
     def delete(music_id: str):
@@ -496,3 +1069,4 @@ class MusicRepository:
         result = musics.delete_one({"_id": music_id})
         if not result.deleted_count:
             raise MusicNotFoundException(identifier=music_id)
+        music_catalog.invalidate()
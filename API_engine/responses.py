@@ -0,0 +1,69 @@
+"""RESPONSES
+Responses of Read objects created from our own database documents (trusted, see BaseModel.construct_trusted).
+They are serialised to JSON directly, skipping the validation of the route response_model,
+which would validate every object again
+"""
+
+# # Native # #
+import json
+from typing import Iterable, AsyncIterable, Union
+
+# # Installed # #
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic.json import pydantic_encoder
+
+# # Package # #
+from .models.common import BaseModel
+
+__all__ = ("ReadResponse", "PartialReadResponse", "NDJSON_MEDIA_TYPE", "ndjson_response")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _jsonable(value):
+    """Convert the Read objects in the value to dicts without null fields (like BaseModel.dict),
+    without copying nor validating anything else"""
+    if isinstance(value, BaseModel):
+        return {name: _jsonable(item) for name, item in value.__dict__.items() if item is not None}
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    return value
+
+
+def _serialize(read: BaseModel, partial: bool = False) -> str:
+    """Serialise a Read object to JSON, without null fields. If partial, only the fields set on the object are serialised"""
+    content = _jsonable(read)
+    if partial:
+        content = {name: value for name, value in content.items() if name in read.__fields_set__}
+    return json.dumps(content, default=pydantic_encoder)
+
+
+class ReadResponse(Response):
+    """JSON response of a Read object or a list of Read objects"""
+    media_type = "application/json"
+    partial = False
+
+    def render(self, content) -> bytes:
+        if isinstance(content, list):
+            return ("[" + ",".join(_serialize(read, self.partial) for read in content) + "]").encode("utf-8")
+        return _serialize(content, self.partial).encode("utf-8")
+
+
+class PartialReadResponse(ReadResponse):
+    """JSON response of a Read object or a list of Read objects, with only some of their fields (sparse fieldsets)"""
+    partial = True
+
+
+def ndjson_response(reads: Union[Iterable[BaseModel], AsyncIterable[BaseModel]], partial: bool = False) -> StreamingResponse:
+    """Stream the given Read objects (sync or async iterable) as newline delimited JSON, serialising one at a time"""
+    if isinstance(reads, AsyncIterable):
+        async def lines():
+            async for read in reads:
+                yield _serialize(read, partial) + "\n"
+    else:
+        def lines():
+            for read in reads:
+                yield _serialize(read, partial) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
@@ -0,0 +1,89 @@
+"""SESSIONS
+Signed, expiring session tokens, issued when a user logs in, so the user can prove its identity
+on the following requests without verifying the password again (bcrypt) nor reading the database.
+Tokens have the format <user_id>.<expires>.<signature>, where the signature is the HMAC-SHA256 of the user_id
+and expiration (Unix timestamp) with the session secret
+"""
+
+# # Native # #
+import hmac
+import base64
+import hashlib
+from typing import Optional, Tuple
+
+# # Installed # #
+from fastapi import Security
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+
+# # Package # #
+from .exceptions import InvalidSessionException, SessionForbiddenException, AdminForbiddenException
+from .utils import get_time
+from .settings import session_settings as settings
+
+__all__ = ("create_token", "verify_token", "check_session", "require_session", "get_credentials", "require_admin")
+
+_bearer = HTTPBearer(auto_error=False, description="Session token returned by the login")
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(settings.secret.encode("utf-8"), payload.encode("utf-8"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def create_token(user_id: str) -> Tuple[str, int]:
+    """Create a session token for a user. Returns the token and its expiration (Unix timestamp)"""
+    expires = get_time() + settings.ttl
+    payload = f"{user_id}.{expires}"
+    return f"{payload}.{_sign(payload)}", expires
+
+
+def verify_token(token: str) -> str:
+    """Verify a session token (signature and expiration) and return the id of its user.
+    Raises InvalidSessionException if the token is not valid or expired"""
+    try:
+        payload, signature = token.rsplit(".", 1)
+        user_id, expires = payload.rsplit(".", 1)
+        expires = int(expires)
+    except ValueError:
+        raise InvalidSessionException()
+
+    if not hmac.compare_digest(signature, _sign(payload)) or expires < get_time():
+        raise InvalidSessionException()
+    return user_id
+
+
+def check_session(user_id: str, credentials: Optional[HTTPAuthorizationCredentials]) -> str:
+    """Verify that the session token of the credentials (Authorization: Bearer <token>) belongs to the given user.
+    Raises InvalidSessionException if missing or not valid, or SessionForbiddenException if of another user"""
+    if not credentials:
+        raise InvalidSessionException()
+    if verify_token(credentials.credentials) != user_id:
+        raise SessionForbiddenException(identifier=user_id)
+    return user_id
+
+
+async def require_session(
+    user_id: str,
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer)
+) -> str:
+    """Dependency of the routes of a user (given by the user_id parameter),
+    which require the session token of that user (Authorization: Bearer <token>).
+    Declared async (although it does not await) so FastAPI does not run it on the threadpool"""
+    return check_session(user_id, credentials)
+
+
+async def get_credentials(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer)
+) -> Optional[HTTPAuthorizationCredentials]:
+    """Dependency of the routes that require the session token only on some requests (e.g. those not sent
+    by a device), verified by the route with check_session"""
+    return credentials
+
+
+async def require_admin(credentials: Optional[HTTPAuthorizationCredentials] = Security(_bearer)):
+    """Dependency of the routes that read all the users, which require the admin token (Authorization: Bearer <token>).
+    Raises InvalidSessionException if missing, or AdminForbiddenException if it is another token (e.g. a user session)"""
+    if not credentials:
+        raise InvalidSessionException()
+    if not hmac.compare_digest(credentials.credentials.encode("utf-8"), settings.admin_token.encode("utf-8")):
+        raise AdminForbiddenException()
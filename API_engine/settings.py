@@ -2,10 +2,15 @@
 Settings loaders using Pydantic BaseSettings classes (load from environment variables / dotenv file)
 """
 
+# # Native # #
+import os
+import secrets
+from typing import Dict, List, Optional
+
 # # Installed # #
 import pydantic
 
-__all__ = ("api_settings", "server_settings", "mongo_settings")
+__all__ = ("api_settings", "server_settings", "mongo_settings", "ingest_settings", "password_settings", "session_settings", "classifier_settings", "quote_settings", "render_settings", "therapy_settings")
 
 
 class BaseSettings(pydantic.BaseSettings):
@@ -18,6 +23,21 @@ class APISettings(BaseSettings):
     host: str = "0.0.0.0"
     port: int = 5000
     log_level: str = "INFO"
+    emotions_batch_size: int = 1000
+    notes_batch_size: int = 1000
+    page_size: int = 100
+    max_page_size: int = 1000
+    export_batch_size: int = 500
+    workers: int = 1
+    """Worker processes of the server. Each worker creates its own Mongo clients and buffers when it starts"""
+    loop: str = "auto"
+    """Event loop implementation: auto (uvloop if installed), uvloop or asyncio"""
+    http: str = "auto"
+    """HTTP protocol implementation: auto (httptools if installed), httptools or h11"""
+    keep_alive: int = 5
+    """Seconds an idle keep-alive connection is kept open"""
+    backlog: int = 2048
+    """Max connections waiting to be accepted by the server socket"""
 
     class Config(BaseSettings.Config):
         env_prefix = "API_"
@@ -27,6 +47,115 @@ class ServerSettings(BaseSettings):
     class Config(BaseSettings.Config):
         env_prefix = "Server_"
 
+class IngestSettings(BaseSettings):
+    buffered: bool = False
+    """If enabled, captured emotions are kept on an in-process buffer and written to Mongo in batches"""
+    flush_interval: float = 1.0
+    """Max seconds a buffered emotion can wait before being written (emotions on the buffer are lost on a crash)"""
+    flush_size: int = 500
+    """Buffered emotions that trigger a flush before the interval"""
+    max_size: int = 10000
+    """Buffered emotions from which the requests write the buffer themselves, if the flusher falls behind"""
+    stream_queue_size: int = 1000
+    """Emotions received on a device stream pending to be written, after which the stream stops reading (backpressure)"""
+    stream_batch_size: int = 100
+    """Max emotions of a device stream written (and acknowledged) at once"""
+    stream_batch_interval: float = 0.5
+    """Max seconds an emotion received on a device stream waits for more emotions before being written"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "INGEST_"
+
+class PasswordSettings(BaseSettings):
+    rounds: int = 12
+    """bcrypt cost factor of the new password hashes (existing hashes keep the cost they were created with)"""
+    workers: int = 4
+    """Threads that hash and verify passwords (of each API worker process)"""
+    queue_size: int = 64
+    """Passwords that can wait for a thread. When full, new logins are rejected right away (503)"""
+    timeout: float = 5.0
+    """Max seconds a password can wait to be hashed or verified, before the request is rejected (503)"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "PASSWORD_"
+
+class SessionSettings(BaseSettings):
+    secret: str = pydantic.Field(default_factory=lambda: secrets.token_urlsafe(32))
+    """Secret used to sign the session tokens. Random by default (tokens are not valid after a restart, nor on other
+    API hosts): set it when running the API on more than one host"""
+    ttl: int = 3600
+    """Seconds a session token is valid"""
+    admin_token: str = pydantic.Field(default_factory=lambda: secrets.token_urlsafe(32))
+    """Token of the routes that read all the users (e.g. the users list), sent as Authorization: Bearer <token>.
+    Random by default (the routes can not be used): set it to use them"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "SESSION_"
+
+class ClassifierSettings(BaseSettings):
+    cache_size: int = 10000
+    """Texts whose emotion scores are kept in memory (least recently used are discarded first)"""
+    batch_size: int = 32
+    """Max users whose pending notes are processed (classified and written) at once"""
+    batch_interval: float = 0.01
+    """Max seconds a user with pending notes waits for more users before its notes are processed"""
+    claim_timeout: int = 600
+    """Seconds after which the notes claimed to be processed, and never processed (e.g. the process was stopped while
+    processing them), are processed again, when an API worker starts"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "CLASSIFIER_"
+
+class QuoteSettings(BaseSettings):
+    path: str = os.path.join(os.path.dirname(__file__), "data", "quotes.jsonl")
+    """Quote store file (JSON lines), loaded when the API starts. Created from a dump with the import-quotes command"""
+    max_length: int = 80
+    """Max characters of the quotes used (longer quotes are not loaded, nor imported)"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "QUOTES_"
+
+class RenderSettings(BaseSettings):
+    workers: int = 2
+    """Processes that render images (of each API worker process)"""
+    queue_size: int = 32
+    """Images that can wait for a process. When full, new renders are rejected right away (503)"""
+    timeout: float = 30.0
+    """Max seconds to wait for an image to be rendered, before the request is rejected (503)"""
+    start_method: str = "spawn"
+    """Start method of the render processes: spawn, forkserver or fork (fork is not safe with the threads of the API)"""
+    quotes_folder: str = "Uploads/quotes/"
+    """Folder of the cached quote images, served by the file server"""
+    quotes_path: str = "quotes/"
+    """Path of the quotes folder on the file server (Server_FTP_SERVER)"""
+    quotes_max_size: int = 512 * 1024 * 1024
+    """Max bytes of the cached quote images. The least recently used images are removed first"""
+    quotes_style: str = "quote2image"
+    """Render style of the quote images, part of their cache key: change it when the images must be rendered again
+    (e.g. the renderer was updated)"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "RENDER_"
+
+class TherapySettings(BaseSettings):
+    music_catalog_ttl: float = 60.0
+    """Max seconds the music catalog is kept in memory (by each API worker process), before reading it again.
+    Changes done through other processes are seen after it expires. If 0, it is kept until the musics change"""
+
+    music_recommendation_mode: str = "catalog"
+    """How the music playlists are sampled: catalog (from the in-memory music catalog of the process),
+    or sample (by Mongo, with a single aggregation, so the catalog is not kept in memory by the API workers)"""
+    music_counts: Dict[str, List[int]] = {
+        "sad": [3, 4, 3], "angry": [3, 4, 3], "disgust": [3, 4, 3],
+        "neutral": [1, 6, 3], "fear": [1, 6, 3]
+    }
+    """Musics of each cluster on the playlists, by the current emotion of the user (JSON)"""
+    music_default_counts: List[int] = [1, 4, 5]
+    """Musics of each cluster on the playlists, for the emotions not given on music_counts (JSON)"""
+
+    class Config(BaseSettings.Config):
+        env_prefix = "THERAPY_"
+
 class MongoSettings(BaseSettings):
     uri: str = "mongodb://52.188.203.118:5001"
     user: str = 'emoup'
@@ -35,6 +164,19 @@ class MongoSettings(BaseSettings):
     users: str = "users"
     doctors: str = "doctors"
     musics: str = "musics"
+    emotions: str = "emotions"
+    emotion_weeks: str = "emotion_weeks"
+    note_words: str = "note_words"
+    max_pool_size: int = 100
+    """Max connections of the pool of each client (each process has its own clients)"""
+    min_pool_size: int = 0
+    """Connections of the pool of each client that are kept open while idle"""
+    wait_queue_timeout_ms: Optional[int] = None
+    """Max milliseconds an operation waits for a connection of the pool when all are in use (forever by default)"""
+    server_selection_timeout_ms: int = 30000
+    """Max milliseconds an operation waits for an available Mongo server"""
+    compressors: str = ""
+    """Comma separated wire compressors (zlib, zstd, snappy; zstd and snappy require their packages). Disabled by default"""
 
     class Config(BaseSettings.Config):
         env_prefix = "MONGO_"
@@ -43,3 +185,10 @@ class MongoSettings(BaseSettings):
 api_settings = APISettings()
 server_settings = ServerSettings()
 mongo_settings = MongoSettings()
+ingest_settings = IngestSettings()
+password_settings = PasswordSettings()
+session_settings = SessionSettings()
+classifier_settings = ClassifierSettings()
+quote_settings = QuoteSettings()
+render_settings = RenderSettings()
+therapy_settings = TherapySettings()
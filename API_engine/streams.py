@@ -0,0 +1,91 @@
+"""STREAMS
+Persistent WebSocket streams of emotions captured by the Emoup Devices.
+The device is resolved to its user once per connection, then each received frame is queued and written in batches.
+Each written batch is acknowledged to the device with the total number of emotions written so far.
+When the queue is full, the stream stops reading frames until the pending emotions are written (backpressure)
+"""
+
+# # Native # #
+import asyncio
+import logging
+
+# # Installed # #
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi import status as statuscode
+
+# # Package # #
+from .async_repositories import AsyncUsersRepository
+from .utils import get_time, get_batch
+from .settings import ingest_settings as settings
+
+__all__ = ("stream_emotions",)
+
+logger = logging.getLogger(__name__)
+
+
+async def stream_emotions(websocket: WebSocket, user_id: str):
+    """Receive the emotion frames of an accepted WebSocket, with the format {"emotion": str, "captured": int (optional)},
+    until the device disconnects"""
+    queue = asyncio.Queue(maxsize=settings.stream_queue_size)
+    writer = asyncio.create_task(_write_emotions(websocket, queue))
+
+    try:
+        while True:
+            try:
+                frame = await websocket.receive_json()
+            except ValueError:
+                # Not JSON: answered as any other invalid frame, without closing the stream
+                frame = None
+
+            emotion = frame.get("emotion") if isinstance(frame, dict) else None
+            if not emotion or not isinstance(emotion, str):
+                await websocket.send_json({"error": "Invalid frame, the emotion is required"})
+                continue
+
+            captured = frame.get("captured")
+            await queue.put({
+                "user_id": user_id,
+                "emotion": emotion.lower(),
+                "captured": captured if isinstance(captured, int) else get_time()
+            })
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        # The writer finishes after writing the pending emotions
+        await queue.put(None)
+        await writer
+
+
+async def _write_emotions(websocket: WebSocket, queue: asyncio.Queue):
+    """Write the emotions of the queue in batches, until a None is received.
+    If a write fails, the WebSocket is closed, and the rest of emotions (not acknowledged) are discarded"""
+    written = 0
+    failed = False
+    closed = False
+
+    while not closed:
+        states, closed = await get_batch(queue, settings.stream_batch_size, settings.stream_batch_interval)
+        if not states or failed:
+            continue
+
+        try:
+            await AsyncUsersRepository.apply_emotions(states)
+        except Exception:
+            logger.exception("Failed writing %d streamed emotions", len(states))
+            failed = True
+            await _send(websocket.close(code=statuscode.WS_1011_INTERNAL_ERROR))
+            continue
+
+        written += len(states)
+        if not closed:
+            await _send(websocket.send_json({"ack": written}))
+
+
+async def _send(coroutine):
+    """Send a message to the device, ignoring the errors caused because it already disconnected"""
+    try:
+        await coroutine
+    except (WebSocketDisconnect, RuntimeError):
+        pass
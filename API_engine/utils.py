@@ -3,21 +3,43 @@ Misc helpers/utils functions
 """
 
 # # Native # #
+import asyncio
 from time import time
 from uuid import uuid4
-from typing import Union
+from typing import Union, Tuple, Optional
 from datetime import date, timedelta, datetime
 
-__all__ = ("get_time", "get_uuid", "get_week_timestamp")
+# # Installed # #
+from dateutil import parser
+
+__all__ = ("get_time", "get_uuid", "get_week_timestamp", "get_day_timestamp", "get_iso_week", "parse_timestamp", "get_batch")
 
 
 def get_time(seconds_precision=True) -> Union[int, float]:
     """Returns the current time as Unix/Epoch timestamp, seconds precision by default"""
     return time() if not seconds_precision else int(time())
 
-def timestamp(date) -> int:
-    """Returns the date as Unix/Epoch timestamp, seconds precision by default"""
-    return int(datetime.strptime(str(date), "%Y-%m-%d").timestamp())
+def parse_timestamp(text: str) -> Optional[int]:
+    """Returns the date (and time) written on a free-form text as Unix/Epoch timestamp (a number is taken as
+    a timestamp already), or None if the text is not a date"""
+    text = str(text).strip()
+    if text.isdigit():
+        return int(text)
+    try:
+        return int(parser.parse(text).timestamp())
+    except (ValueError, OverflowError):
+        return None
+
+
+def get_day_timestamp(captured: int) -> int:
+    """Returns the start of the (UTC) day the given Unix/Epoch timestamp belongs to"""
+    return captured - captured % 86400
+
+
+def get_iso_week(captured: int = None) -> str:
+    """Returns the ISO week (YYYY-Www) the given Unix/Epoch timestamp belongs to, the current week by default"""
+    year, week, _ = datetime.fromtimestamp(captured if captured is not None else time()).isocalendar()
+    return f"{year}-W{week:02d}"
 
 
 def get_uuid() -> str:
@@ -31,4 +53,22 @@ def get_week_timestamp():
     start = int(datetime.strptime(str(start), "%Y-%m-%d").timestamp())
     end = int(datetime.strptime(str(end), "%Y-%m-%d").timestamp())
 
-    return start,end
\ No newline at end of file
+    return start,end
+
+
+async def get_batch(queue: asyncio.Queue, batch_size: int, interval: float) -> Tuple[list, bool]:
+    """Wait for an item of the queue, then get more items until the batch size is reached or the interval passes.
+    A None item closes the queue. Returns the items of the batch and whether the queue was closed"""
+    loop = asyncio.get_running_loop()
+    batch = [await queue.get()]
+    deadline = loop.time() + interval
+    while batch[-1] is not None and len(batch) < batch_size:
+        try:
+            batch.append(await asyncio.wait_for(queue.get(), deadline - loop.time()))
+        except asyncio.TimeoutError:
+            break
+
+    if batch[-1] is None:
+        batch.pop()
+        return batch, True
+    return batch, False
@@ -1,3 +1,5 @@
 from API_engine import run
 
-run()
+# The guard is required by the worker processes, which are spawned (they import the main module)
+if __name__ == "__main__":
+    run()
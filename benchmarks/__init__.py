@@ -0,0 +1,3 @@
+"""BENCHMARKS
+Standalone scripts that measure the performance of parts of the API, run with `python -m benchmarks.<name>`
+"""
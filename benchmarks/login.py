@@ -0,0 +1,96 @@
+"""BENCHMARK - LOGIN
+Login storm: many concurrent logins (bcrypt verifications) while cheap requests keep arriving,
+which run on the shared threadpool (like the sync routes and the blocking work of the async ones).
+- inline: bcrypt runs on the shared threadpool (how logins worked before the password executor)
+- executor: bcrypt runs on the dedicated, size-limited password executor
+Reports the login throughput, the logins rejected (executor queue full), and the latency of the cheap requests
+"""
+
+# # Native # #
+import sys
+import time
+import asyncio
+from statistics import median, quantiles
+
+# # Installed # #
+import bcrypt
+from fastapi.concurrency import run_in_threadpool
+
+# # Project # #
+from API_engine.passwords import PasswordExecutor
+from API_engine.exceptions import PasswordServiceBusyException
+from API_engine.settings import password_settings
+
+LOGINS = 200
+READS = 400
+READ_INTERVAL = 0.005
+"""Seconds between cheap requests"""
+READ_DURATION = 0.002
+"""Seconds a cheap request blocks its thread (e.g. a small Mongo read)"""
+
+
+async def login_inline(password: bytes, hashed: bytes):
+    assert await run_in_threadpool(bcrypt.checkpw, password, hashed)
+
+
+def get_login_executor(executor: PasswordExecutor):
+    async def login_executor(password: bytes, hashed: bytes):
+        assert await executor.check_async(password.decode(), hashed)
+    return login_executor
+
+
+async def read() -> float:
+    start = time.perf_counter()
+    await run_in_threadpool(time.sleep, READ_DURATION)
+    return time.perf_counter() - start
+
+
+async def storm(login, rounds: int) -> dict:
+    password = b"password"
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+    async def reads():
+        tasks = list()
+        for _ in range(READS):
+            tasks.append(asyncio.ensure_future(read()))
+            await asyncio.sleep(READ_INTERVAL)
+        return await asyncio.gather(*tasks)
+
+    start = time.perf_counter()
+    logins = asyncio.gather(*[login(password, hashed) for _ in range(LOGINS)], return_exceptions=True)
+    latencies = await reads()
+    results = await logins
+    elapsed = time.perf_counter() - start
+
+    rejected = sum(isinstance(result, PasswordServiceBusyException) for result in results)
+    failed = [result for result in results if isinstance(result, Exception)]
+    assert len(failed) == rejected, failed
+    return {
+        "logins/s": (LOGINS - rejected) / elapsed,
+        "rejected": rejected,
+        "read p50 (ms)": median(latencies) * 1000,
+        "read p99 (ms)": quantiles(latencies, n=100)[98] * 1000
+    }
+
+
+def main():
+    # The bcrypt cost factor can be given as first argument (the configured one by default)
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else password_settings.rounds
+    executor = PasswordExecutor(
+        workers=password_settings.workers,
+        queue_size=password_settings.queue_size,
+        timeout=password_settings.timeout,
+        rounds=rounds
+    )
+    print(f"{LOGINS} logins (bcrypt cost {rounds}), {READS} cheap requests, "
+          f"password executor with {executor.workers} threads and a queue of {executor.queue_size}")
+    print(f"{'mode':>10} {'logins/s':>10} {'rejected':>10} {'read p50 (ms)':>15} {'read p99 (ms)':>15}")
+    for mode, login in (("inline", login_inline), ("executor", get_login_executor(executor))):
+        result = asyncio.run(storm(login, rounds))
+        print(f"{mode:>10} {result['logins/s']:>10.1f} {result['rejected']:>10} "
+              f"{result['read p50 (ms)']:>15.2f} {result['read p99 (ms)']:>15.2f}")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""BENCHMARK - READ MODELS
+Compare the time to build and serialise a UserRead response from a database document:
+- validated: the model is validated when created from the document, then FastAPI validates it again against
+  the route response_model, and serialises it with jsonable_encoder
+- trusted: the model is created with UserRead.from_document (no validation) and serialised by ReadResponse
+The users are read without their password (see UsersRepository.READ_PROJECTION), and their emotion states are
+kept on the emotion buckets, so their size is given by their notes: users with many notes benefit the most
+"""
+
+# # Native # #
+import json
+from timeit import timeit
+from random import choice
+
+# # Installed # #
+from fastapi.encoders import jsonable_encoder
+
+# # Project # #
+from API_engine.models import UserRead
+from API_engine.responses import ReadResponse
+from API_engine.utils import get_time, get_uuid
+
+EMOTIONS = ("happy", "sad", "angry", "neutral", "fear", "surprise", "disgust")
+SIZES = (0, 10, 100, 1000, 10000)
+"""Notes of each benchmarked user"""
+
+
+def get_document(notes: int) -> dict:
+    now = get_time()
+    return {
+        "_id": get_uuid(),
+        "name": "John Doe",
+        "email": "johndoe@gmail.com",
+        "birth": "1999-12-31",
+        "address": {"street": "141, Navlakha", "city": "Indore", "state": "Madhya Pradesh", "zip_code": "452005"},
+        "current_emotion": "happy",
+        "notes": [
+            {
+                "note": "Hello, I finally won, really happy!", "color": "red", "captured": "2020-01-01",
+                "captured_at": now - i, "note_id": get_uuid(), "status": "classified", "emotions": [choice(EMOTIONS)]
+            }
+            for i in range(notes)
+        ],
+        "created": now,
+        "updated": now
+    }
+
+
+def validated(document: dict) -> bytes:
+    read = UserRead(**document)
+    # What FastAPI does with the returned object on routes with response_model
+    read = UserRead(**read.dict(by_alias=True))
+    return json.dumps(jsonable_encoder(read)).encode("utf-8")
+
+
+def trusted(document: dict) -> bytes:
+    return ReadResponse(UserRead.from_document(document)).body
+
+
+def main():
+    print(f"{'notes':>8} {'validated (ms)':>16} {'trusted (ms)':>14} {'speedup':>8}")
+    for notes in SIZES:
+        document = get_document(notes)
+        assert json.loads(validated(document)) == json.loads(trusted(document))
+
+        number = max(1, 2000 // (notes + 1))
+        validated_ms = timeit(lambda: validated(document), number=number) / number * 1000
+        trusted_ms = timeit(lambda: trusted(document), number=number) / number * 1000
+        print(f"{notes:>8} {validated_ms:>16.3f} {trusted_ms:>14.3f} {validated_ms / trusted_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,3 +2,19 @@
 Direct acceptance+integration tests that start up the API and use a real Mongo database,
 to directly test the API endpoints
 """
+
+# # Native # #
+import os
+
+# # Installed # #
+from pymongo import monitoring
+
+# # Package # #
+from .listeners import command_listener
+
+monitoring.register(command_listener)
+
+# The tests create session tokens and list the users, so they must share the session secret and admin token
+# with the API process
+os.environ.setdefault("SESSION_SECRET", "tests")
+os.environ.setdefault("SESSION_ADMIN_TOKEN", "tests-admin")
@@ -10,9 +10,12 @@ import httpx
 from wait4it import wait_for, get_free_port
 
 # # Project # #
-from users_api import run
-from users_api.database import users
-from users_api.settings import api_settings
+from API_engine import run
+from API_engine.database import users
+from API_engine.settings import api_settings
+
+# # Package # #
+from .utils import get_session_headers, get_admin_headers
 
 __all__ = ("BaseTest",)
 
@@ -42,13 +45,13 @@ class BaseTest:
 
     # # API Methods # #
 
-    def get_user(self, user_id: str, statuscode: int = 200):
-        r = httpx.get(f"{self.api_url}/users/{user_id}")
+    def get_user(self, user_id: str, statuscode: int = 200, headers: dict = None, **params):
+        r = httpx.get(f"{self.api_url}/users/{user_id}", params=params, headers=headers or get_session_headers(user_id))
         assert r.status_code == statuscode, r.text
         return r
 
-    def list_users(self, statuscode: int = 200):
-        r = httpx.get(f"{self.api_url}/users")
+    def list_users(self, statuscode: int = 200, headers: dict = None, **params):
+        r = httpx.get(f"{self.api_url}/users", params=params, headers={**get_admin_headers(), **(headers or {})})
         assert r.status_code == statuscode, r.text
         return r
 
@@ -58,11 +61,16 @@ class BaseTest:
         return r
 
     def update_user(self, user_id: str, update: dict, statuscode: int = 204):
-        r = httpx.patch(f"{self.api_url}/users/{user_id}", json=update)
+        r = httpx.patch(f"{self.api_url}/users/{user_id}", json=update, headers=get_session_headers(user_id))
         assert r.status_code == statuscode, r.text
         return r
 
     def delete_user(self, user_id: str, statuscode: int = 204):
-        r = httpx.delete(f"{self.api_url}/users/{user_id}")
+        r = httpx.delete(f"{self.api_url}/users/{user_id}", headers=get_session_headers(user_id))
+        assert r.status_code == statuscode, r.text
+        return r
+
+    def login_user(self, email: str, password: str, statuscode: int = 200):
+        r = httpx.post(f"{self.api_url}/users/login", params={"email": email, "password": password})
         assert r.status_code == statuscode, r.text
         return r
@@ -0,0 +1,40 @@
+"""TEST - LISTENERS
+Mongo command listener, used to count the round trips to the database performed by the repositories.
+It must be registered before the Mongo client is created, so it is registered on the tests package init
+"""
+
+# # Native # #
+from contextlib import contextmanager
+
+# # Installed # #
+from pymongo import monitoring
+
+__all__ = ("command_listener", "count_round_trips")
+
+
+class CommandListener(monitoring.CommandListener):
+    """Record the name of every command sent to Mongo while recording is enabled"""
+    commands = None
+
+    def started(self, event):
+        if self.commands is not None:
+            self.commands.append(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+command_listener = CommandListener()
+
+
+@contextmanager
+def count_round_trips():
+    """Record the commands sent to Mongo within the context, on the yielded list"""
+    command_listener.commands = commands = list()
+    try:
+        yield commands
+    finally:
+        command_listener.commands = None
@@ -0,0 +1,162 @@
+"""TEST BUFFERS
+Test the write-behind buffer of the captured emotions, and how the emotions of a batch are coalesced.
+The writes of the buffer are recorded instead of sent to Mongo
+"""
+
+# # Native # #
+import time
+
+# # Installed # #
+import pytest
+from pymongo import UpdateOne
+
+# # Project # #
+from API_engine.buffers import EmotionBuffer
+from API_engine.models import EmotionEvent
+from API_engine.repositories import UsersRepository, EmotionsRepository
+
+# # Package # #
+from .utils import get_uuid
+
+USER_ID = get_uuid()
+
+
+def get_event(user_id: str = USER_ID, emotion: str = "happy", captured: int = 1577836800):
+    return EmotionEvent(user_id=user_id, emotion=emotion, captured=captured)
+
+
+def wait_until(condition, timeout: float = 2.0) -> bool:
+    limit = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > limit:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestEmotionBuffer:
+    @pytest.fixture(autouse=True)
+    def writes(self, monkeypatch):
+        """Batches of events written by the buffer (the fail attribute makes the next writes fail)"""
+        writes = list()
+
+        def update_emotions(events):
+            if self.fail:
+                self.fail -= 1
+                raise ConnectionError("Mongo is down")
+            writes.append(list(events))
+            return [{"status": "ok"}] * len(events)
+
+        self.fail = 0
+        self.writes = writes
+        monkeypatch.setattr(UsersRepository, "update_emotions", staticmethod(update_emotions))
+        return writes
+
+    @pytest.fixture
+    def buffer(self):
+        buffer = EmotionBuffer(flush_size=3, flush_interval=60, max_size=100)
+        buffer.start()
+        yield buffer
+        buffer.stop()
+
+    def test_flush_on_size(self, buffer):
+        """Add emotions to a started buffer until the flush size.
+        Should not write them before the flush size is reached, and then write them in a single batch"""
+        events = [get_event(captured=i) for i in range(3)]
+        buffer.add(events[0])
+        buffer.add(events[1])
+        time.sleep(0.1)
+        assert self.writes == []
+
+        buffer.add(events[2])
+        assert wait_until(lambda: self.writes)
+        assert self.writes == [events]
+
+    def test_flush_on_interval(self):
+        """Add less emotions than the flush size to a started buffer.
+        Should write them after the flush interval"""
+        buffer = EmotionBuffer(flush_size=100, flush_interval=0.1, max_size=1000)
+        buffer.start()
+        try:
+            event = get_event()
+            buffer.add(event)
+            assert wait_until(lambda: self.writes)
+            assert self.writes == [[event]]
+        finally:
+            buffer.stop()
+
+    def test_flush_on_stop(self, buffer):
+        """Add less emotions than the flush size to a started buffer, and stop it.
+        Should write the pending emotions when stopped"""
+        events = [get_event(captured=i) for i in range(2)]
+        for event in events:
+            buffer.add(event)
+
+        buffer.stop()
+        assert self.writes == [events]
+
+    def test_retry_on_failure(self):
+        """Add an emotion to a buffer that is not started (written right away) while Mongo fails, and then another one.
+        Should keep the failed emotion and write it with the next one, in the same order"""
+        buffer = EmotionBuffer(flush_size=3, flush_interval=60, max_size=100)
+        events = [get_event(captured=i) for i in range(2)]
+        self.fail = 1
+
+        buffer.add(events[0])
+        assert self.writes == []
+
+        buffer.add(events[1])
+        assert self.writes == [events]
+
+    def test_retry_on_failure_max_size(self):
+        """Add more emotions than the max size to a buffer while Mongo fails.
+        Should only keep the latest max size emotions to retry"""
+        buffer = EmotionBuffer(flush_size=3, flush_interval=60, max_size=2)
+        events = [get_event(captured=i) for i in range(3)]
+        self.fail = 3
+
+        for event in events:
+            buffer.add(event)
+        buffer.flush()
+        assert self.writes == [events[1:]]
+
+
+class TestCoalesce:
+    def test_current_emotion_once_per_user(self):
+        """Get the operations that set the current emotion of many states of two users.
+        Should set the current emotion of each user once, with its latest captured state"""
+        states = [
+            {"user_id": "a", "emotion": "sad", "captured": 20},
+            {"user_id": "a", "emotion": "happy", "captured": 10},
+            {"user_id": "b", "emotion": "angry", "captured": 5},
+        ]
+        operations = UsersRepository.get_emotions_operations(states)
+
+        assert [(operation._filter, operation._doc["$set"]["current_emotion"]) for operation in operations] == [
+            ({"_id": "a"}, "sad"), ({"_id": "b"}, "angry")
+        ]
+
+    def test_states_grouped_by_bucket_and_week(self):
+        """Get the operations that append many states of a user, two of them on the same day.
+        Should push the states of the same day on a single operation, and count them on a single weekly operation"""
+        day = 1577836800
+        states = [
+            {"user_id": "a", "emotion": "happy", "captured": day + 10},
+            {"user_id": "a", "emotion": "happy", "captured": day + 20},
+            {"user_id": "a", "emotion": "sad", "captured": day + 86400},
+        ]
+        bucket_operations, week_operations = EmotionsRepository.get_push_operations(states)
+
+        assert len(bucket_operations) == 2
+        assert bucket_operations[0] == UpdateOne(
+            {"_id": EmotionsRepository.get_bucket_id("a", day)},
+            {
+                "$push": {"states": {"$each": [
+                    {"emotion": "happy", "captured": day + 10}, {"emotion": "happy", "captured": day + 20}
+                ]}},
+                "$setOnInsert": {"user_id": "a", "day": day}
+            },
+            upsert=True
+        )
+        assert len(week_operations) == 1
+        assert week_operations[0]._doc["$inc"] == {"counts.happy": 2, "counts.sad": 1}
@@ -0,0 +1,38 @@
+"""TEST INDEXES
+Test the creation of the indexes when the collections have values that prevent creating them
+"""
+
+# # Installed # #
+import pytest
+from pymongo import IndexModel, ASCENDING
+
+# # Project # #
+from API_engine import indexes
+from API_engine.database import LazyCollection
+
+# # Package # #
+from .utils import get_uuid
+
+
+class TestCreateIndexes:
+    @pytest.fixture
+    def collection(self, monkeypatch):
+        collection = LazyCollection("test_indexes_" + get_uuid())
+        monkeypatch.setattr(indexes, "INDEXES", (
+            (collection, [
+                IndexModel([("code", ASCENDING)], name="code", unique=True),
+                IndexModel([("name", ASCENDING)], name="name"),
+            ]),
+        ))
+        yield collection
+        collection.drop()
+
+    def test_create_indexes_duplicated_values(self, collection):
+        """Create the indexes of a collection with a value repeated on the field of a unique index.
+        Should create the other indexes, and return the unique index as not created, with its duplicated value"""
+        collection.insert_many([{"code": "a", "name": "first"}, {"code": "a", "name": "second"}, {"code": "b"}])
+
+        failed = indexes.create_indexes()
+        assert [index.document["name"] for _, index, _ in failed] == ["code"]
+        assert "name" in collection.index_information()
+        assert indexes.find_duplicates(collection, failed[0][1]) == [{"_id": {"code": "a"}, "count": 2}]
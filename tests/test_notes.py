@@ -0,0 +1,110 @@
+"""TEST NOTES
+Test the notes of the users, and the classification of their emotions
+"""
+
+# # Native # #
+import time
+import asyncio
+
+# # Installed # #
+import httpx
+from fastapi import status as statuscode
+
+# # Project # #
+from API_engine.database import users, close_clients
+from API_engine.repositories import UsersRepository, EmotionsRepository
+from API_engine.async_repositories import AsyncUsersRepository
+
+# # Package # #
+from .base import BaseTest
+from .utils import *
+
+
+class TestClassifyNotes(BaseTest):
+    def test_classify_notes(self):
+        """Classify many notes at once, two of them with the same normalised text.
+        Should return the emotions of each note, in the same order, with the same emotions for the repeated notes"""
+        texts = ["Hello, I finally won, really happy!", "I am so angry right now", "hello, i finally  won, really HAPPY!"]
+
+        r = httpx.post(f"{self.api_url}/users/notes:classify", json=texts)
+        assert r.status_code == statuscode.HTTP_200_OK, r.text
+
+        classifications = r.json()
+        assert len(classifications) == len(texts)
+        assert classifications[0] == classifications[2]
+        for classification in classifications:
+            assert set(classification["emotions"]) <= {emotion.lower() for emotion in classification["scores"]}
+
+
+class TestAddNote(BaseTest):
+    def test_add_note_processed(self):
+        """Add a note to an existing user.
+        Should return the note as pending, and then classify it in background"""
+        user = get_existing_user()
+        note = {"note": "Hello, I finally won, really happy!", "color": "red", "captured": "06/04/2020"}
+
+        r = httpx.post(f"{self.api_url}/users/add-note", params={"user_id": user.user_id}, json=note,
+                       headers=get_session_headers(user.user_id))
+        assert r.status_code == statuscode.HTTP_200_OK, r.text
+        added = r.json()["notes"][-1]
+        assert added["status"] == "pending"
+        assert added["note"] == note["note"]
+
+        for _ in range(50):
+            read = self.get_user(user.user_id).json()
+            processed = next(n for n in read["notes"] if n["note_id"] == added["note_id"])
+            if processed["status"] != "pending":
+                break
+            time.sleep(0.1)
+
+        assert processed["status"] == "classified"
+        assert read["current_emotion"] == processed["emotions"][-1]
+
+    def test_add_note_with_status(self):
+        """Add a note to an existing user, sending the status set by the API.
+        Should return 422, as the status (like the note_id and emotions) is not sent by the clients"""
+        user = get_existing_user()
+        note = {"note": "Hello", "color": "red", "captured": "06/04/2020", "status": "pending"}
+
+        r = httpx.post(f"{self.api_url}/users/add-note", params={"user_id": user.user_id}, json=note,
+                       headers=get_session_headers(user.user_id))
+        assert r.status_code == statuscode.HTTP_422_UNPROCESSABLE_ENTITY, r.text
+
+
+class TestProcessNotes(BaseTest):
+    def test_process_notes_twice(self):
+        """Process the pending note of a user on two batches at once.
+        Should classify the note once, and count its emotions once"""
+        user = get_existing_user()
+        note = {"note": "Hello, I finally won, really happy!", "color": "red", "captured": "06/04/2020"}
+        users.update_one({"_id": user.user_id}, {"$push": {"notes": UsersRepository.get_note_document(note, "pending")}})
+
+        async def process():
+            try:
+                await asyncio.gather(*[AsyncUsersRepository.process_notes([user.user_id]) for _ in range(2)])
+            finally:
+                close_clients()
+
+        asyncio.run(process())
+        processed = UsersRepository.get(user.user_id).notes[-1]
+        assert processed.status == "classified"
+        assert sum(EmotionsRepository.count(user.user_id).values()) == len(processed.emotions)
+
+
+class TestListNotes(BaseTest):
+    def test_list_notes_between(self):
+        """Add two notes with different captured dates to an existing user, and list the notes captured between
+        two timestamps. Should return only the note captured between them, with its parsed captured_at"""
+        user = get_existing_user()
+        headers = get_session_headers(user.user_id)
+        for captured in ("2020-06-04", "2021-03-04"):
+            note = {"note": "A walk on the beach", "color": "blue", "captured": captured}
+            r = httpx.post(f"{self.api_url}/users/add-note", params={"user_id": user.user_id}, json=note, headers=headers)
+            assert r.status_code == statuscode.HTTP_200_OK, r.text
+
+        r = httpx.get(f"{self.api_url}/users/{user.user_id}/notes", params={"start": 1591000000, "end": 1592000000},
+                      headers=headers)
+        assert r.status_code == statuscode.HTTP_200_OK, r.text
+        notes = r.json()
+        assert [note["captured"] for note in notes] == ["2020-06-04"]
+        assert notes[0]["captured_at"] == 1591228800
@@ -0,0 +1,57 @@
+"""TEST QUOTES
+Test the local quote store, and its import from a dump
+"""
+
+# # Installed # #
+import pytest
+
+# # Project # #
+from API_engine.quotes import QuoteStore, read_dump, write_store
+
+
+def write_dump(path, lines: str):
+    path.write_text(lines, encoding="utf-8")
+    return str(path)
+
+
+class TestQuotes:
+    def test_import_and_sample(self, tmp_path):
+        """Import a CSV dump with a repeated quote, a long quote and a quote without title, and sample its quotes.
+        Should keep the valid quotes once, and sample the quotes of a mood"""
+        dump = write_dump(tmp_path / "dump.csv", "\n".join([
+            "quote,author,tags",
+            "Well begun is half done.,Aristotle,\"Happy, Neutral\"",
+            "well begun is  half done.,Someone,",
+            "Expect the unexpected.,Heraclitus,surprise",
+            f"{'Long ' * 20},Someone,happy",
+            "No title,,sad",
+        ]))
+        path = str(tmp_path / "quotes.jsonl")
+
+        assert write_store(read_dump(dump), path, max_length=80) == 2
+
+        store = QuoteStore(path, max_length=80)
+        assert store.sample("happy") == ("Well begun is half done.", "Aristotle")
+        assert store.sample("SURPRISE") == ("Expect the unexpected.", "Heraclitus")
+        assert set(store.sample_many(2)) == {
+            ("Well begun is half done.", "Aristotle"), ("Expect the unexpected.", "Heraclitus")
+        }
+
+    def test_sample_max_length(self, tmp_path):
+        """Sample quotes of a mood with a max length, when only some quotes of the mood are short enough.
+        Should only return the short quotes of the mood, or any short quote if the mood has none"""
+        dump = write_dump(tmp_path / "dump.jsonl", "\n".join([
+            '{"quote": "A short sad quote.", "title": "A", "moods": ["sad"]}',
+            '{"quote": "A much longer sad quote, on this line.", "title": "B", "moods": ["sad"]}',
+            '{"quote": "A short one.", "title": "C", "moods": ["happy"]}',
+        ]))
+        path = str(tmp_path / "quotes.jsonl")
+        write_store(read_dump(dump), path, max_length=80)
+        store = QuoteStore(path, max_length=80)
+
+        for _ in range(10):
+            assert store.sample("sad", max_length=20) == ("A short sad quote.", "A")
+            assert store.sample("angry", max_length=12) == ("A short one.", "C")
+
+        with pytest.raises(ValueError):
+            store.sample(max_length=5)
@@ -5,6 +5,9 @@ Test read actions (get one, list)
 # # Installed # #
 from fastapi import status as statuscode
 
+# # Project # #
+from API_engine.responses import NDJSON_MEDIA_TYPE
+
 # # Package # #
 from .base import BaseTest
 from .utils import *
@@ -27,12 +30,81 @@ class TestGet(BaseTest):
         response = self.get_user(user_id, statuscode=statuscode.HTTP_404_NOT_FOUND)
         assert response.json()["identifier"] == user_id
 
+    def test_get_user_fields(self):
+        """Having an existing user, get only some of its fields.
+        Should return only those fields and the user_id"""
+        user = get_existing_user()
+
+        response = self.get_user(user.user_id, fields="name,age")
+        assert response.json() == {"user_id": user.user_id, "name": user.name, "age": user.age}
+
+    def test_get_user_invalid_fields(self):
+        """Having an existing user, get fields that do not exist.
+        Should return validation error 422 and the invalid fields"""
+        user = get_existing_user()
+
+        response = self.get_user(user.user_id, statuscode=statuscode.HTTP_422_UNPROCESSABLE_ENTITY, fields="name,foo")
+        assert response.json()["identifier"] == "foo"
+
 
 class TestList(BaseTest):
     def test_list_users(self):
         """Having multiple users, list all of them.
-        Should return all of them in array"""
-        users = [get_existing_user() for _ in range(4)]
+        Should return all of them in array, sorted by their id"""
+        users = sorted([get_existing_user() for _ in range(4)], key=lambda p: p.user_id)
 
         response = self.list_users()
         assert response.json() == [p.dict() for p in users]
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_list_users_paginated(self):
+        """Having multiple users, list them in pages of 2, following the next page cursor.
+        Should return all of them, sorted by their id"""
+        users = sorted([get_existing_user() for _ in range(5)], key=lambda p: p.user_id)
+
+        pages = list()
+        params = dict(limit=2)
+        while True:
+            response = self.list_users(**params)
+            pages.append(response.json())
+            if "X-Next-Cursor" not in response.headers:
+                break
+            params["after"] = response.headers["X-Next-Cursor"]
+
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert [p for page in pages for p in page] == [p.dict() for p in users]
+
+    def test_list_users_fields(self):
+        """Having multiple users, list only their email.
+        Should return all of them in array, sorted by their id, with only their email and user_id"""
+        users = sorted([get_existing_user() for _ in range(4)], key=lambda p: p.user_id)
+
+        response = self.list_users(fields="email")
+        assert response.json() == [{"user_id": p.user_id, "email": p.email} for p in users]
+
+    def test_stream_users_invalid_fields(self):
+        """Stream the users as NDJSON, with fields that do not exist.
+        Should return validation error 422 and the invalid fields, before starting the stream"""
+        get_existing_user()
+
+        response = self.list_users(
+            statuscode=statuscode.HTTP_422_UNPROCESSABLE_ENTITY,
+            headers={"Accept": NDJSON_MEDIA_TYPE},
+            fields="email,foo"
+        )
+        assert response.json()["identifier"] == "foo"
+
+    def test_list_users_without_admin_token(self):
+        """List the users without a token, and with the session token of a user.
+        Should return unauthorized 401 and forbidden 403"""
+        user = get_existing_user()
+        self.list_users(statuscode=statuscode.HTTP_401_UNAUTHORIZED, headers={"Authorization": ""})
+        self.list_users(statuscode=statuscode.HTTP_403_FORBIDDEN, headers=get_session_headers(user.user_id))
+
+    def test_list_users_without_password(self):
+        """Having an existing user, list the users, and list only their password.
+        Should not return the password, and return validation error 422 for the password field"""
+        get_existing_user()
+        assert all("password" not in user for user in self.list_users().json())
+        response = self.list_users(statuscode=statuscode.HTTP_422_UNPROCESSABLE_ENTITY, fields="password")
+        assert response.json()["identifier"] == "password"
@@ -0,0 +1,53 @@
+"""TEST RENDERER
+Test the render service (process pool)
+"""
+
+# # Native # #
+import os
+import time
+
+# # Installed # #
+import pytest
+
+# # Project # #
+from API_engine.renderer import RenderExecutor
+from API_engine.exceptions import RenderServiceBusyException
+
+
+def render_pid(text: str, path: str):
+    time.sleep(0.2)
+    with open(path, "w") as file:
+        file.write(text)
+    return os.getpid()
+
+
+class TestRenderExecutor:
+    def test_render_many(self, tmp_path):
+        """Render many images at once, on a pool of two processes.
+        Should render all of them, in parallel and outside of the API process, and record their latency"""
+        executor = RenderExecutor(workers=2, queue_size=8, timeout=10, start_method="fork")
+        paths = [str(tmp_path / f"{i}.txt") for i in range(4)]
+        try:
+            pids = executor.render_many(render_pid, [(str(i), path) for i, path in enumerate(paths)])
+        finally:
+            executor.shutdown()
+
+        assert [open(path).read() for path in paths] == ["0", "1", "2", "3"]
+        assert len(set(pids)) == 2 and os.getpid() not in pids
+
+        stats = executor.stats()
+        assert stats["rendered"] == 4
+        assert stats["pending"] == 0
+        assert stats["latency_ms"]["p50"] >= 200
+
+    def test_queue_full(self, tmp_path):
+        """Render an image while another is rendering, on a pool of one process without queue.
+        Should reject the second render"""
+        executor = RenderExecutor(workers=1, queue_size=0, timeout=10, start_method="fork")
+        try:
+            future = executor.submit(render_pid, "0", str(tmp_path / "0.txt"))
+            with pytest.raises(RenderServiceBusyException):
+                executor.render(render_pid, "1", str(tmp_path / "1.txt"))
+            executor.wait([future])
+        finally:
+            executor.shutdown()
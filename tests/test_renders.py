@@ -0,0 +1,112 @@
+"""TEST RENDERS
+Test the cache of rendered images
+"""
+
+# # Native # #
+import os
+import time
+
+# # Installed # #
+import pytest
+
+# # Project # #
+from API_engine.renders import RenderCache
+from API_engine.renderer import render_executor
+from API_engine.repositories import NoteWordsRepository
+
+
+def get_render(content: str = "image", renders: list = None):
+    def render(path: str):
+        if renders is not None:
+            renders.append(path)
+        with open(path, "w") as file:
+            file.write(content)
+    return render
+
+
+class TestRenderCache:
+    def test_render_once(self, tmp_path):
+        """Get the image of the same text twice, and of another text.
+        Should render each text once, and return the same URL for the same text"""
+        cache = RenderCache(str(tmp_path), "http://files/quotes/", max_size=1000, style="style")
+        renders = list()
+
+        url = cache.get("A quote", get_render(renders=renders))
+        assert cache.get("A quote", get_render(renders=renders)) == url
+        assert cache.get("Another quote", get_render(renders=renders)) != url
+
+        assert url.startswith("http://files/quotes/")
+        assert len(renders) == 2
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 2
+
+    def test_style_key(self, tmp_path):
+        """Get the image of the same text with two render styles.
+        Should be cached as different images"""
+        first = RenderCache(str(tmp_path), "", max_size=1000, style="first")
+        second = RenderCache(str(tmp_path), "", max_size=1000, style="second")
+        assert first.get("A quote", get_render()) != second.get("A quote", get_render())
+
+    def test_evict_least_recently_used(self, tmp_path):
+        """Get the images of three texts, on a cache that only fits two, using the first one again before the third.
+        Should remove the image of the second text, and keep the index after loading the cache again"""
+        cache = RenderCache(str(tmp_path), "", max_size=10, style="style")
+        first = cache.get("first", get_render("12345"))
+        second = cache.get("second", get_render("12345"))
+        cache.get("first", get_render("12345"))
+        third = cache.get("third", get_render("12345"))
+
+        assert sorted(os.listdir(tmp_path)) == sorted([first, third])
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["size"] == 10
+
+        loaded = RenderCache(str(tmp_path), "", max_size=10, style="style")
+        loaded.load()
+        assert loaded.stats()["files"] == 2
+
+
+    def test_failed_render_temp_files(self, tmp_path):
+        """Get the images of two texts, failing the render after writing the first one.
+        Should remove the temporary file of the rendered image, and not cache any of them"""
+        cache = RenderCache(str(tmp_path), "", max_size=1000, style="style")
+
+        def render(jobs):
+            get_render()(jobs[0][1])
+            raise TimeoutError()
+
+        with pytest.raises(TimeoutError):
+            cache.get_many(["first", "second"], render)
+        assert os.listdir(tmp_path) == []
+        assert cache.stats()["files"] == 0
+
+    def test_load_stale_temp_files(self, tmp_path):
+        """Load a cache with a cached image, the temporary file of a render that failed long ago, and another
+        of a render in progress. Should index the image, and remove only the stale temporary file"""
+        for name in ("cached.jpg", "stale.jpg.1.tmp", "rendering.jpg.1.tmp"):
+            (tmp_path / name).write_text("12345")
+        stale = time.time() - 120
+        os.utime(tmp_path / "stale.jpg.1.tmp", (stale, stale))
+
+        cache = RenderCache(str(tmp_path), "", max_size=1000, style="style", temp_timeout=60)
+        cache.load()
+        assert sorted(os.listdir(tmp_path)) == ["cached.jpg", "rendering.jpg.1.tmp"]
+        assert cache.stats()["files"] == 1
+
+class TestWordCloudCleanup:
+    def test_keep_renders_in_progress(self, tmp_path, monkeypatch):
+        """Submit the word cloud of a user with a newer version than its cached image, while another render is
+        in progress, and with the temporary file of a render that failed long ago.
+        Should remove the previous image and the stale temporary file, keeping the render in progress"""
+        monkeypatch.chdir(tmp_path)
+        monkeypatch.setattr(NoteWordsRepository, "get", staticmethod(lambda user_id, week=None: {"words": {}, "version": 2}))
+        monkeypatch.setattr(render_executor, "submit", lambda *args: None)
+        folder = tmp_path / "Uploads" / "user"
+        folder.mkdir(parents=True)
+        previous, rendering, failed = "wordcloud-w-1-a.jpg", "wordcloud-w-3-a.jpg.1.tmp", "wordcloud-w-0-a.jpg.1.tmp"
+        for name in (previous, rendering, failed):
+            (folder / name).write_text("image")
+        stale = time.time() - render_executor.timeout - 60
+        os.utime(folder / failed, (stale, stale))
+
+        NoteWordsRepository.submit_wordcloud("user", "name")
+        assert os.listdir(folder) == [rendering]
@@ -0,0 +1,224 @@
+"""TEST ROUND TRIPS
+Count the Mongo commands (round trips) performed by each write endpoint.
+The repositories are called directly, since the testing API runs on another process: the async repositories for the
+routes that use them (on an event loop of the test), and the sync repositories for the routes that generate images,
+the maintenance commands and the workers
+"""
+
+# # Native # #
+import json
+import asyncio
+
+# # Installed # #
+import pytest
+
+# # Project # #
+from API_engine.models import *
+from API_engine.database import doctors, musics, emotions, emotion_weeks, note_words, close_clients
+from API_engine.repositories import *
+from API_engine.async_repositories import *
+from API_engine.utils import get_time
+from API_engine.exceptions import UserFieldRequiredException
+from API_engine.catalog import music_catalog
+
+# # Package # #
+from .base import BaseTest
+from .listeners import count_round_trips
+from .utils import *
+
+
+class TestRoundTrips(BaseTest):
+    @pytest.fixture(autouse=True)
+    def uploads_folder(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "Uploads").mkdir()
+
+    @pytest.fixture(autouse=True)
+    def loop(self):
+        """Event loop of the async repositories. The Motor client is bound to it, so it is closed with the loop"""
+        self.loop = asyncio.new_event_loop()
+        yield self.loop
+        close_clients()
+        self.loop.close()
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    @classmethod
+    def teardown_method(cls):
+        super().teardown_method()
+        for collection in (doctors, musics, emotions, emotion_weeks, note_words):
+            collection.delete_many({})
+
+    def test_create_user(self):
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.create(get_user_create()))
+        assert commands == ["insert"]
+
+    def test_update_user(self):
+        user = get_existing_user()
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.update(user.user_id, UserUpdate(name=get_uuid())))
+        assert commands == ["update"]
+
+    def test_delete_user(self):
+        user = get_existing_user()
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.delete(user.user_id))
+        # The user, and then its emotion buckets, weekly counters and word frequencies
+        assert commands == ["delete", "delete", "delete", "delete"]
+
+    def test_update_emotion(self):
+        """The user is updated and returned at once, then the emotion bucket and weekly counter are written"""
+        user = get_existing_user()
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.update_emotion(user.user_id, "happy"))
+        assert commands == ["findAndModify", "update", "update"]
+
+    def test_update_emotion_by_device(self):
+        device_id = get_uuid()
+        get_existing_user(device_id=device_id)
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.update_emotion(device_id, "happy", device=True))
+        assert commands == ["findAndModify", "update", "update"]
+
+    @pytest.mark.parametrize("buffered", [False, True])
+    def test_update_emotions_batch(self, buffered):
+        """Users and devices are resolved at once, then users, buckets and counters get a bulk write each.
+        The same for the batch route (async) and the write-behind buffer (sync)"""
+        device_id = get_uuid()
+        users = [get_existing_user(), get_existing_user(device_id=device_id)]
+        events = [
+            *[EmotionEvent(user_id=users[0].user_id, emotion="happy") for _ in range(10)],
+            *[EmotionEvent(device_id=device_id, emotion="sad") for _ in range(10)],
+            EmotionEvent(device_id=get_uuid(), emotion="sad")
+        ]
+        with count_round_trips() as commands:
+            if buffered:
+                statuses = UsersRepository.update_emotions(events)
+            else:
+                statuses = self.run(AsyncUsersRepository.update_emotions(events))
+        assert commands == ["find", "update", "update", "update"]
+        assert [status["status"] for status in statuses] == ["ok"] * 20 + ["not_found"]
+
+    def test_backfill_counters(self):
+        """The weeks of each user are replaced (or inserted) with a single bulk write, keeping their ids"""
+        user = get_existing_user()
+        UsersRepository.update_emotion(user.user_id, "happy")
+        week = emotion_weeks.find_one({"user_id": user.user_id})
+        emotion_weeks.update_one({"_id": week["_id"]}, {"$inc": {"counts.happy": 5}})
+
+        with count_round_trips() as commands:
+            EmotionsRepository.backfill_counters()
+        assert commands == ["distinct", "find", "update"]
+        assert emotion_weeks.find_one({"_id": week["_id"]})["counts"] == {"happy": 1}
+
+    def test_add_note(self):
+        """The note is added as pending. Then the notes of the batch are claimed and read, and the notes and users,
+        emotion buckets, weekly counters and word frequencies get a bulk write each"""
+        user = get_existing_user()
+        note = Note(note="I am really happy today", color="red", captured="2020-01-01")
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.add_note(user.user_id, note))
+        assert commands == ["findAndModify"]
+
+        with count_round_trips() as commands:
+            self.run(AsyncUsersRepository.process_notes([user.user_id]))
+        assert commands == ["update", "find", "update", "update", "update", "update"]
+
+    def test_emotion_analysis_cached_wordcloud(self):
+        user = get_existing_user()
+        note = {"user_id": user.user_id, "note": "I am really happy today", "captured_at": get_time()}
+        UsersRepository.update_emotion(user.user_id, "happy")
+        NoteWordsRepository.push_many([note])
+        first = json.loads(UsersRepository.emotion_analysis(user.user_id).body)
+
+        # The word cloud is not rendered again, nor the notes read, if no note was added
+        with count_round_trips() as commands:
+            second = json.loads(UsersRepository.emotion_analysis(user.user_id).body)
+        assert commands == ["find", "find", "find"]
+        assert second["wordcloud"] == first["wordcloud"]
+
+        NoteWordsRepository.push_many([note])
+        third = json.loads(UsersRepository.emotion_analysis(user.user_id).body)
+        assert third["wordcloud"] != first["wordcloud"]
+
+    def test_add_user_profile_pic(self):
+        user = get_existing_user()
+        with count_round_trips() as commands:
+            read = self.run(AsyncUsersRepository.add_profile_pic(get_upload("me.png"), user.user_id))
+        assert commands == ["findAndModify"]
+        assert read.profile_pic.endswith(user.user_id + "/" + user.name + ".png")
+
+    def test_add_user_profile_pic_without_name(self):
+        """The picture is named after the user, so nothing is written if the user has no name"""
+        user = get_existing_user(name=None)
+        with pytest.raises(UserFieldRequiredException):
+            self.run(AsyncUsersRepository.add_profile_pic(get_upload("me.png"), user.user_id))
+        assert UsersRepository.get(user.user_id).profile_pic is None
+
+    def test_add_deepfake_audio_without_pic(self):
+        """The audio is named after the deepfake picture, so nothing is written if there is no picture"""
+        user = get_existing_user()
+        with pytest.raises(UserFieldRequiredException):
+            DeepFakeRepository.add_deepfake_audio(get_upload("voice.wav"), user.user_id)
+        assert UsersRepository.get(user.user_id).deepfake is None
+
+    def test_add_deepfake_pic_and_audio(self):
+        user = get_existing_user()
+        with count_round_trips() as commands:
+            DeepFakeRepository.add_deepfake_pic(get_upload("face.jpg"), "mom", user.user_id)
+            read = DeepFakeRepository.add_deepfake_audio(get_upload("voice.wav"), user.user_id)
+        assert commands == ["findAndModify", "findAndModify"]
+        assert read.deepfake.voice.endswith(user.user_id + "/deepfake/mom.wav")
+
+    def test_create_doctor(self):
+        with count_round_trips() as commands:
+            self.run(AsyncDoctorRepository.create(get_doctor_create()))
+        assert commands == ["insert"]
+
+    def test_add_doctor_profile_pic(self):
+        doctor = DoctorRepository.create(get_doctor_create())
+        with count_round_trips() as commands:
+            self.run(AsyncDoctorRepository.add_profile_pic(get_upload(), doctor.doctor_id))
+        assert commands == ["findAndModify"]
+
+    def test_create_music(self):
+        with count_round_trips() as commands:
+            self.run(AsyncMusicRepository.create(get_music_create()))
+        assert commands == ["insert"]
+
+    def test_update_music(self):
+        music = MusicRepository.create(get_music_create())
+        with count_round_trips() as commands:
+            self.run(AsyncMusicRepository.update(music.music_id, MusicUpdate(number_of_likes=1)))
+        assert commands == ["update"]
+
+    def test_music_catalog(self):
+        """The catalog is read once for many recommendations, and read again after a music is created"""
+        music_catalog.invalidate()
+        created = [MusicRepository.create(get_music_create(cluster=cluster)) for cluster in ("0", "1", "2")]
+
+        with count_round_trips() as commands:
+            first = music_catalog.sample_many([1, 4, 5])
+            music_catalog.sample_many([3, 4, 3])
+        assert commands == ["find"]
+        assert [music["spotify_id"] for music in first] == \
+            [created[0].spotify_id] + [created[1].spotify_id] * 4 + [created[2].spotify_id] * 5
+
+        music = MusicRepository.create(get_music_create(cluster="3"))
+        with count_round_trips() as commands:
+            sampled = music_catalog.sample("3", 2)
+        assert commands == ["find"]
+        assert sampled == [{"spotify_id": music.spotify_id, "name": music.name}] * 2
+
+    def test_music_sample_many(self):
+        """The musics of all the clusters are sampled by a single aggregation, with their spotify_id and name"""
+        for cluster in ("0", "1", "1", "2"):
+            MusicRepository.create(get_music_create(cluster=cluster))
+
+        with count_round_trips() as commands:
+            playlist = MusicRepository.sample_many([1, 2, 1])
+        assert commands == ["aggregate"]
+        assert len(playlist) == 4
+        assert all(set(music) == {"spotify_id", "name"} for music in playlist)
@@ -0,0 +1,105 @@
+"""TEST SESSIONS
+Test the session tokens issued on login, and required by the routes of the users
+"""
+
+# # Installed # #
+import httpx
+import pytest
+from fastapi import status as statuscode
+
+# # Project # #
+from API_engine.sessions import create_token, verify_token
+from API_engine.exceptions import InvalidSessionException
+
+# # Package # #
+from .base import BaseTest
+from .utils import *
+
+
+class TestSessions(BaseTest):
+    def test_login_token(self):
+        """Create a user and login.
+        Should return a session token, that gives access to the user"""
+        create = get_user_create().dict()
+        user_id = self.create_user(create).json()["user_id"]
+
+        response = self.login_user(create["email"], create["password"])
+        token = response.json()["token"]
+        assert verify_token(token) == user_id
+
+        self.get_user(user_id, headers={"Authorization": f"Bearer {token}"})
+
+    def test_login_wrong_password(self):
+        """Create a user and login with another password.
+        Should return 404 and no token"""
+        create = get_user_create().dict()
+        self.create_user(create)
+
+        response = self.login_user(create["email"], get_uuid(), statuscode=statuscode.HTTP_404_NOT_FOUND)
+        assert "token" not in response.json()
+
+    def test_get_user_without_token(self):
+        """Get an existing user without a session token.
+        Should return unauthorized 401"""
+        user = get_existing_user()
+        self.get_user(user.user_id, statuscode=statuscode.HTTP_401_UNAUTHORIZED, headers={"Authorization": ""})
+
+    def test_get_user_tampered_token(self):
+        """Get an existing user with a token of another user, changed to have the id of the user.
+        Should return unauthorized 401"""
+        user = get_existing_user()
+        token, _ = create_token(get_uuid())
+        tampered = ".".join([user.user_id, *token.split(".")[1:]])
+
+        self.get_user(user.user_id, statuscode=statuscode.HTTP_401_UNAUTHORIZED,
+                      headers={"Authorization": f"Bearer {tampered}"})
+
+    def test_get_user_token_of_other_user(self):
+        """Get an existing user with a valid session token of another user.
+        Should return forbidden 403"""
+        user = get_existing_user()
+        self.get_user(user.user_id, statuscode=statuscode.HTTP_403_FORBIDDEN, headers=get_session_headers(get_uuid()))
+
+    def test_token_extended_expiration(self):
+        """Verify a token whose expiration was extended.
+        Should be rejected, as the signature does not match"""
+        token, expires = create_token(get_uuid())
+        user_id, _, signature = token.split(".")
+
+        with pytest.raises(InvalidSessionException):
+            verify_token(f"{user_id}.{expires + 3600}.{signature}")
+
+    def test_update_emotion_without_token(self):
+        """Update the emotion of an existing user without a session token.
+        Should return unauthorized 401, and keep the current emotion of the user"""
+        user = get_existing_user()
+        r = httpx.post(f"{self.api_url}/users/update-emotion",
+                       params={"user_id": user.user_id, "emotion": "happy", "device": "false"})
+        assert r.status_code == statuscode.HTTP_401_UNAUTHORIZED, r.text
+
+        read = self.get_user(user.user_id).json()
+        assert read.get("current_emotion") != "happy"
+
+    def test_update_emotion_by_device_without_token(self):
+        """Update the emotion by an unknown device without a session token.
+        Should not require a session (returns not found 404, as the device is not linked to a user)"""
+        r = httpx.post(f"{self.api_url}/users/update-emotion",
+                       params={"user_id": get_uuid(), "emotion": "happy", "device": "true"})
+        assert r.status_code == statuscode.HTTP_404_NOT_FOUND, r.text
+
+    def test_update_emotions_batch_of_other_user(self):
+        """Apply a batch with emotions of two users, with the session token of one of them.
+        Should return forbidden 403"""
+        user, other = get_existing_user(), get_existing_user()
+        events = [{"user_id": user.user_id, "emotion": "happy"}, {"user_id": other.user_id, "emotion": "sad"}]
+        r = httpx.post(f"{self.api_url}/users/emotions:batch", json=events,
+                       headers=get_session_headers(user.user_id))
+        assert r.status_code == statuscode.HTTP_403_FORBIDDEN, r.text
+
+    @pytest.mark.parametrize("path", ["/therapies/music-recommendation/{}", "/therapies/inspiration/{}"])
+    def test_therapies_without_token(self, path):
+        """Get the therapies of an existing user without a session token.
+        Should return unauthorized 401"""
+        user = get_existing_user()
+        r = httpx.get(self.api_url + path.format(user.user_id))
+        assert r.status_code == statuscode.HTTP_401_UNAUTHORIZED, r.text
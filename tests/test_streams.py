@@ -0,0 +1,119 @@
+"""TEST STREAMS
+Test the WebSocket streams of emotions captured by the devices: batched writes, acknowledgements, invalid frames
+and backpressure. The streams run on a testing app, and their writes are recorded instead of sent to Mongo
+"""
+
+# # Native # #
+import asyncio
+
+# # Installed # #
+import pytest
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+# # Project # #
+from API_engine.streams import stream_emotions
+from API_engine.async_repositories import AsyncUsersRepository
+from API_engine.settings import ingest_settings
+
+# # Package # #
+from .utils import get_uuid
+
+USER_ID = get_uuid()
+
+
+class FakeWebSocket:
+    """WebSocket that receives the given frames, and then disconnects. Counts the frames read by the stream"""
+    def __init__(self, frames: list):
+        self.frames = frames
+        self.received = 0
+        self.sent = list()
+
+    async def receive_json(self):
+        if self.received == len(self.frames):
+            raise WebSocketDisconnect()
+        self.received += 1
+        return self.frames[self.received - 1]
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+    async def close(self, code: int):
+        pass
+
+
+class TestStreams:
+    @pytest.fixture(autouse=True)
+    def writes(self, monkeypatch):
+        """Batches of states written by the streams"""
+        self.writes = list()
+        self.gate = None
+
+        async def apply_emotions(states):
+            if self.gate:
+                await self.gate.wait()
+            self.writes.append(list(states))
+
+        monkeypatch.setattr(AsyncUsersRepository, "apply_emotions", staticmethod(apply_emotions))
+        monkeypatch.setattr(ingest_settings, "stream_batch_size", 2)
+        monkeypatch.setattr(ingest_settings, "stream_batch_interval", 5.0)
+
+    @pytest.fixture
+    def client(self):
+        app = FastAPI()
+
+        @app.websocket("/stream")
+        async def _stream(websocket: WebSocket):
+            await websocket.accept()
+            await stream_emotions(websocket, USER_ID)
+
+        return TestClient(app)
+
+    def test_stream_acks(self, client):
+        """Stream four emotions, with a batch size of two.
+        Should write them in two batches, acknowledging the total written after each one"""
+        with client.websocket_connect("/stream") as websocket:
+            for i in range(4):
+                websocket.send_json({"emotion": "Happy", "captured": i})
+            assert websocket.receive_json() == {"ack": 2}
+            assert websocket.receive_json() == {"ack": 4}
+
+        assert self.writes == [
+            [{"user_id": USER_ID, "emotion": "happy", "captured": i} for i in range(j, j + 2)]
+            for j in (0, 2)
+        ]
+
+    def test_stream_invalid_frames(self, client):
+        """Stream frames that are not JSON, not objects, or without emotion, and then two valid frames.
+        Should reply an error to each invalid frame, keeping the stream open, and write the valid frames"""
+        with client.websocket_connect("/stream") as websocket:
+            websocket.send_text("not json")
+            websocket.send_json(["happy"])
+            websocket.send_json({"emotion": 1})
+            for _ in range(3):
+                assert "error" in websocket.receive_json()
+
+            websocket.send_json({"emotion": "sad", "captured": 1})
+            websocket.send_json({"emotion": "sad", "captured": 2})
+            assert websocket.receive_json() == {"ack": 2}
+
+    def test_stream_backpressure(self, monkeypatch):
+        """Stream ten emotions while the writes are blocked, with a queue of two emotions.
+        Should stop reading frames once the queue is full, and read and write the rest when the writes continue"""
+        monkeypatch.setattr(ingest_settings, "stream_queue_size", 2)
+        monkeypatch.setattr(ingest_settings, "stream_batch_size", 1)
+        websocket = FakeWebSocket([{"emotion": "happy", "captured": i} for i in range(10)])
+
+        async def stream():
+            self.gate = asyncio.Event()
+            task = asyncio.create_task(stream_emotions(websocket, USER_ID))
+            await asyncio.sleep(0.1)
+            # One emotion being written, two queued, and one waiting for the queue
+            assert websocket.received == 4
+
+            self.gate.set()
+            await task
+
+        asyncio.run(stream())
+        assert websocket.received == 10
+        assert [state["captured"] for batch in self.writes for state in batch] == list(range(10))
@@ -3,12 +3,14 @@ Test write actions (create, update, delete)
 """
 
 # # Native # #
-from datetime import datetime
+from datetime import datetime, date
 from random import randint
 
 # # Project # #
-from users_api.models import *
-from users_api.repositories import UsersRepository
+from API_engine.models import *
+from API_engine.repositories import UsersRepository, EmotionsRepository, NoteWordsRepository
+from API_engine.utils import get_time
+from API_engine.database import users, emotions, emotion_weeks, note_words
 
 # # Installed # #
 import pydantic
@@ -31,11 +33,12 @@ class UserAsCreate(UserCreate):
 class TestCreate(BaseTest):
     def test_create_user(self):
         """Create a user.
-        Should return the user"""
+        Should return the user, without its password"""
         create = get_user_create().dict()
 
-        response = self.create_user(create)
-        response_as_create = UserAsCreate(**response.json())
+        response = self.create_user(create).json()
+        assert "password" not in response
+        response_as_create = UserAsCreate(**response, password=create["password"])
         assert response_as_create.dict() == create
 
     def test_create_user_assert_birth_age(self):
@@ -63,6 +66,15 @@ class TestCreate(BaseTest):
         assert response_as_read.birth is None
         assert response_as_read.age is None
 
+    def test_create_user_existing_email(self):
+        """Create a user with the email of an existing user (the email index is unique).
+        Should return already exists 409 error and the email"""
+        user = get_existing_user()
+        create = get_user_create(email=user.email).dict()
+
+        response = self.create_user(create, statuscode=statuscode.HTTP_409_CONFLICT)
+        assert response.json()["identifier"] == user.email
+
     def test_timestamp_created_updated(self):
         """Create a user and assert the created and updated timestamp fields.
         The creation is performed against the UsersRepository,
@@ -87,6 +99,17 @@ class TestDelete(BaseTest):
         self.delete_user(user.user_id)
         self.get_user(user.user_id, statuscode=statuscode.HTTP_404_NOT_FOUND)
 
+    def test_delete_user_emotions_and_words(self):
+        """Delete a user with captured emotions and notes.
+        Should delete its emotion buckets, weekly counters and word frequencies too"""
+        user = get_existing_user()
+        UsersRepository.update_emotion(user.user_id, "happy")
+        NoteWordsRepository.push_many([{"user_id": user.user_id, "note": "A happy day", "captured_at": get_time()}])
+
+        self.delete_user(user.user_id)
+        for collection in (emotions, emotion_weeks, note_words):
+            assert collection.count_documents({"user_id": user.user_id}) == 0
+
     def test_delete_nonexisting_user(self):
         """Delete a user that does not exist.
         Should return not found 404 error and the identifier"""
@@ -149,3 +172,67 @@ class TestUpdate(BaseTest):
         assert read.updated == expected_timestamp
         assert read.updated != read.created
         assert read.created == user.created
+
+
+    def test_update_notes_word_frequencies(self):
+        """Replace the notes of a user twice, with different words.
+        Should replace the word frequencies of the week, increasing their version on each update"""
+        user = get_existing_user()
+        words = list()
+        for text in ("apples bananas", "zebras giraffes"):
+            self.update_user(user.user_id, {"notes": [{"note": text, "color": "red", "captured": str(date.today())}]})
+            words.append(NoteWordsRepository.get(user.user_id))
+
+        assert set(words[0]["words"]) == {"apples", "bananas"}
+        assert set(words[1]["words"]) == {"zebras", "giraffes"}
+        assert words[1]["version"] > words[0]["version"]
+
+class TestMigrateStates(BaseTest):
+    def test_migrate_resumed(self):
+        """Migrate the states of a user, and migrate them again as if the first run was interrupted
+        before removing the states from the user document.
+        Should write the states to their bucket once"""
+        user = get_existing_user()
+        states = [{"emotion": "happy", "captured": 1577836800}, {"emotion": "sad", "captured": 1577836900}]
+        users.update_one({"_id": user.user_id}, {"$set": {"states": states}})
+        assert EmotionsRepository.migrate() == 1
+
+        users.update_one({"_id": user.user_id}, {"$set": {"states": states}})
+        assert EmotionsRepository.migrate() == 1
+
+        assert [Emotion(**state) for state in states] == EmotionsRepository.list(user.user_id)
+        assert users.count_documents({"_id": user.user_id, "states": {"$exists": True}}) == 0
+
+    def test_migrate_resumed_appended_states(self):
+        """Migrate the states of a user, and migrate them again as if the first run was interrupted
+        before removing the states from the user document, and a state of the same day was appended meanwhile.
+        Should write every state to its bucket once, the appended one included"""
+        user = get_existing_user()
+        states = [{"emotion": "happy", "captured": 1577836800}, {"emotion": "sad", "captured": 1577836900}]
+        users.update_one({"_id": user.user_id}, {"$set": {"states": states}})
+        assert EmotionsRepository.migrate() == 1
+
+        appended = {"emotion": "angry", "captured": 1577837000}
+        users.update_one({"_id": user.user_id}, {"$set": {"states": [*states, appended]}})
+        assert EmotionsRepository.migrate() == 1
+
+        assert [Emotion(**state) for state in [*states, appended]] == EmotionsRepository.list(user.user_id)
+        assert users.count_documents({"_id": user.user_id, "states": {"$exists": True}}) == 0
+
+
+class TestMigrateNotes(BaseTest):
+    def test_migrate_notes_partially_migrated(self):
+        """Migrate the notes of a user with a note that has captured_at and two that do not.
+        Should set the captured_at of the notes without it, keeping the existing one"""
+        user = get_existing_user()
+        notes = [
+            {"note": "First", "color": "red", "captured": "2020-06-04", "captured_at": 1},
+            {"note": "Second", "color": "red", "captured": "2021-03-04"},
+            {"note": "Third", "color": "red", "captured": "not a date"},
+        ]
+        users.update_one({"_id": user.user_id}, {"$set": {"notes": notes}})
+        assert UsersRepository.migrate_notes() >= 1
+
+        document = users.find_one({"_id": user.user_id})
+        assert [note["captured_at"] for note in document["notes"]] == [1, 1614816000, None]
+        assert users.count_documents({"_id": user.user_id, "notes": {"$elemMatch": {"captured_at": {"$exists": False}}}}) == 0
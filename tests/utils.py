@@ -3,17 +3,22 @@ Misc helpers/utils functions for tests
 """
 
 # # Native # #
+from io import BytesIO
+from types import SimpleNamespace
 from datetime import datetime
 from random import randint
 
 # # Project # #
-from users_api.models import *
-from users_api.repositories import UsersRepository
-from users_api.utils import get_uuid
+from API_engine.models import *
+from API_engine.repositories import UsersRepository
+from API_engine.sessions import create_token
+from API_engine.settings import session_settings
+from API_engine.utils import get_uuid
 
 __all__ = (
     "get_user_create", "get_existing_user",
-    "get_uuid"
+    "get_doctor_create", "get_music_create", "get_upload",
+    "get_session_headers", "get_admin_headers", "get_uuid"
 )
 
 
@@ -30,6 +35,8 @@ def get_address(**kwargs):
 def get_user_create(**kwargs):
     return UserCreate(**{
         "name": get_uuid(),
+        "email": get_uuid() + "@emoup.com",
+        "password": get_uuid(),
         "address": get_address(),
         "birth": datetime.now().date(),
         **kwargs
@@ -38,3 +45,46 @@ def get_user_create(**kwargs):
 
 def get_existing_user(**kwargs):
     return UsersRepository.create(get_user_create(**kwargs))
+
+
+def get_doctor_create(**kwargs):
+    return DoctorCreate(**{
+        "name": get_uuid(),
+        "gender": "Female",
+        "mobile": randint(1000000000, 9999999999),
+        "degree": get_uuid(),
+        "consultation_place": get_uuid(),
+        "about_doctor": get_uuid(),
+        "services_provided": get_uuid(),
+        "address": get_uuid(),
+        "latitude": 22.7,
+        "longitude": 75.8,
+        "ratings": 4.5,
+        **kwargs
+    })
+
+
+def get_music_create(**kwargs):
+    return MusicCreate(**{
+        "name": get_uuid(),
+        "spotify_id": get_uuid(),
+        "cluster": str(randint(0, 2)),
+        "number_of_likes": randint(0, 100),
+        **kwargs
+    })
+
+
+def get_upload(filename: str = "file.jpg"):
+    """Fake uploaded file, with the attributes of FastAPI UploadFile used by the repositories"""
+    return SimpleNamespace(filename=filename, file=BytesIO(get_uuid().encode()))
+
+
+def get_session_headers(user_id: str) -> dict:
+    """Authorization header with a session token of the user (the tests share the session secret with the API)"""
+    token, _ = create_token(user_id)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def get_admin_headers() -> dict:
+    """Authorization header with the admin token (the tests share the session settings with the API)"""
+    return {"Authorization": f"Bearer {session_settings.admin_token}"}